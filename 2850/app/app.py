@@ -1,20 +1,22 @@
 # app/app.py
 # -*- coding: utf-8 -*-
 import os
-import time
 from pathlib import Path
-from urllib.parse import quote_plus
 from typing import Optional
+from urllib.parse import quote_plus
 
-import requests
-from bs4 import BeautifulSoup
-from fastapi import FastAPI, Request, APIRouter
+from fastapi import FastAPI, Request, APIRouter, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
 from starlette.staticfiles import StaticFiles
 
 # ===== Import routers (dùng tuyệt đối để ổn định) =====
 from app.routes import user, family, submission, plan, meal_code, message, wheel, preferences
+from app.database import pool_stats, begin_request_scope, last_write_at, close_async_pool
+from app import image_cache, image_proxy, plan_summary
+from app.config import IMAGE_PROXY_CONFIG, DB_ROUTING_CONFIG
+from app.image_scraper import resolve_dish_image, resolve_many
+from app.models import ImageBatchRequest
 
 # =====================================================================
 # FastAPI app
@@ -28,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Before-Id", "ETag"],  # FE đọc được cursor phân trang plan
 )
 
 # ---------- Static mount ----------
@@ -38,6 +41,26 @@ if PAGE_DIR.exists():
 elif Path("page").exists():
     app.mount("/page", StaticFiles(directory="page", html=False), name="page")
 
+# ---------- DB read-your-writes scope (read/write split) ----------
+# Mốc ghi cuối của client đi qua cookie -> request đọc ngay sau request ghi (vd regenerate rồi
+# mở plan, vote rồi GET /wheel/state) vẫn đọc primary trong cửa sổ read_your_writes.
+@app.middleware("http")
+async def db_request_scope(request: Request, call_next):
+    cookie = DB_ROUTING_CONFIG["cookie"]
+    try:
+        seen = float(request.cookies.get(cookie) or 0)
+    except ValueError:
+        seen = 0.0
+    begin_request_scope(seen)
+    response = await call_next(request)
+    wrote = last_write_at()
+    if wrote > seen:
+        response.set_cookie(
+            cookie, f"{wrote:.3f}", max_age=max(1, int(DB_ROUTING_CONFIG["read_your_writes"])),
+            httponly=True, samesite="lax",
+        )
+    return response
+
 # =====================================================================
 # Include routers
 #  Quy ước: prefix đặt HẾT ở đây.
@@ -63,7 +86,8 @@ def health():
 
 @app.get("/api/health")
 def api_health_alias():
-    return {"ok": True}
+    return {"ok": True, "llm_cache": plan.LLM_CACHE.stats(), "db_pool": pool_stats(),
+            "db_replica_pool": pool_stats(replica=True), "image_cache": image_cache.stats()}
 
 @app.get("/")
 def root():
@@ -74,126 +98,6 @@ def root():
         return RedirectResponse(url="/page/index.html", status_code=302)
     return {"message": "Meal Planner API is running."}
 
-# =====================================================================
-# Helpers & Scraper (NO DB, NO SLUG)
-# =====================================================================
-def _is_https(u: Optional[str]) -> bool:
-    return bool(u) and str(u).strip().lower().startswith("https://")
-
-def _first_non_empty(*vals: Optional[str]) -> Optional[str]:
-    for v in vals:
-        if isinstance(v, str) and v.strip():
-            return v.strip()
-    return None
-
-# ---- In-memory cache (name -> (expire_ts, url)) ----
-_IMG_CACHE: dict[str, tuple[float, str]] = {}
-_IMG_CACHE_TTL = 60 * 60 * 24 * 7  # 7 ngày
-
-def _cache_get(name: str) -> Optional[str]:
-    key = (name or "").lower().strip()
-    rec = _IMG_CACHE.get(key)
-    if not rec:
-        return None
-    exp, url = rec
-    if time.time() > exp:
-        _IMG_CACHE.pop(key, None)
-        return None
-    return url
-
-def _cache_put(name: str, url: str) -> None:
-    key = (name or "").lower().strip()
-    if key and url:
-        _IMG_CACHE[key] = (time.time() + _IMG_CACHE_TTL, url)
-
-def _wiki_thumb(name: str) -> Optional[str]:
-    q = (name or "").strip()
-    if not q:
-        return None
-
-    # vi.wikipedia
-    vi_url = (
-        "https://vi.wikipedia.org/w/api.php"
-        f"?action=query&titles={quote_plus(q)}&prop=pageimages"
-        "&format=json&pithumbsize=800&redirects=1"
-    )
-    try:
-        r = requests.get(vi_url, timeout=6)
-        j = r.json()
-        pages = j.get("query", {}).get("pages", {})
-        for p in pages.values():
-            src = (p or {}).get("thumbnail", {}).get("source")
-            if _is_https(src):
-                return src
-    except Exception:
-        pass
-
-    # en.wikipedia
-    en_url = (
-        "https://en.wikipedia.org/w/api.php"
-        f"?action=query&titles={quote_plus(q)}&prop=pageimages"
-        "&format=json&pithumbsize=800&redirects=1"
-    )
-    try:
-        r = requests.get(en_url, timeout=6)
-        j = r.json()
-        pages = j.get("query", {}).get("pages", {})
-        for p in pages.values():
-            src = (p or {}).get("thumbnail", {}).get("source")
-            if _is_https(src):
-                return src
-    except Exception:
-        pass
-
-    return None
-
-def _duckduckgo_first_result_url(q: str) -> Optional[str]:
-    try:
-        url = f"https://duckduckgo.com/html/?q={quote_plus(q)}"
-        r = requests.get(url, timeout=8, headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(r.text, "html.parser")
-        a = soup.select_one("a.result__a")
-        if a and a.get("href"):
-            return a["href"]
-    except Exception:
-        pass
-    return None
-
-def _page_og_image(url: str) -> Optional[str]:
-    try:
-        r = requests.get(url, timeout=8, headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(r.text, "html.parser")
-        meta = soup.find("meta", property="og:image") or soup.find("meta", attrs={"name": "og:image"})
-        if meta:
-            src = _first_non_empty(meta.get("content"), meta.get("value"))
-            if _is_https(src):
-                return src
-        # Fallback: <img> lớn
-        for img in soup.find_all("img"):
-            src = img.get("src") or img.get("data-src")
-            if not _is_https(src):
-                continue
-            w = (img.get("width") or "").strip()
-            h = (img.get("height") or "").strip()
-            if (w.isdigit() and int(w) >= 400) or (h.isdigit() and int(h) >= 300):
-                return src
-    except Exception:
-        pass
-    return None
-
-def _scrape_dish_image(name: str) -> Optional[str]:
-    wiki = _wiki_thumb(name)
-    if _is_https(wiki):
-        return wiki
-    for q in (f"{name} món ăn", f"{name} recipe"):
-        link = _duckduckgo_first_result_url(q)
-        if not link:
-            continue
-        og = _page_og_image(link)
-        if _is_https(og):
-            return og
-    return None
-
 # =====================================================================
 # ENDPOINTS ẢNH MÓN ĂN (KHÔNG DÙNG SLUG, KHÔNG DÙNG DB)
 # =====================================================================
@@ -204,13 +108,9 @@ def scrape_image_for_dish(name: str):
     n = (name or "").strip()
     if not n:
         return {"src": "/page/images/dishes/placeholder.jpg"}
-    cached = _cache_get(n)
-    if cached:
-        return {"src": cached}
-    src = _scrape_dish_image(n)
-    if not _is_https(src):
+    src = resolve_dish_image(n)
+    if not src:
         src = f"https://source.unsplash.com/640x400/?{quote_plus(n + ' dish food')}"
-    _cache_put(n, src)
     return {"src": src}
 
 @images_router.get("/dish")
@@ -218,18 +118,14 @@ def api_images_dish(name: str, square: int = 512):
     n = (name or "").strip()
     if not n:
         return {"src": "/page/images/dishes/placeholder.jpg"}
-    cached = _cache_get(n)
-    if cached:
-        return {"src": cached}
-    src = _scrape_dish_image(n)
-    if not _is_https(src):
+    src = resolve_dish_image(n)
+    if not src:
         try:
             s = int(square)
         except Exception:
             s = 512
         s = min(max(s, 64), 1600)
         src = f"https://source.unsplash.com/{s}x{s}/?{quote_plus(n + ' dish food')}"
-    _cache_put(n, src)
     return {"src": src}
 
 @images_router.get("/for-dish")
@@ -237,11 +133,8 @@ def api_images_for_dish(name: str, w: int = 640, h: int = 400):
     n = (name or "").strip()
     if not n:
         return {"src": "/page/images/dishes/placeholder.jpg"}
-    cached = _cache_get(n)
-    if cached:
-        return {"src": cached}
-    src = _scrape_dish_image(n)
-    if not _is_https(src):
+    src = resolve_dish_image(n)
+    if not src:
         try:
             w = int(w); h = int(h)
         except Exception:
@@ -249,9 +142,82 @@ def api_images_for_dish(name: str, w: int = 640, h: int = 400):
         w = min(max(w, 64), 1920)
         h = min(max(h, 64), 1080)
         src = f"https://source.unsplash.com/{w}x{h}/?{quote_plus(n + ' dish food')}"
-    _cache_put(n, src)
     return {"src": src}
 
+@images_router.post("/batch")
+def api_images_batch(req: ImageBatchRequest):
+    """
+    Nhiều món 1 request: {"names": [...]} hoặc {"plan_id": 123} (mọi món của plan đã lưu).
+    Trả {"images": {name: src}}; món không có ảnh -> fallback unsplash vuông như /dish.
+    """
+    names = list(req.names or [])
+    if req.plan_id is not None:
+        summary = plan_summary.load_many([req.plan_id]).get(int(req.plan_id))
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Plan not found")
+        names.extend(summary["dish_names"])
+    if len(names) > 200:
+        raise HTTPException(status_code=400, detail="Too many names (max 200)")
+
+    s = min(max(int(req.square or 512), 64), 1600)
+    thumb = req.thumb_w is not None or req.thumb_h is not None
+    images = {}
+    for n, src in resolve_many(names).items():
+        if src and thumb:
+            images[n] = _thumb_url(n, src, req.thumb_w, req.thumb_h)
+        else:
+            images[n] = src or f"https://source.unsplash.com/{s}x{s}/?{quote_plus(n + ' dish food')}"
+    return {"images": images}
+
+_THUMB_VERSION_LEN = 16
+
+def _thumb_url(name: str, src: str, w: Optional[int], h: Optional[int]) -> str:
+    # v = khoá nội dung ảnh nguồn: tên món resolve sang ảnh khác -> URL khác -> cache trình duyệt không bị cũ
+    v = image_proxy.source_key(src)[:_THUMB_VERSION_LEN]
+    url = f"/api/images/thumb?name={quote_plus(name)}&v={v}"
+    if w is not None:
+        url += f"&w={image_proxy.snap_size(w)}"
+    if h is not None:
+        url += f"&h={image_proxy.snap_size(h)}"
+    return url
+
+@images_router.get("/thumb")
+def api_images_thumb(request: Request, name: str, w: Optional[int] = 512, h: Optional[int] = None,
+                     v: Optional[str] = None):
+    """
+    Thumbnail WebP (JPEG nếu client không nhận WebP) của ảnh món, resize + cache trên đĩa.
+    Chỉ nhận tên món (resolve qua cache/scraper), không nhận URL -> không thành open proxy.
+    `v` (do /batch sinh) = khoá nội dung ảnh nguồn: khớp -> Cache-Control dài; thiếu / lệch -> ngắn.
+    Không có ảnh -> redirect placeholder (cache ngắn để lần sau thử lại).
+    """
+    n = (name or "").strip()
+    src = resolve_dish_image(n) if n else None
+    got = None
+    if src:
+        webp = "image/webp" in (request.headers.get("accept") or "")
+        try:
+            got = image_proxy.thumbnail(src, image_proxy.snap_size(w), image_proxy.snap_size(h), webp=webp)
+        except Exception:
+            got = None
+    if got is None:
+        return RedirectResponse(
+            url="/page/images/dishes/placeholder.jpg",
+            status_code=302,
+            headers={"Cache-Control": "public, max-age=300"},
+        )
+    path, media_type, key = got
+    etag = f'"{key}"'
+    versioned = bool(v) and len(v) == _THUMB_VERSION_LEN and image_proxy.source_key(src).startswith(v)
+    max_age = IMAGE_PROXY_CONFIG["max_age"] if versioned else IMAGE_PROXY_CONFIG["name_max_age"]
+    headers = {
+        "Cache-Control": f"public, max-age={max_age}",
+        "ETag": etag,
+        "Vary": "Accept",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(str(path), media_type=media_type, headers=headers)
+
 app.include_router(images_router)
 
 # =====================================================================
@@ -276,6 +242,10 @@ async def _print_routes():
     except Exception:
         pass
 
+@app.on_event("shutdown")
+async def _close_async_db_pool():
+    await close_async_pool()
+
 # =====================================================================
 # Uvicorn launcher (local)
 # =====================================================================
@@ -0,0 +1,389 @@
+"""
+Generic caching utilities (in-memory LRU + TTL, optional persistent store)
+
+- LRUTTLCache: cache trong RAM, thread-safe, có TTL và evict theo LRU.
+- SQLiteStore / MySQLStore: lớp lưu bền (dùng chung giữa các worker/process). Mỗi dòng có
+  last_access; sweep() xoá dòng hết hạn và dòng ít dùng nhất vượt max_rows của namespace.
+- TieredCache: RAM trước, store sau; đếm hit/miss cho /api/health; sweep store định kỳ khi set.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("meal")
+
+_MISSING = object()
+
+
+def content_key(*parts: Any) -> str:
+    """Khoá content-addressed: sha256 của JSON (sort_keys) các phần đầu vào."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """In-memory LRU cache with per-entry TTL (seconds, None = never expires)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Persistent key/value store on a local SQLite file (shared by workers on the same host)."""
+
+    _SWEEP_BATCH = 1000
+
+    def __init__(self, path: str, table: str = "kv_cache"):
+        self.path = str(path)
+        self.table = table
+        self._lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " namespace TEXT NOT NULL,"
+                " cache_key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL,"
+                " last_access REAL,"
+                " PRIMARY KEY (namespace, cache_key))"
+            )
+            # bảng tạo từ bản cũ chưa có last_access
+            cols = {r[1] for r in self._conn.execute(f"PRAGMA table_info({self.table})")}
+            if "last_access" not in cols:
+                self._conn.execute(f"ALTER TABLE {self.table} ADD COLUMN last_access REAL")
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.table}_lru ON {self.table} (namespace, last_access)"
+            )
+            self._conn.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE namespace=? AND cache_key=?",
+                (namespace, key),
+            ).fetchone()
+            if not row:
+                return None
+            if row[1] is not None and row[1] <= time.time():
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE namespace=? AND cache_key=?", (namespace, key)
+                )
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access=? WHERE namespace=? AND cache_key=?",
+                (time.time(), namespace, key),
+            )
+            self._conn.commit()
+            return row[0]
+
+    def set(self, namespace: str, key: str, value: str, expires_at: Optional[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (namespace, cache_key, value, expires_at, last_access)"
+                " VALUES (?,?,?,?,?)",
+                (namespace, key, value, expires_at, time.time()),
+            )
+            self._conn.commit()
+
+    def sweep(self, namespace: str, max_rows: Optional[int] = None) -> int:
+        """Xoá dòng hết hạn + dòng ít dùng nhất vượt max_rows; trả số dòng đã xoá."""
+        with self._lock:
+            removed = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE namespace=? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (namespace, time.time()),
+            ).rowcount
+            if max_rows:
+                (count,) = self._conn.execute(
+                    f"SELECT COUNT(*) FROM {self.table} WHERE namespace=?", (namespace,)
+                ).fetchone()
+                excess = count - int(max_rows)
+                if excess > 0:
+                    removed += self._conn.execute(
+                        f"DELETE FROM {self.table} WHERE namespace=? AND cache_key IN ("
+                        f" SELECT cache_key FROM {self.table} WHERE namespace=?"
+                        " ORDER BY COALESCE(last_access, 0) ASC LIMIT ?)",
+                        (namespace, namespace, excess),
+                    ).rowcount
+            self._conn.commit()
+            return removed
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE namespace=? AND cache_key=?", (namespace, key)
+            )
+            self._conn.commit()
+
+
+class MySQLStore:
+    """Persistent key/value store on the app's MySQL pool (shared by every worker/host)."""
+
+    def __init__(self, table: str = "kv_cache"):
+        self.table = table
+        self._ready = False
+
+    def _ensure_table(self) -> None:
+        if self._ready:
+            return
+        from .database import db_execute
+        db_execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+              namespace VARCHAR(64) NOT NULL,
+              cache_key CHAR(64) NOT NULL,
+              value MEDIUMTEXT NOT NULL,
+              expires_at DOUBLE NULL,
+              last_access DOUBLE NULL,
+              PRIMARY KEY (namespace, cache_key),
+              KEY idx_kv_lru (namespace, last_access)
+            ) DEFAULT CHARSET=utf8mb4
+            """
+        )
+        # bảng tạo từ bản cũ chưa có last_access (1060 = cột đã có, 1061 = index đã có)
+        for ddl in (
+            f"ALTER TABLE {self.table} ADD COLUMN last_access DOUBLE NULL",
+            f"ALTER TABLE {self.table} ADD KEY idx_kv_lru (namespace, last_access)",
+        ):
+            try:
+                db_execute(ddl)
+            except Exception as e:
+                msg = str(e)
+                if "1060" not in msg and "1061" not in msg and "Duplicate" not in msg:
+                    raise
+        self._ready = True
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        from .database import db_query
+        self._ensure_table()
+        rows = db_query(
+            f"SELECT value, expires_at FROM {self.table} WHERE namespace=%s AND cache_key=%s",
+            (namespace, key),
+        )
+        if not rows:
+            return None
+        exp = rows[0].get("expires_at")
+        if exp is not None and float(exp) <= time.time():
+            self.delete(namespace, key)
+            return None
+        from .database import db_execute
+        db_execute(
+            f"UPDATE {self.table} SET last_access=%s WHERE namespace=%s AND cache_key=%s",
+            (time.time(), namespace, key),
+        )
+        return rows[0]["value"]
+
+    def set(self, namespace: str, key: str, value: str, expires_at: Optional[float]) -> None:
+        from .database import db_execute
+        self._ensure_table()
+        db_execute(
+            f"""
+            INSERT INTO {self.table} (namespace, cache_key, value, expires_at, last_access)
+            VALUES (%s,%s,%s,%s,%s)
+            ON DUPLICATE KEY UPDATE value=VALUES(value), expires_at=VALUES(expires_at),
+                                    last_access=VALUES(last_access)
+            """,
+            (namespace, key, value, expires_at, time.time()),
+        )
+
+    def sweep(self, namespace: str, max_rows: Optional[int] = None) -> int:
+        """Xoá dòng hết hạn + dòng ít dùng nhất vượt max_rows; trả số dòng đã xoá."""
+        from .database import db_query, db_execute
+        self._ensure_table()
+        removed = db_execute(
+            f"DELETE FROM {self.table} WHERE namespace=%s AND expires_at IS NOT NULL AND expires_at <= %s",
+            (namespace, time.time()),
+        ) or 0
+        if max_rows:
+            rows = db_query(
+                f"SELECT COUNT(*) AS n FROM {self.table} WHERE namespace=%s", (namespace,), primary=True
+            )
+            excess = int(rows[0]["n"]) - int(max_rows) if rows else 0
+            if excess > 0:
+                removed += db_execute(
+                    f"DELETE FROM {self.table} WHERE namespace=%s ORDER BY last_access ASC LIMIT %s",
+                    (namespace, excess),
+                ) or 0
+        return removed
+
+    def delete(self, namespace: str, key: str) -> None:
+        from .database import db_execute
+        self._ensure_table()
+        db_execute(f"DELETE FROM {self.table} WHERE namespace=%s AND cache_key=%s", (namespace, key))
+
+
+def make_store(backend: str, path: Optional[str] = None):
+    """
+    backend: 'memory' | 'sqlite' | 'mysql'  -> None (chỉ RAM) hoặc store tương ứng.
+    Store không khởi tạo được -> log cảnh báo, chạy chỉ với RAM.
+    """
+    backend = (backend or "memory").strip().lower()
+    try:
+        if backend == "sqlite":
+            return SQLiteStore(path or "cache/cache.sqlite3")
+        if backend == "mysql":
+            return MySQLStore()
+    except Exception as e:
+        logger.warning("Cache store '%s' unavailable, using memory only: %s", backend, e)
+    return None
+
+
+class TieredCache:
+    """
+    RAM (LRUTTLCache) -> store bền (tuỳ chọn). Giá trị phải JSON-serializable.
+    Lỗi của store không bao giờ làm hỏng request: chỉ log và coi như miss.
+    """
+
+    # Sweep store sau mỗi N lần set hoặc khi lần sweep trước đã quá N giây
+    SWEEP_EVERY_SETS = 200
+    SWEEP_EVERY_SECONDS = 600
+
+    def __init__(self, namespace: str, maxsize: int = 1024, ttl: Optional[float] = None,
+                 store=None, enabled: bool = True, max_rows: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.store = store
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.memory = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._sets_since_sweep = 0
+        self._last_sweep = time.monotonic()
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count("hits")
+            return value
+        if self.store is not None:
+            try:
+                raw = self.store.get(self.namespace, key)
+            except Exception as e:
+                logger.warning("Cache store get failed (%s): %s", self.namespace, e)
+                raw = None
+            if raw is not None:
+                try:
+                    value = json.loads(raw)
+                except ValueError as e:
+                    # dòng hỏng / bị cắt -> xoá và coi như miss, không làm hỏng request
+                    logger.warning("Cache store value corrupt (%s/%s), dropping: %s", self.namespace, key, e)
+                    self.delete(key)
+                else:
+                    self.memory.set(key, value)
+                    self._count("store_hits")
+                    return value
+        self._count("misses")
+        return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl)
+        if self.store is not None:
+            try:
+                expires_at = time.time() + ttl if ttl else None
+                self.store.set(self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            except Exception as e:
+                logger.warning("Cache store set failed (%s): %s", self.namespace, e)
+            self._maybe_sweep()
+
+    def _maybe_sweep(self) -> None:
+        with self._lock:
+            self._sets_since_sweep += 1
+            due = (self._sets_since_sweep >= self.SWEEP_EVERY_SETS
+                   or time.monotonic() - self._last_sweep >= self.SWEEP_EVERY_SECONDS)
+            if not due:
+                return
+            self._sets_since_sweep = 0
+            self._last_sweep = time.monotonic()
+        self.sweep()
+
+    def sweep(self) -> int:
+        """Dọn store: dòng hết hạn + dòng ít dùng nhất vượt max_rows (RAM đã tự giới hạn bằng LRU)."""
+        if self.store is None or not hasattr(self.store, "sweep"):
+            return 0
+        try:
+            removed = self.store.sweep(self.namespace, self.max_rows)
+        except Exception as e:
+            logger.warning("Cache store sweep failed (%s): %s", self.namespace, e)
+            return 0
+        with self._lock:
+            self.evicted += removed
+        return removed
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.store is not None:
+            try:
+                self.store.delete(self.namespace, key)
+            except Exception as e:
+                logger.warning("Cache store delete failed (%s): %s", self.namespace, e)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.store_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.store).__name__ if self.store is not None else "memory",
+            "size": len(self.memory),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "max_rows": self.max_rows,
+            "evicted": self.evicted,
+            "hit_ratio": round((self.hits + self.store_hits) / total, 3) if total else 0.0,
+        }
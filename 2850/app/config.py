@@ -14,6 +14,34 @@ os.environ.setdefault('OPENAI_API_KEY', 'sk-OXQbbXXNnri4PxQFE3D0B04dF84f4fE1872a
 os.environ.setdefault('OPENAI_BASE_URL', 'https://api.v3.cm/v1/')
 os.environ.setdefault('OPENAI_MODEL', 'gpt-4o-mini')
 os.environ.setdefault('DEBUG_LLM', 'false')
+os.environ.setdefault('LLM_MAX_WORKERS', '4')
+os.environ.setdefault('LLM_PLAN_DEADLINE', '60')
+os.environ.setdefault('LLM_CACHE_BACKEND', 'sqlite')
+os.environ.setdefault('LLM_CACHE_TTL', str(30 * 24 * 3600))
+os.environ.setdefault('LLM_CACHE_SIZE', '2000')
+os.environ.setdefault('PLAN_JOB_WORKERS', '2')
+os.environ.setdefault('PLAN_CODEC', 'z1')
+os.environ.setdefault('IMAGE_CACHE_BACKEND', 'sqlite')
+# Reset session (COM_RESET_CONNECTION) mỗi lần trả connection về pool sẽ xoá luôn
+# prepared statement đã cache và tốn thêm 1 round-trip. App không dùng biến session /
+# bảng tạm, còn db_transaction() tự commit / rollback transaction của nó -> mặc định tắt.
+os.environ.setdefault('DB_POOL_RESET_SESSION', 'false')
+os.environ.setdefault('DB_POOL_SIZE', '10')
+os.environ.setdefault('DB_POOL_MAX_OVERFLOW', '10')
+os.environ.setdefault('DB_POOL_TIMEOUT', '5')
+os.environ.setdefault('DB_POOL_MAX_WAITERS', '100')
+os.environ.setdefault('DB_READ_YOUR_WRITES', '10')
+os.environ.setdefault('DB_ASYNC_ENABLED', 'true')
+os.environ.setdefault('DB_ASYNC_POOL_SIZE', '10')
+
+# Nén plans.plan_json / model_raw khi lưu (app/plan_codec.py)
+PLAN_CODEC_CONFIG = {
+    # 'z1' = zlib, 'zs1' = zstd (cần `zstandard`, thiếu thì dùng zlib), 'none' = lưu JSON thường
+    'codec': os.environ.get('PLAN_CODEC', 'z1').lower(),
+    # Chỉ nén payload từ N byte trở lên
+    'min_size': 512,
+    'level': 6,
+}
 
 # Database configuration
 DB_CONFIG = {
@@ -26,8 +54,47 @@ DB_CONFIG = {
     'collation': 'utf8mb4_unicode_ci',
     'autocommit': True,
     'pool_name': 'meal_planner_pool',
-    'pool_size': 10,
-    'pool_reset_session': True
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'pool_reset_session': os.environ.get('DB_POOL_RESET_SESSION', 'false').lower() == 'true'
+}
+
+# Read replica (tuỳ chọn): đặt DB_REPLICA_HOST để db_query/db_iter đọc từ replica.
+# Các giá trị còn lại mặc định giống primary.
+DB_REPLICA_CONFIG = {
+    **DB_CONFIG,
+    'host': os.environ.get('DB_REPLICA_HOST'),
+    'port': int(os.environ.get('DB_REPLICA_PORT') or os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_REPLICA_USER') or os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_REPLICA_PASSWORD') or os.environ.get('DB_PASSWORD'),
+    'database': os.environ.get('DB_REPLICA_NAME') or os.environ.get('DB_NAME'),
+    'pool_name': 'meal_planner_replica_pool',
+    'pool_size': int(os.environ.get('DB_REPLICA_POOL_SIZE') or os.environ.get('DB_POOL_SIZE', 10)),
+} if os.environ.get('DB_REPLICA_HOST') else None
+
+DB_ROUTING_CONFIG = {
+    # Sau khi ghi, các lần đọc của cùng client (request/thread + cookie) đi primary trong N giây
+    'read_your_writes': float(os.environ.get('DB_READ_YOUR_WRITES', 10)),
+    # Cookie mang mốc ghi cuối giữa các request của cùng client
+    'cookie': os.environ.get('DB_READ_YOUR_WRITES_COOKIE', 'meal_last_write'),
+}
+
+# aiomysql pool (database.db_query_async / db_execute_async, page/services/preferences.py)
+DB_ASYNC_CONFIG = {
+    'enabled': os.environ.get('DB_ASYNC_ENABLED', 'true').lower() == 'true',
+    'minsize': 1,
+    'maxsize': int(os.environ.get('DB_ASYNC_POOL_SIZE', 10)),
+    # Đóng/mở lại connection cũ hơn N giây (tránh wait_timeout của MySQL)
+    'pool_recycle': 3600,
+}
+
+# Pool wrapper (database.ConnectionPool): hàng đợi khi pool bận, overflow
+DB_POOL_CONFIG = {
+    # Số connection mượn thêm ngoài pool_size khi quá tải (đóng hẳn khi trả)
+    'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+    # Số giây tối đa chờ connection trước khi báo lỗi
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    # Số request tối đa cùng chờ; vượt quá -> lỗi ngay
+    'max_waiters': int(os.environ.get('DB_POOL_MAX_WAITERS', 100)),
 }
 
 # OpenAI configuration
@@ -35,7 +102,73 @@ OPENAI_CONFIG = {
     'api_key': os.environ.get('OPENAI_API_KEY'),
     'base_url': os.environ.get('OPENAI_BASE_URL'),
     'model': os.environ.get('OPENAI_MODEL'),
-    'debug': os.environ.get('DEBUG_LLM', 'false').lower() == 'true'
+    'debug': os.environ.get('DEBUG_LLM', 'false').lower() == 'true',
+    # Số request recipe chạy song song tối đa (pool dùng chung cho mọi plan)
+    'max_workers': int(os.environ.get('LLM_MAX_WORKERS', 4)),
+    # Hạn chót (giây) cho toàn bộ các lượt gọi recipe của một plan
+    'plan_deadline': float(os.environ.get('LLM_PLAN_DEADLINE', 60)),
+}
+
+# LLM response cache (recipe chính xác + danh sách món theo theme)
+LLM_CACHE_CONFIG = {
+    # 'off' | 'memory' | 'sqlite' | 'mysql'
+    'backend': os.environ.get('LLM_CACHE_BACKEND', 'sqlite'),
+    'path': os.environ.get('LLM_CACHE_PATH', 'cache/llm_cache.sqlite3'),
+    'ttl': float(os.environ.get('LLM_CACHE_TTL', 30 * 24 * 3600)),
+    'maxsize': int(os.environ.get('LLM_CACHE_SIZE', 2000)),
+    # Số dòng tối đa trong store bền (sqlite/mysql); vượt thì xoá dòng ít dùng nhất
+    'max_rows': int(os.environ.get('LLM_CACHE_MAX_ROWS', 20000)),
+}
+
+# Dish image cache (app/image_cache.py): tên món -> URL ảnh, dùng chung giữa các worker
+IMAGE_CACHE_CONFIG = {
+    # 'off' | 'memory' | 'sqlite' | 'mysql'
+    'backend': os.environ.get('IMAGE_CACHE_BACKEND', 'sqlite'),
+    'path': os.environ.get('IMAGE_CACHE_PATH', 'cache/image_cache.sqlite3'),
+    'ttl': float(os.environ.get('IMAGE_CACHE_TTL', 7 * 24 * 3600)),
+    # Món không tìm được ảnh: nhớ ngắn hơn rồi thử lại
+    'negative_ttl': float(os.environ.get('IMAGE_CACHE_NEGATIVE_TTL', 24 * 3600)),
+    # Lượt scrape hết giờ / nguồn lỗi: chỉ chặn scrape lại trong thời gian ngắn
+    'error_ttl': float(os.environ.get('IMAGE_CACHE_ERROR_TTL', 300)),
+    'maxsize': int(os.environ.get('IMAGE_CACHE_SIZE', 5000)),
+    # Số dòng tối đa trong store bền dùng chung (gồm cả negative); vượt thì xoá dòng ít dùng nhất
+    'max_rows': int(os.environ.get('IMAGE_CACHE_MAX_ROWS', 50000)),
+}
+
+# Scrape ảnh món (app/image_scraper.py): các nguồn chạy song song, 1 hạn chót chung
+IMAGE_SCRAPER_CONFIG = {
+    'workers': int(os.environ.get('IMAGE_SCRAPER_WORKERS', 16)),
+    # Tổng số giây tối đa cho 1 lượt scrape (mọi nguồn)
+    'deadline': float(os.environ.get('IMAGE_SCRAPER_DEADLINE', 10)),
+    # Số món scrape song song trong 1 lượt batch (/api/images/batch, pre-warm)
+    'batch_workers': int(os.environ.get('IMAGE_SCRAPER_BATCH_WORKERS', 4)),
+    # Tìm ảnh cho mọi món ở background ngay khi plan được lưu (generate / regenerate / ingest)
+    'prewarm': os.environ.get('IMAGE_PREWARM', 'true').lower() == 'true',
+    # Ghi luôn ảnh tìm được vào dishes[].image_url của plan_json
+    'prewarm_write_back': os.environ.get('IMAGE_PREWARM_WRITE_BACK', 'false').lower() == 'true',
+}
+
+# Image proxy (app/image_proxy.py): thumbnail WebP/JPEG cache trên đĩa (ngoài /page static)
+IMAGE_PROXY_CONFIG = {
+    'dir': os.environ.get('IMAGE_PROXY_DIR', 'cache/images'),
+    # Tổng dung lượng cache (ảnh gốc + thumbnail); vượt thì xoá file ít dùng nhất
+    'max_total_bytes': int(os.environ.get('IMAGE_PROXY_MAX_TOTAL_BYTES', 512 * 1024 * 1024)),
+    'quality': int(os.environ.get('IMAGE_PROXY_QUALITY', 80)),
+    # Ảnh gốc lớn hơn N byte -> bỏ, dùng fallback
+    'max_bytes': int(os.environ.get('IMAGE_PROXY_MAX_BYTES', 8 * 1024 * 1024)),
+    'timeout': float(os.environ.get('IMAGE_PROXY_TIMEOUT', 8)),
+    # Cache-Control max-age (giây) khi URL có v=<khoá nội dung ảnh nguồn> khớp (URL đổi khi ảnh đổi)
+    'max_age': int(os.environ.get('IMAGE_PROXY_MAX_AGE', 30 * 24 * 3600)),
+    # URL chỉ theo tên món (không có / sai v=): tên có thể resolve sang ảnh khác sau này -> cache ngắn
+    'name_max_age': int(os.environ.get('IMAGE_PROXY_NAME_MAX_AGE', 3600)),
+}
+
+# Background job queue cho POST /api/plan/generate
+PLAN_JOB_CONFIG = {
+    # Số plan được sinh song song (mỗi plan tự fan-out recipe trên pool LLM riêng)
+    'workers': int(os.environ.get('PLAN_JOB_WORKERS', 2)),
+    # Giữ trạng thái job đã xong bao lâu (giây) để FE poll
+    'ttl': float(os.environ.get('PLAN_JOB_TTL', 3600)),
 }
 
 # Application configuration
@@ -1,38 +1,251 @@
 """
 Database connection and query utilities
+
+Read/write split (tuỳ chọn, bật khi có DB_REPLICA_HOST):
+- db_query / db_iter -> pool replica; db_execute / db_execute_many / db_transaction -> primary.
+- Read-your-writes: trong cùng context (request / thread) vừa ghi thì các lần đọc
+  trong DB_ROUTING_CONFIG['read_your_writes'] giây tiếp theo đi primary.
+  Giữa các request của cùng 1 client: middleware gửi mốc ghi cuối qua cookie
+  (DB_ROUTING_CONFIG['cookie']) và nạp lại bằng begin_request_scope(last_write_at).
+- Đọc theo id vừa tạo ở nơi khác (job nền...) -> db_query_or_primary(): replica không có thì đọc primary.
+- Replica lỗi / chưa cấu hình -> đọc từ primary như cũ.
 """
+import asyncio
 import logging
-from typing import List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence
 
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector import errors, pooling
+
+try:  # async driver là tuỳ chọn: thiếu thì db_*_async chạy bản sync trong threadpool
+    import aiomysql
+except ImportError:  # pragma: no cover
+    aiomysql = None
 
-from .config import DB_CONFIG
+from .config import DB_CONFIG, DB_POOL_CONFIG, DB_REPLICA_CONFIG, DB_ROUTING_CONFIG, DB_ASYNC_CONFIG
 
 logger = logging.getLogger("meal")
 
-# Global connection pool
+# Global connection pool (primary) + optional read replica pool
 connection_pool = None
+replica_pool = None
+
+# aiomysql pool (primary), tạo lazily trên event loop đang chạy
+async_pool = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+
+# [thời điểm (epoch) lần ghi gần nhất] của request / thread hiện tại -> read-your-writes.
+# Dùng list (mutable) để các bản copy context (run_in_threadpool) của cùng request thấy nhau.
+_last_write_at: ContextVar[Optional[List[float]]] = ContextVar("meal_db_last_write_at", default=None)
+
+# Prepared statements: cache cursor theo SQL trên từng connection thật của pool
+_STMT_CACHE_ATTR = "_meal_stmt_cache"
+_STMT_CACHE_SIZE = 64
+_ER_UNKNOWN_STMT_HANDLER = 1243
+_CONN_ID_ATTR = "_meal_connection_id"
+
+
+class _Checkout:
+    """
+    Connection đang được mượn từ ConnectionPool. Dùng y như connection của mysql-connector
+    (mọi thuộc tính chuyển tiếp xuống connection gốc); close() trả slot về pool.
+    """
+    __slots__ = ("_conn", "_cnx", "_pool", "_overflow", "_started", "_closed")
+
+    def __init__(self, pool: "ConnectionPool", conn, overflow: bool):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_cnx", getattr(conn, "_cnx", conn))
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_overflow", overflow)
+        object.__setattr__(self, "_started", time.monotonic())
+        object.__setattr__(self, "_closed", False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        object.__setattr__(self, "_closed", True)
+        self._pool._release(self)
+
+
+class ConnectionPool:
+    """
+    Wrapper quanh mysql.connector.pooling.MySQLConnectionPool:
+
+    - Hết connection thì chờ (tối đa `timeout` giây, tối đa `max_waiters` request cùng chờ)
+      thay vì raise "pool exhausted" ngay.
+    - Cho mượn thêm tối đa `max_overflow` connection ngoài pool khi quá tải; connection
+      overflow bị đóng hẳn khi trả.
+    - MySQLConnectionPool.get_connection() đã tự ping (is_connected) và reconnect connection chết
+      mỗi lần checkout; wrapper chỉ phát hiện reconnect đó (connection_id đổi) để xoá cache
+      prepared statement của connection và đếm vào `reconnects`.
+    - stats(): in_use / waiting / wait time / checkout duration cho /api/health.
+    """
+
+    def __init__(self, db_args: Dict[str, Any], max_overflow: int = 0, timeout: float = 5.0,
+                 max_waiters: int = 50):
+        args = dict(db_args)
+        self.name = args.get("pool_name", "pool")
+        self.size = int(args.get("pool_size", 5))
+        self.max_overflow = max(0, int(max_overflow))
+        self.timeout = float(timeout)
+        self.max_waiters = max(0, int(max_waiters))
+        self._connect_args = {k: v for k, v in args.items() if not k.startswith("pool_")}
+        self._pool = pooling.MySQLConnectionPool(**args)
+        self._slots = threading.BoundedSemaphore(self.size + self.max_overflow)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._overflow_in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._reconnects = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hold_total = 0.0
+        self._hold_max = 0.0
+        self._returned = 0
+
+    def get_connection(self) -> _Checkout:
+        waited = self._acquire_slot()
+        try:
+            conn, overflow = self._take()
+            self._track_reconnect(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._overflow_in_use += int(overflow)
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return _Checkout(self, conn, overflow)
+
+    def _acquire_slot(self) -> float:
+        if self._slots.acquire(blocking=False):
+            return 0.0
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                self._rejected += 1
+                raise errors.PoolError(f"Pool '{self.name}' wait queue is full ({self.max_waiters})")
+            self._waiting += 1
+        start = time.monotonic()
+        try:
+            ok = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        waited = time.monotonic() - start
+        if not ok:
+            with self._lock:
+                self._timeouts += 1
+            raise errors.PoolError(f"Timed out after {self.timeout}s waiting for a connection from '{self.name}'")
+        return waited
+
+    def _take(self):
+        try:
+            return self._pool.get_connection(), False
+        except errors.PoolError:
+            # pool chính đã cho mượn hết nhưng còn slot overflow
+            return mysql.connector.connect(**self._connect_args), True
+
+    def _track_reconnect(self, conn) -> None:
+        """
+        Pool của mysql-connector đã reconnect connection chết khi checkout (không tốn thêm round-trip ở đây):
+        connection_id khác lần trước -> session mới, prepared statements cũ đã mất.
+        """
+        raw = getattr(conn, "_cnx", conn)
+        cid = getattr(raw, "connection_id", None)
+        seen = getattr(raw, _CONN_ID_ATTR, None)
+        if seen is not None and seen != cid:
+            setattr(raw, _STMT_CACHE_ATTR, None)
+            with self._lock:
+                self._reconnects += 1
+        try:
+            setattr(raw, _CONN_ID_ATTR, cid)
+        except Exception:
+            pass
+
+    def _release(self, checkout: _Checkout) -> None:
+        held = time.monotonic() - checkout._started
+        try:
+            checkout._conn.close()
+        except Exception as e:
+            logger.warning("Closing pooled connection failed: %s", e)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._overflow_in_use -= int(checkout._overflow)
+                self._returned += 1
+                self._hold_total += held
+                self._hold_max = max(self._hold_max, held)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "in_use": self._in_use,
+                "overflow_in_use": self._overflow_in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "reconnects": self._reconnects,
+                "wait_ms_avg": round(1000 * self._wait_total / self._checkouts, 2) if self._checkouts else 0.0,
+                "wait_ms_max": round(1000 * self._wait_max, 2),
+                "checkout_ms_avg": round(1000 * self._hold_total / self._returned, 2) if self._returned else 0.0,
+                "checkout_ms_max": round(1000 * self._hold_max, 2),
+            }
 
 
 def init_database() -> bool:
-    """Initialize database connection pool"""
+    """Initialize database connection pool (and the replica pool when configured)"""
     global connection_pool
     try:
         # Thêm timeout ngắn để không bao giờ treo khi DB lỗi
         db_args = dict(DB_CONFIG)
         db_args.setdefault("connection_timeout", 3)  # giây
 
-        connection_pool = pooling.MySQLConnectionPool(**db_args)
+        connection_pool = ConnectionPool(db_args, **DB_POOL_CONFIG)
         logger.info("Database connection pool initialized successfully")
-        return True
     except Exception as e:
         logger.error(f"Failed to initialize database connection pool: {e}")
         return False
+    _init_replica()
+    return True
+
+
+def _init_replica() -> None:
+    """Replica lỗi không làm hỏng app: chỉ log cảnh báo và đọc từ primary."""
+    global replica_pool
+    if not DB_REPLICA_CONFIG or replica_pool is not None:
+        return
+    try:
+        db_args = dict(DB_REPLICA_CONFIG)
+        db_args.setdefault("connection_timeout", 3)
+        replica_pool = ConnectionPool(db_args, **DB_POOL_CONFIG)
+        logger.info("Database replica pool initialized (%s)", db_args.get("host"))
+    except Exception as e:
+        logger.warning(f"Failed to initialize replica pool, reads go to primary: {e}")
 
 
 def get_connection():
-    """Get a connection from the pool"""
+    """Get a connection from the primary pool (chờ tối đa DB_POOL_CONFIG['timeout'] giây nếu pool bận)"""
     global connection_pool
     if connection_pool is None:
         ok = init_database()
@@ -41,20 +254,133 @@ def get_connection():
     return connection_pool.get_connection()
 
 
-def db_query(sql: str, params: tuple = None) -> List[Dict[str, Any]]:
+def begin_request_scope(last_write_at: float = 0.0) -> None:
+    """
+    Gọi đầu mỗi request (middleware). `last_write_at`: mốc ghi cuối (epoch) của client,
+    lấy từ cookie -> request đọc ngay sau 1 request ghi của cùng client vẫn đi primary.
+    """
+    _last_write_at.set([float(last_write_at or 0.0)])
+
+
+def last_write_at() -> float:
+    """Mốc ghi cuối (epoch) của context hiện tại, 0 nếu chưa ghi (middleware dùng để set cookie)."""
+    box = _last_write_at.get()
+    return box[0] if box else 0.0
+
+
+def _mark_write() -> None:
+    box = _last_write_at.get()
+    if box is None:
+        _last_write_at.set([time.time()])
+    else:
+        box[0] = time.time()
+
+
+def _recently_wrote() -> bool:
+    box = _last_write_at.get()
+    return bool(box and box[0]) and time.time() - box[0] < DB_ROUTING_CONFIG["read_your_writes"]
+
+
+def has_replica() -> bool:
+    return replica_pool is not None
+
+
+def get_read_connection(primary: bool = False):
+    """
+    Connection cho SELECT: replica nếu có và context hiện tại không vừa ghi,
+    ngược lại (hoặc replica lỗi, hoặc primary=True) -> primary.
+    """
+    if connection_pool is None:
+        return get_connection()
+    pool = replica_pool
+    if primary or pool is None or _recently_wrote():
+        return get_connection()
+    try:
+        return pool.get_connection()
+    except Exception as e:
+        logger.warning(f"Replica unavailable, reading from primary: {e}")
+        return get_connection()
+
+
+def pool_stats(replica: bool = False) -> Optional[Dict[str, Any]]:
+    """Metrics của pool (primary hoặc replica) cho /api/health (None nếu chưa khởi tạo / không cấu hình)"""
+    pool = replica_pool if replica else connection_pool
+    return pool.stats() if pool is not None else None
+
+
+def _raw_connection(conn):
+    """PooledMySQLConnection -> connection thật (sống suốt đời pool)."""
+    return getattr(conn, "_cnx", conn)
+
+
+def _prepared_cursor(conn, sql: str):
+    """
+    Cursor prepared (dictionary) cho `sql`, cache trên connection thật (LRU _STMT_CACHE_SIZE).
+    Trả (cursor, cached) — cached=True nếu statement đã được prepare từ trước.
+    """
+    raw = _raw_connection(conn)
+    cache = getattr(raw, _STMT_CACHE_ATTR, None)
+    if cache is None:
+        cache = OrderedDict()
+        setattr(raw, _STMT_CACHE_ATTR, cache)
+    cur = cache.get(sql)
+    if cur is not None:
+        cache.move_to_end(sql)
+        return cur, True
+    cur = conn.cursor(prepared=True, dictionary=True)
+    cache[sql] = cur
+    if len(cache) > _STMT_CACHE_SIZE:
+        _, old = cache.popitem(last=False)
+        try:
+            old.close()
+        except Exception:
+            pass
+    return cur, False
+
+
+def _drop_prepared(conn, sql: str) -> None:
+    cache = getattr(_raw_connection(conn), _STMT_CACHE_ATTR, None)
+    if cache:
+        cache.pop(sql, None)
+
+
+def _query_prepared(conn, sql: str, params: tuple) -> List[Dict[str, Any]]:
+    cur, cached = _prepared_cursor(conn, sql)
+    try:
+        cur.execute(sql, params or ())
+        return cur.fetchall()
+    except errors.Error as e:
+        _drop_prepared(conn, sql)
+        # Statement cũ mất ở server (reconnect / reset session) -> prepare lại 1 lần
+        stale = e.errno == _ER_UNKNOWN_STMT_HANDLER or isinstance(e, errors.InterfaceError)
+        if not (cached and stale):
+            raise
+        logger.info("Re-preparing statement after error %s", e.errno)
+        cur, _ = _prepared_cursor(conn, sql)
+        cur.execute(sql, params or ())
+        return cur.fetchall()
+
+
+def db_query(sql: str, params: tuple = None, prepared: bool = False,
+             primary: bool = False) -> List[Dict[str, Any]]:
     """
     Execute a SELECT query and return results as list of dictionaries
 
     Args:
         sql: SQL query string
         params: Query parameters tuple
+        prepared: Dùng server-side prepared statement, cache theo connection
+            (cho câu lệnh nóng, SQL cố định — không dùng với SQL sinh động như IN (%s,%s,...))
+        primary: Bỏ qua replica, đọc thẳng primary
 
     Returns:
         List of dictionaries representing query results
     """
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection(primary)
+        if prepared:
+            return _query_prepared(conn, sql, params)
         cur = conn.cursor(dictionary=True)
         cur.execute(sql, params or ())
         rows = cur.fetchall()
@@ -69,6 +395,53 @@ def db_query(sql: str, params: tuple = None) -> List[Dict[str, Any]]:
             conn.close()
 
 
+def db_query_or_primary(sql: str, params: tuple = None, prepared: bool = False) -> List[Dict[str, Any]]:
+    """
+    db_query(); replica không trả dòng nào (có thể do replica chưa kịp nhận bản ghi vừa tạo,
+    vd plan_id của job nền / request khác) -> đọc lại 1 lần trên primary.
+    """
+    rows = db_query(sql, params, prepared)
+    if rows or not has_replica():
+        return rows
+    return db_query(sql, params, prepared, primary=True)
+
+
+def db_iter(sql: str, params: tuple = None, batch_size: int = 100) -> Iterator[Dict[str, Any]]:
+    """
+    Stream a large SELECT row by row (unbuffered cursor, fetchmany theo lô)
+    thay vì fetchall() cả result set vào RAM.
+
+    Connection bị giữ tới khi generator chạy hết hoặc bị close();
+    dừng giữa chừng thì phần còn lại được đọc bỏ trước khi trả connection về pool.
+    """
+    conn = None
+    cur = None
+    done = False
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor(dictionary=True, buffered=False)
+        cur.execute(sql, params or ())
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+        done = True
+    except Exception as e:
+        logger.error(f"Database iter error: {e}")
+        logger.error(f"SQL: {sql}")
+        logger.error(f"Params: {params}")
+        raise
+    finally:
+        if conn:
+            if not done:
+                try:
+                    conn.consume_results()
+                except Exception:
+                    pass
+            conn.close()
+
+
 def db_execute(sql: str, params: tuple = None) -> int:
     """
     Execute an INSERT/UPDATE/DELETE query and return the last row ID
@@ -82,6 +455,7 @@ def db_execute(sql: str, params: tuple = None) -> int:
     """
     conn = None
     try:
+        _mark_write()
         conn = get_connection()
         cur = conn.cursor()
         cur.execute(sql, params or ())
@@ -102,6 +476,226 @@ def db_execute(sql: str, params: tuple = None) -> int:
             conn.close()
 
 
+def db_execute_many(sql: str, seq_params: Iterable[Sequence[Any]]) -> int:
+    """
+    Execute one INSERT/UPDATE/DELETE for many parameter rows on a single connection
+    and commit once (all rows or none).
+
+    Với INSERT ... VALUES (...), mysql-connector gộp thành 1 câu multi-row VALUES
+    -> 1 round-trip thay vì N lần mượn connection + commit.
+
+    Args:
+        sql: SQL statement with placeholders
+        seq_params: Iterable of parameter tuples
+
+    Returns:
+        Affected rows
+    """
+    rows = [tuple(p) for p in seq_params or ()]
+    if not rows:
+        return 0
+    conn = None
+    try:
+        _mark_write()
+        conn = get_connection()
+        if conn.autocommit:
+            conn.start_transaction()
+        cur = conn.cursor()
+        cur.executemany(sql, rows)
+        conn.commit()
+        return cur.rowcount
+    except Exception as e:
+        if conn:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        logger.error(f"Database execute_many error: {e}")
+        logger.error(f"SQL: {sql}")
+        logger.error(f"Rows: {len(rows)}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+class Transaction:
+    """
+    Unit of work trên 1 connection đã mượn từ pool (xem db_transaction()).
+    Mọi câu lệnh chạy trong cùng 1 transaction; commit/rollback do context manager lo.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def query(self, sql: str, params: tuple = None) -> List[Dict[str, Any]]:
+        """SELECT -> list of dicts (same as db_query)"""
+        cur = self._conn.cursor(dictionary=True)
+        try:
+            cur.execute(sql, params or ())
+            return cur.fetchall()
+        except Exception:
+            logger.error(f"SQL: {sql}")
+            logger.error(f"Params: {params}")
+            raise
+        finally:
+            cur.close()
+
+    def execute(self, sql: str, params: tuple = None) -> int:
+        """INSERT/UPDATE/DELETE -> last row ID for INSERT, affected rows for others (same as db_execute)"""
+        cur = self._conn.cursor()
+        try:
+            cur.execute(sql, params or ())
+            if sql.strip().upper().startswith('INSERT'):
+                return cur.lastrowid
+            return cur.rowcount
+        except Exception:
+            logger.error(f"SQL: {sql}")
+            logger.error(f"Params: {params}")
+            raise
+        finally:
+            cur.close()
+
+    def executemany(self, sql: str, seq_params: Iterable[Sequence[Any]]) -> int:
+        """Many parameter rows for one statement -> affected rows (same as db_execute_many)"""
+        rows = [tuple(p) for p in seq_params or ()]
+        if not rows:
+            return 0
+        cur = self._conn.cursor()
+        try:
+            cur.executemany(sql, rows)
+            return cur.rowcount
+        except Exception:
+            logger.error(f"SQL: {sql}")
+            logger.error(f"Rows: {len(rows)}")
+            raise
+        finally:
+            cur.close()
+
+
+@contextmanager
+def db_transaction() -> Iterator[Transaction]:
+    """
+    Pin 1 connection cho nhiều câu lệnh và commit đúng 1 lần:
+
+        with db_transaction() as tx:
+            tx.execute("INSERT ...", (...))
+            tx.execute("INSERT ...", (...))
+
+    Exception bất kỳ (kể cả HTTPException) -> rollback rồi raise lại.
+    Dùng START TRANSACTION (như db_execute_many): gán conn.autocommit qua PooledMySQLConnection
+    chỉ đặt thuộc tính trên wrapper, session thật vẫn autocommit -> không có transaction.
+    """
+    _mark_write()
+    conn = get_connection()
+    try:
+        conn.start_transaction()
+        yield Transaction(conn)
+        conn.commit()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        logger.debug(f"Database transaction rolled back: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+# =====================================================================
+# Async (aiomysql) — chạy thẳng trên event loop, không tốn thread hop
+# =====================================================================
+
+async def init_async_pool():
+    """
+    Tạo aiomysql pool (DictCursor, autocommit) nếu chưa có. Trả pool, hoặc None khi
+    thiếu aiomysql / tắt bằng DB_ASYNC_ENABLED=false / DB lỗi.
+    """
+    global async_pool, _async_pool_lock
+    if async_pool is not None:
+        return async_pool
+    if aiomysql is None or not DB_ASYNC_CONFIG["enabled"]:
+        return None
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if async_pool is None:
+            try:
+                async_pool = await aiomysql.create_pool(
+                    host=DB_CONFIG["host"],
+                    port=DB_CONFIG["port"],
+                    user=DB_CONFIG["user"],
+                    password=DB_CONFIG["password"],
+                    db=DB_CONFIG["database"],
+                    charset=DB_CONFIG["charset"],
+                    autocommit=True,
+                    minsize=DB_ASYNC_CONFIG["minsize"],
+                    maxsize=DB_ASYNC_CONFIG["maxsize"],
+                    pool_recycle=DB_ASYNC_CONFIG["pool_recycle"],
+                    connect_timeout=3,
+                    cursorclass=aiomysql.DictCursor,
+                )
+                logger.info("Async database pool initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize async database pool: {e}")
+                return None
+    return async_pool
+
+
+async def get_async_pool():
+    """aiomysql pool cho các service async (page/services/preferences.py); raise nếu không có."""
+    pool = await init_async_pool()
+    if pool is None:
+        raise RuntimeError("Async database pool is not available")
+    return pool
+
+
+async def close_async_pool() -> None:
+    global async_pool
+    pool, async_pool = async_pool, None
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+        logger.info("Async database pool closed")
+
+
+async def db_query_async(sql: str, params: tuple = None) -> List[Dict[str, Any]]:
+    """Async db_query: aiomysql nếu có, không thì chạy db_query trong threadpool."""
+    pool = await init_async_pool()
+    if pool is None:
+        return await asyncio.to_thread(db_query, sql, params)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params or ())
+                return list(await cur.fetchall())
+    except Exception as e:
+        logger.error(f"Database query error: {e}")
+        logger.error(f"SQL: {sql}")
+        logger.error(f"Params: {params}")
+        raise
+
+
+async def db_execute_async(sql: str, params: tuple = None) -> int:
+    """Async db_execute: last row ID for INSERT, affected rows for others."""
+    pool = await init_async_pool()
+    if pool is None:
+        return await asyncio.to_thread(db_execute, sql, params)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params or ())
+                if sql.strip().upper().startswith('INSERT'):
+                    return cur.lastrowid
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"Database execute error: {e}")
+        logger.error(f"SQL: {sql}")
+        logger.error(f"Params: {params}")
+        raise
+
+
 def test_connection() -> bool:
     """Test database connection"""
     try:
@@ -114,10 +708,11 @@ def test_connection() -> bool:
 
 def close_pool():
     """Close all connections in the pool"""
-    global connection_pool
+    global connection_pool, replica_pool
     if connection_pool:
         # mysql-connector pool không có close_all; GC sẽ dọn dẹp
         connection_pool = None
+        replica_pool = None
         logger.info("Database connection pool closed")
 
 
@@ -0,0 +1,62 @@
+"""
+Dish image cache: tên món -> URL ảnh (https) đã tìm được
+
+- RAM (LRU, giới hạn số entry) + store bền dùng chung giữa các worker/process
+  (IMAGE_CACHE_BACKEND: 'sqlite' cùng host, 'mysql' cho nhiều host) -> mỗi món chỉ scrape 1 lần.
+- Negative cache: món không tìm được ảnh lưu "" với TTL ngắn hơn, để không scrape lại liên tục
+  nhưng vẫn thử lại sau một thời gian.
+- Cả 2 tầng đều có giới hạn: RAM theo LRU (maxsize), store bền được sweep định kỳ
+  (xoá dòng hết hạn + dòng ít dùng nhất vượt IMAGE_CACHE_CONFIG['max_rows']).
+- Khoá = sha256 của tên chuẩn hoá (recipes.dish_key), vừa cột CHAR(64) của MySQLStore.
+"""
+from typing import Any, Dict, Optional
+
+from .cache import TieredCache, content_key, make_store
+from .config import IMAGE_CACHE_CONFIG
+from .recipes import dish_key
+
+IMAGE_CACHE = TieredCache(
+    namespace="dish_image",
+    maxsize=IMAGE_CACHE_CONFIG["maxsize"],
+    ttl=IMAGE_CACHE_CONFIG["ttl"],
+    store=make_store(IMAGE_CACHE_CONFIG["backend"], IMAGE_CACHE_CONFIG["path"]),
+    enabled=IMAGE_CACHE_CONFIG["backend"].strip().lower() != "off",
+    max_rows=IMAGE_CACHE_CONFIG["max_rows"],
+)
+
+
+def _is_https(u: Optional[str]) -> bool:
+    return bool(u) and str(u).strip().lower().startswith("https://")
+
+
+def image_key(name: str) -> str:
+    return content_key("dish_image", dish_key(name))
+
+
+def get(name: str) -> Optional[str]:
+    """
+    None  -> chưa biết (cần scrape)
+    ""    -> đã scrape, không có ảnh (negative cache)
+    "https://..." -> ảnh đã tìm được
+    """
+    if not dish_key(name):
+        return None
+    value = IMAGE_CACHE.get(image_key(name))
+    return value if isinstance(value, str) else None
+
+
+def put(name: str, src: Optional[str], ttl: Optional[float] = None) -> None:
+    """
+    Lưu kết quả scrape; src không phải https -> lưu negative ("") với TTL ngắn
+    (mặc định negative_ttl; lượt scrape lỗi / hết giờ truyền ttl=error_ttl).
+    """
+    if not dish_key(name):
+        return
+    if _is_https(src):
+        IMAGE_CACHE.set(image_key(name), str(src).strip(), ttl=ttl)
+    else:
+        IMAGE_CACHE.set(image_key(name), "", ttl=ttl or IMAGE_CACHE_CONFIG["negative_ttl"])
+
+
+def stats() -> Dict[str, Any]:
+    return IMAGE_CACHE.stats()
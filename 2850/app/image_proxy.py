@@ -0,0 +1,315 @@
+"""
+Dish image proxy: thumbnail WebP/JPEG từ ảnh gốc đã resolve, cache trên đĩa (content-addressed)
+
+- Chỉ nhận tên món -> resolve qua image_scraper (cache dùng chung); KHÔNG nhận URL tuỳ ý từ client.
+  URL nguồn vẫn có thể đến từ og:image của trang lạ -> chỉ tải https, host phải là IP public.
+- Ảnh gốc tải 1 lần:  <IMAGE_PROXY_DIR>/orig/<sha256(src)>
+  Thumbnail:           <IMAGE_PROXY_DIR>/<sha256(src, w, h, fmt)>.webp|.jpg
+  (mặc định cache/images — ngoài thư mục /page được mount static).
+  Kích thước được làm tròn lên theo bậc (_SIZE_STEPS) để số biến thể trên đĩa có giới hạn.
+- Tổng dung lượng bị chặn (IMAGE_PROXY_CONFIG['max_total_bytes']): vượt thì xoá file cũ nhất
+  theo mtime (mỗi lần dùng lại file được touch -> LRU).
+- Cùng 1 ảnh gốc / thumbnail đang được tạo bởi request khác -> chờ kết quả đó (single-flight).
+- Không có Pillow -> trả ảnh gốc (vẫn cache trên đĩa).
+"""
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+try:  # Pillow là tuỳ chọn
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = 40_000_000  # chặn decompression bomb
+except ImportError:  # pragma: no cover
+    Image = None
+    ImageOps = None
+
+from .config import IMAGE_PROXY_CONFIG
+from .image_scraper import SESSION, is_https
+
+logger = logging.getLogger("meal")
+
+CACHE_DIR = Path(IMAGE_PROXY_CONFIG["dir"])
+_ORIG_DIR = CACHE_DIR / "orig"
+
+_SIZE_STEPS = (64, 128, 192, 256, 384, 512, 640, 800, 1024, 1280, 1600)
+
+_MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+# File vừa dùng trong khoảng này không bị xoá (đang được FileResponse gửi đi)
+_PRUNE_GRACE = 120
+
+_INFLIGHT: Dict[str, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+_size_lock = threading.Lock()
+_total_bytes: Optional[int] = None   # ước lượng tổng dung lượng cache (None = chưa quét)
+
+
+def source_key(src: str) -> str:
+    """Khoá nội dung của ảnh nguồn (dùng trong URL thumbnail để URL đổi khi ảnh đổi)."""
+    return hashlib.sha256(src.encode("utf-8")).hexdigest()
+
+
+def _single_flight(key: str, fn: Callable[[], Any]) -> Any:
+    """
+    Chỉ 1 thread chạy fn cho mỗi key; các thread khác cùng key chờ và dùng chung kết quả.
+    Thread chờ quá hạn hoặc thread chạy fn bị lỗi -> thread chờ nhận None (coi như miss).
+    """
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(key)
+        owner = fut is None
+        if owner:
+            fut = _INFLIGHT[key] = Future()
+    if not owner:
+        try:
+            return fut.result(timeout=IMAGE_PROXY_CONFIG["timeout"] * 4)
+        except Exception as e:
+            logger.info("Image proxy wait for %s gave up: %r", key, e)
+            return None
+    try:
+        result = fn()
+        fut.set_result(result)
+        return result
+    except Exception as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _cache_files():
+    if not CACHE_DIR.exists():
+        return []
+    return [p for p in CACHE_DIR.rglob("*") if p.is_file() and not p.name.startswith(".tmp-")]
+
+
+def _prune_unit(p: Path) -> Path:
+    """orig/<key> và orig/<key>.type là một đơn vị: luôn giữ / xoá cùng nhau."""
+    if p.parent == _ORIG_DIR and p.suffix == ".type":
+        return p.with_suffix("")
+    return p
+
+
+def _prune() -> None:
+    """Xoá file ít dùng nhất (mtime cũ nhất) tới khi còn ~90% max_total_bytes."""
+    global _total_bytes
+    limit = IMAGE_PROXY_CONFIG["max_total_bytes"]
+    units: Dict[Path, list] = {}  # đơn vị -> [mtime mới nhất, tổng size, [(file, size)]]
+    for p in _cache_files():
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        u = units.setdefault(_prune_unit(p), [0.0, 0, []])
+        u[0] = max(u[0], st.st_mtime)
+        u[1] += st.st_size
+        u[2].append((p, st.st_size))
+    total = sum(u[1] for u in units.values())
+    target = int(limit * 0.9)
+    now = time.time()
+    removed = 0
+    for mtime, _, files in sorted(units.values(), key=lambda u: u[0]):
+        if total <= target:
+            break
+        if now - mtime < _PRUNE_GRACE:
+            break
+        for p, fsize in files:
+            try:
+                p.unlink()
+                total -= fsize
+                removed += 1
+            except OSError:
+                pass
+    _total_bytes = total
+    if removed:
+        logger.info("Image proxy cache pruned %s files, %s bytes left", removed, total)
+
+
+def _account(added: int) -> None:
+    global _total_bytes
+    with _size_lock:
+        if _total_bytes is None:
+            _total_bytes = 0
+            for p in _cache_files():
+                try:
+                    _total_bytes += p.stat().st_size
+                except OSError:
+                    pass
+        else:
+            _total_bytes += added
+        if _total_bytes > IMAGE_PROXY_CONFIG["max_total_bytes"]:
+            _prune()
+
+
+def snap_size(v: Optional[int]) -> Optional[int]:
+    """Làm tròn lên bậc gần nhất (None giữ nguyên = theo tỉ lệ ảnh)."""
+    if v is None:
+        return None
+    try:
+        v = int(v)
+    except (TypeError, ValueError):
+        return None
+    for step in _SIZE_STEPS:
+        if v <= step:
+            return step
+    return _SIZE_STEPS[-1]
+
+
+def _public_https(url: str) -> bool:
+    """https + mọi địa chỉ của host là IP public (không cho proxy vào mạng nội bộ)."""
+    if not is_https(url):
+        return False
+    host = urlparse(url).hostname
+    if not host:
+        return False
+    try:
+        infos = socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+    except OSError:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(i[4][0].split("%")[0]).is_global for i in infos)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _fetch(src: str) -> Optional[Tuple[bytes, str]]:
+    """Tải ảnh gốc -> (bytes, content-type); giới hạn dung lượng, mỗi bước redirect đều kiểm tra host."""
+    url = src
+    for _ in range(4):  # tự theo redirect để kiểm tra từng host
+        if not _public_https(url):
+            return None
+        r = SESSION.get(url, timeout=IMAGE_PROXY_CONFIG["timeout"], stream=True, allow_redirects=False)
+        try:
+            if r.is_redirect and r.headers.get("Location"):
+                url = urljoin(url, r.headers["Location"])
+                continue
+            if r.status_code != 200:
+                return None
+            ctype = (r.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            if not ctype.startswith("image/"):
+                return None
+            buf = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                buf.extend(chunk)
+                if len(buf) > IMAGE_PROXY_CONFIG["max_bytes"]:
+                    return None
+            return bytes(buf), ctype
+        finally:
+            r.close()
+    return None
+
+
+def _original(src: str) -> Optional[Tuple[bytes, str]]:
+    """Ảnh gốc từ đĩa, chưa có thì tải 1 lần rồi lưu (content-type lưu ở file .type bên cạnh)."""
+    key = source_key(src)
+    path = _ORIG_DIR / key
+    type_path = _ORIG_DIR / f"{key}.type"
+
+    def load() -> Optional[Tuple[bytes, str]]:
+        try:
+            data, ctype = path.read_bytes(), type_path.read_text().strip()
+        except OSError:
+            return None
+        _touch(path)
+        return data, ctype
+
+    def fetch() -> Optional[Tuple[bytes, str]]:
+        hit = load()
+        if hit is not None:
+            return hit
+        got = _fetch(src)
+        if got is None:
+            return None
+        data, ctype = got
+        _write_atomic(type_path, ctype.encode("ascii", "ignore"))
+        _write_atomic(path, data)
+        _account(len(data))
+        return data, ctype
+
+    hit = load()
+    return hit if hit is not None else _single_flight(f"orig:{key}", fetch)
+
+
+def _render(data: bytes, w: Optional[int], h: Optional[int], fmt: str) -> bytes:
+    img = Image.open(BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("RGB")
+    if w and h:
+        img = ImageOps.fit(img, (w, h), method=Image.LANCZOS)
+    else:
+        img.thumbnail((w or h or 512, h or w or 512), Image.LANCZOS)
+    out = BytesIO()
+    if fmt == "webp":
+        img.save(out, "WEBP", quality=IMAGE_PROXY_CONFIG["quality"], method=4)
+    else:
+        img.save(out, "JPEG", quality=IMAGE_PROXY_CONFIG["quality"], optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def thumbnail(src: str, w: Optional[int], h: Optional[int], webp: bool = True) -> Optional[Tuple[Path, str, str]]:
+    """
+    -> (đường dẫn file trên đĩa, media type, etag) hoặc None nếu không tải / không đọc được ảnh.
+    w, h nên đã qua snap_size(); thiếu Pillow -> trả ảnh gốc.
+    """
+    if Image is None:
+        orig = _original(src)
+        if orig is None:
+            return None
+        key = source_key(src)
+        return _ORIG_DIR / key, orig[1], key
+
+    fmt = "webp" if webp else "jpeg"
+    key = hashlib.sha256(f"{src}|{w}|{h}|{fmt}|{IMAGE_PROXY_CONFIG['quality']}".encode("utf-8")).hexdigest()
+    path = CACHE_DIR / f"{key}.{'webp' if fmt == 'webp' else 'jpg'}"
+    if path.exists():
+        _touch(path)
+        return path, _MEDIA_TYPES[fmt], key
+
+    def build() -> bool:
+        if path.exists():
+            return True
+        orig = _original(src)
+        if orig is None:
+            return False
+        try:
+            blob = _render(orig[0], w, h, fmt)
+        except Exception as e:
+            logger.warning("Thumbnail for %s failed: %s", src, e)
+            return False
+        _write_atomic(path, blob)
+        _account(len(blob))
+        return True
+
+    if not _single_flight(f"thumb:{key}", build):
+        return None
+    return path, _MEDIA_TYPES[fmt], key
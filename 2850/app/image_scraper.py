@@ -0,0 +1,247 @@
+"""
+Dish image scraper: tìm ảnh https cho 1 món ăn (NO DB, NO SLUG)
+
+- Các nguồn chạy song song trên 1 thread pool dùng chung, cùng 1 requests.Session (giữ kết nối):
+    vi.wikipedia, en.wikipedia, DuckDuckGo "<món> món ăn" -> og:image, DuckDuckGo "<món> recipe" -> og:image
+- Lấy kết quả https hợp lệ đầu tiên, huỷ các nguồn chưa chạy; cả lượt có 1 hạn chót chung
+  (IMAGE_SCRAPER_CONFIG['deadline']) và timeout từng HTTP call không vượt quá thời gian còn lại.
+- resolve_dish_image(): cache dùng chung (app/image_cache.py) trước; cùng 1 món đang được scrape
+  bởi request khác thì chờ kết quả đó thay vì scrape lần nữa.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import quote_plus
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from . import image_cache
+from .config import IMAGE_CACHE_CONFIG, IMAGE_SCRAPER_CONFIG
+from .recipes import dish_key
+
+logger = logging.getLogger("meal")
+
+_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+SESSION = requests.Session()
+SESSION.headers.update(_HEADERS)
+_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=IMAGE_SCRAPER_CONFIG["workers"],
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+_POOL = ThreadPoolExecutor(
+    max_workers=IMAGE_SCRAPER_CONFIG["workers"], thread_name_prefix="img-scrape"
+)
+# resolve_many: mỗi món 1 task, task lại fan-out nguồn lên _POOL -> pool riêng để không tự chặn nhau
+_BATCH_POOL = ThreadPoolExecutor(
+    max_workers=IMAGE_SCRAPER_CONFIG["batch_workers"], thread_name_prefix="img-batch"
+)
+
+# name_key -> Future đang scrape (single-flight)
+_INFLIGHT: Dict[str, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def is_https(u: Optional[str]) -> bool:
+    return bool(u) and str(u).strip().lower().startswith("https://")
+
+
+def _first_non_empty(*vals: Optional[str]) -> Optional[str]:
+    for v in vals:
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+    return None
+
+
+def _timeout(deadline: float, cap: float) -> float:
+    """Timeout cho 1 HTTP call: không quá cap, không vượt hạn chót chung."""
+    left = deadline - time.monotonic()
+    if left <= 0.05:
+        raise TimeoutError("image scrape deadline reached")
+    return min(cap, left)
+
+
+def _wiki_thumb(lang: str, name: str, deadline: float) -> Optional[str]:
+    url = (
+        f"https://{lang}.wikipedia.org/w/api.php"
+        f"?action=query&titles={quote_plus(name)}&prop=pageimages"
+        "&format=json&pithumbsize=800&redirects=1"
+    )
+    r = SESSION.get(url, timeout=_timeout(deadline, 6))
+    pages = r.json().get("query", {}).get("pages", {})
+    for p in pages.values():
+        src = (p or {}).get("thumbnail", {}).get("source")
+        if is_https(src):
+            return src
+    return None
+
+
+def _duckduckgo_first_result_url(q: str, deadline: float) -> Optional[str]:
+    r = SESSION.get(f"https://duckduckgo.com/html/?q={quote_plus(q)}", timeout=_timeout(deadline, 8))
+    soup = BeautifulSoup(r.text, "html.parser")
+    a = soup.select_one("a.result__a")
+    if a and a.get("href"):
+        return a["href"]
+    return None
+
+
+def _page_og_image(url: str, deadline: float) -> Optional[str]:
+    r = SESSION.get(url, timeout=_timeout(deadline, 8))
+    soup = BeautifulSoup(r.text, "html.parser")
+    meta = soup.find("meta", property="og:image") or soup.find("meta", attrs={"name": "og:image"})
+    if meta:
+        src = _first_non_empty(meta.get("content"), meta.get("value"))
+        if is_https(src):
+            return src
+    # Fallback: <img> lớn
+    for img in soup.find_all("img"):
+        src = img.get("src") or img.get("data-src")
+        if not is_https(src):
+            continue
+        w = (img.get("width") or "").strip()
+        h = (img.get("height") or "").strip()
+        if (w.isdigit() and int(w) >= 400) or (h.isdigit() and int(h) >= 300):
+            return src
+    return None
+
+
+def _search_og_image(q: str, deadline: float) -> Optional[str]:
+    link = _duckduckgo_first_result_url(q, deadline)
+    return _page_og_image(link, deadline) if link else None
+
+
+def _sources(name: str, deadline: float) -> List[Callable[[], Optional[str]]]:
+    return [
+        lambda: _wiki_thumb("vi", name, deadline),
+        lambda: _wiki_thumb("en", name, deadline),
+        lambda: _search_og_image(f"{name} món ăn", deadline),
+        lambda: _search_og_image(f"{name} recipe", deadline),
+    ]
+
+
+class ScrapeIncomplete(Exception):
+    """Không có ảnh nhưng chưa chắc là món không có ảnh: hết hạn chót hoặc có nguồn lỗi."""
+
+
+def scrape_dish_image(name: str, deadline: Optional[float] = None) -> Optional[str]:
+    """
+    Chạy mọi nguồn song song, trả URL https hợp lệ đầu tiên.
+    None = mọi nguồn đã trả lời và không nguồn nào có ảnh (kết luận được).
+    Raise ScrapeIncomplete khi hết hạn chót hoặc có nguồn lỗi mà chưa tìm được ảnh.
+    deadline: số giây tối đa cho cả lượt (mặc định IMAGE_SCRAPER_CONFIG['deadline']).
+    """
+    q = (name or "").strip()
+    if not q:
+        return None
+    budget = IMAGE_SCRAPER_CONFIG["deadline"] if deadline is None else float(deadline)
+    until = time.monotonic() + budget
+    pending = {_POOL.submit(fn) for fn in _sources(q, until)}
+    errors = 0
+    try:
+        while pending:
+            left = until - time.monotonic()
+            if left <= 0:
+                raise ScrapeIncomplete(f"deadline {budget:.1f}s reached")
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for f in done:
+                try:
+                    src = f.result()
+                except Exception:
+                    errors += 1
+                    continue
+                if is_https(src):
+                    return src
+        if errors:
+            raise ScrapeIncomplete(f"{errors} source(s) failed")
+        return None
+    finally:
+        # Nguồn chưa chạy thì huỷ; nguồn đang chạy tự dừng khi hết timeout (≤ hạn chót)
+        for f in pending:
+            f.cancel()
+
+
+def resolve_dish_image(name: str, deadline: Optional[float] = None) -> Optional[str]:
+    """
+    Ảnh https cho món (None nếu không có): cache dùng chung trước, miss mới scrape.
+    Kết quả (kể cả "không có ảnh") được ghi vào cache -> mỗi món chỉ scrape 1 lần cho cả cụm worker.
+    Lượt scrape dở dang (hết giờ / nguồn lỗi) chỉ được nhớ IMAGE_CACHE_CONFIG['error_ttl'] giây.
+    """
+    cached = image_cache.get(name)
+    if cached is not None:
+        return cached or None
+    key = dish_key(name)
+    if not key:
+        return None
+
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(key)
+        owner = fut is None
+        if owner:
+            fut = _INFLIGHT[key] = Future()
+    if not owner:
+        budget = IMAGE_SCRAPER_CONFIG["deadline"] if deadline is None else float(deadline)
+        try:
+            return fut.result(timeout=budget)
+        except Exception:
+            return None
+
+    src = None
+    try:
+        src = scrape_dish_image(name, deadline)
+        image_cache.put(name, src)
+    except ScrapeIncomplete as e:
+        logger.info("Image scrape for %r incomplete: %s", name, e)
+        image_cache.put(name, None, ttl=IMAGE_CACHE_CONFIG["error_ttl"])
+    except Exception as e:
+        logger.warning("Image scrape for %r failed: %s", name, e)
+        image_cache.put(name, None, ttl=IMAGE_CACHE_CONFIG["error_ttl"])
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+        fut.set_result(src if is_https(src) else None)
+    return src if is_https(src) else None
+
+
+def resolve_many(names: Iterable[str], deadline: Optional[float] = None) -> Dict[str, Optional[str]]:
+    """
+    Nhiều món 1 lượt: bỏ trùng (theo dish_key), cache hit trả ngay, miss scrape song song.
+    Trả name -> src (None = không có ảnh / chưa xong trước hạn chót). Món chưa xong vẫn chạy
+    tiếp ở background và ghi vào cache cho lần sau.
+    """
+    budget = IMAGE_SCRAPER_CONFIG["deadline"] if deadline is None else float(deadline)
+    out: Dict[str, Optional[str]] = {}
+    by_key: Dict[str, List[str]] = {}
+    for n in names or []:
+        n = (n or "").strip()
+        key = dish_key(n)
+        if not key or n in out:
+            continue
+        out[n] = None
+        by_key.setdefault(key, []).append(n)
+
+    todo: Dict[Future, str] = {}
+    for key, group in by_key.items():
+        cached = image_cache.get(group[0])
+        if cached is not None:
+            for n in group:
+                out[n] = cached or None
+        else:
+            todo[_BATCH_POOL.submit(resolve_dish_image, group[0], budget)] = key
+
+    if todo:
+        done, _ = wait(todo, timeout=budget)
+        for f in done:
+            try:
+                src = f.result()
+            except Exception:
+                src = None
+            for n in by_key[todo[f]]:
+                out[n] = src
+    return out
@@ -0,0 +1,143 @@
+"""
+Background job queue (thread pool) with pollable progress
+
+- JobQueue.submit(kind, fn, *args) -> job_id ngay lập tức; fn(progress, *args) chạy trên worker.
+- Hàm job báo tiến độ thật qua JobProgress.update(stage, percent, **detail).
+- Trạng thái job giữ trong RAM của process (poll phải về cùng process);
+  job đã xong được dọn sau `ttl` giây.
+- Single-flight: submit(..., dedupe_key=...) trùng key với job đang chạy -> trả lại job_id cũ;
+  SingleFlight làm điều tương tự cho coroutine (await chung 1 task).
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("meal")
+
+
+class JobProgress:
+    """Handle mà hàm job dùng để cập nhật stage/percent cho endpoint poll."""
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self._queue = queue
+        self.job_id = job_id
+
+    def update(self, stage: str, percent: Optional[float] = None, **detail: Any) -> None:
+        self._queue._update(self.job_id, stage=stage, percent=percent, detail=detail)
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = 2, name: str = "job", ttl: float = 3600):
+        self.name = name
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix=name)
+        self._jobs: Dict[str, dict] = {}
+        self._inflight: Dict[str, str] = {}  # dedupe_key -> job_id (queued/running)
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args: Any,
+               dedupe_key: Optional[str] = None, **kwargs: Any) -> str:
+        """
+        Đưa job vào hàng đợi, trả job_id. Nếu `dedupe_key` trùng với job đang queued/running
+        thì không tạo job mới mà trả job_id đó (các caller cùng nhận 1 kết quả).
+        """
+        self._gc()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            if dedupe_key is not None and dedupe_key in self._inflight:
+                existing = self._inflight[dedupe_key]
+                logger.info("Job %s (%s) joined in-flight job %s", kind, self.name, existing)
+                return existing
+            if dedupe_key is not None:
+                self._inflight[dedupe_key] = job_id
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": kind,
+                "status": "queued",
+                "stage": "queued",
+                "percent": 0,
+                "detail": {},
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "dedupe_key": dedupe_key,
+            }
+        self._pool.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snap = dict(job)
+            snap["detail"] = dict(job["detail"])
+            snap.pop("dedupe_key", None)
+        snap["elapsed"] = round((snap["updated_at"] if snap["status"] in ("done", "error") else time.time())
+                                - snap["created_at"], 2)
+        return snap
+
+    def _update(self, job_id: str, stage: Optional[str] = None, percent: Optional[float] = None,
+                detail: Optional[dict] = None, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if stage is not None:
+                job["stage"] = stage
+                job["detail"] = dict(detail or {})
+            if percent is not None:
+                # tiến độ không bao giờ lùi
+                job["percent"] = max(job["percent"], int(round(percent)))
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def _run(self, job_id: str, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        self._update(job_id, status="running")
+        try:
+            result = fn(JobProgress(self, job_id), *args, **kwargs)
+            self._update(job_id, stage="done", percent=100, status="done", result=result)
+        except Exception as e:
+            logger.error("Job %s (%s) failed: %s", job_id, self.name, e, exc_info=True)
+            self._update(job_id, stage="error", status="error", error=getattr(e, "detail", None) or "Internal server error")
+        finally:
+            with self._lock:
+                key = (self._jobs.get(job_id) or {}).get("dedupe_key")
+                if key is not None and self._inflight.get(key) == job_id:
+                    del self._inflight[key]
+
+    def _gc(self) -> None:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for jid in [j for j, v in self._jobs.items()
+                        if v["status"] in ("done", "error") and v["updated_at"] < cutoff]:
+                del self._jobs[jid]
+
+
+class SingleFlight:
+    """
+    Gộp các coroutine trùng key đang chạy đồng thời (trong cùng event loop):
+    caller đầu tiên chạy, các caller sau await chung kết quả/exception.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+
+    async def run(self, key: str, coro_fn: Callable[[], Any]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._inflight[key] = task
+            task.add_done_callback(
+                lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None
+            )
+        else:
+            logger.info("SingleFlight joined in-flight call %s", key[:12])
+        # shield: 1 caller ngắt kết nối không huỷ kết quả của những caller khác
+        return await asyncio.shield(task)
@@ -177,6 +177,14 @@ class LegacyInfoCollectIn(BaseModel):
     drinks: Optional[str] = None
     remark: Optional[str] = None
 
+class ImageBatchRequest(BaseModel):
+    names: List[str] = Field(default_factory=list)
+    plan_id: Optional[int] = None
+    square: int = 512
+    # Có thumb_w/thumb_h -> trả URL thumbnail qua /api/images/thumb thay vì URL ảnh gốc
+    thumb_w: Optional[int] = None
+    thumb_h: Optional[int] = None
+
 # ==================== Response Models ====================
 
 class ApiResponse(BaseModel):
@@ -1,7 +1,17 @@
 // Global Notification System
 // This script checks for notifications and displays badges
+// Realtime: WebSocket /message/user/{id}/ws push unread count / new member;
+// nếu socket không nối được (server cũ, proxy chặn WS...) thì quay về poll 30s như cũ.
 
 let notificationCheckInterval = null;
+let notificationSocket = null;
+let notificationSocketUser = null;
+let notificationSocketRetries = 0;
+let notificationRetryTimer = null;
+const NOTIFICATION_POLL_MS = 30000;
+const NOTIFICATION_SOCKET_MAX_RETRIES = 5;
+// Số đếm hiện tại để vẽ lại badge khi chỉ 1 loại thay đổi
+let notificationCounts = { unreadMessages: 0, newMembers: 0 };
 
 // Badge styles
 const badgeStyle = `
@@ -140,14 +150,9 @@ async function checkNewMembers(userId) {
     return 0;
 }
 
-// Update all notifications
-async function updateAllNotifications(userId) {
-    if (!userId) return;
-    
-    const [unreadMessages, newMembers] = await Promise.all([
-        checkUnreadMessages(userId),
-        checkNewMembers(userId)
-    ]);
+// Render badges from the current counts
+function renderNotificationBadges() {
+    const { unreadMessages, newMembers } = notificationCounts;
     
     // Update message badge
     const messageLink = document.querySelector('a[href="messages.html"]');
@@ -167,6 +172,18 @@ async function updateAllNotifications(userId) {
         const totalNotifications = unreadMessages + newMembers;
         updateBadge(userProfileBtn, totalNotifications);
     }
+}
+
+// Update all notifications
+async function updateAllNotifications(userId) {
+    if (!userId) return;
+    
+    const [unreadMessages, newMembers] = await Promise.all([
+        checkUnreadMessages(userId),
+        checkNewMembers(userId)
+    ]);
+    notificationCounts = { unreadMessages, newMembers };
+    renderNotificationBadges();
     
     return {
         unreadMessages,
@@ -174,6 +191,84 @@ async function updateAllNotifications(userId) {
     };
 }
 
+// Handle a pushed event from the notification socket
+async function handleNotificationEvent(userId, msg) {
+    if (msg.type === 'unread') {
+        notificationCounts.unreadMessages = msg.unread_count || 0;
+        renderNotificationBadges();
+    } else if (msg.type === 'new_member') {
+        notificationCounts.newMembers = await checkNewMembers(userId);
+        renderNotificationBadges();
+    }
+}
+
+function startNotificationPolling(userId) {
+    if (notificationCheckInterval) return;
+    notificationCheckInterval = setInterval(() => {
+        updateAllNotifications(userId);
+    }, NOTIFICATION_POLL_MS);
+}
+
+function stopNotificationPolling() {
+    if (notificationCheckInterval) {
+        clearInterval(notificationCheckInterval);
+        notificationCheckInterval = null;
+    }
+}
+
+function closeNotificationSocket() {
+    if (notificationRetryTimer) {
+        clearTimeout(notificationRetryTimer);
+        notificationRetryTimer = null;
+    }
+    if (notificationSocket) {
+        notificationSocket.onclose = null;
+        notificationSocket.close();
+        notificationSocket = null;
+    }
+    notificationSocketUser = null;
+}
+
+// Open the push channel; polling stays on until the socket is open
+function connectNotificationSocket(userId) {
+    if (!window.API_BASE || typeof WebSocket === 'undefined') return;
+    if (notificationSocket && notificationSocketUser === userId) return;
+    closeNotificationSocket();
+    
+    let ws;
+    try {
+        ws = new WebSocket(`${window.API_BASE.replace(/^http/, 'ws')}/message/user/${encodeURIComponent(userId)}/ws`);
+    } catch (error) {
+        return;
+    }
+    notificationSocket = ws;
+    notificationSocketUser = userId;
+    
+    ws.onopen = () => {
+        notificationSocketRetries = 0;
+        stopNotificationPolling();
+    };
+    ws.onmessage = (ev) => {
+        let msg;
+        try { msg = JSON.parse(ev.data); } catch (_) { return; }
+        handleNotificationEvent(userId, msg);
+    };
+    ws.onclose = () => {
+        if (notificationSocket !== ws) return;
+        notificationSocket = null;
+        notificationSocketUser = null;
+        // Mất push -> poll lại ngay, đồng thời thử nối lại vài lần
+        updateAllNotifications(userId);
+        startNotificationPolling(userId);
+        if (++notificationSocketRetries <= NOTIFICATION_SOCKET_MAX_RETRIES) {
+            notificationRetryTimer = setTimeout(
+                () => connectNotificationSocket(userId),
+                3000 * notificationSocketRetries
+            );
+        }
+    };
+}
+
 // Start notification checking
 function startNotificationCheck(userId) {
     if (!userId) return;
@@ -184,22 +279,17 @@ function startNotificationCheck(userId) {
     // Initial check
     updateAllNotifications(userId);
     
-    // Check every 30 seconds
-    if (notificationCheckInterval) {
-        clearInterval(notificationCheckInterval);
-    }
-    
-    notificationCheckInterval = setInterval(() => {
-        updateAllNotifications(userId);
-    }, 30000); // 30 seconds
+    // Poll every 30 seconds until the push channel is open
+    const socketOpen = notificationSocket && notificationSocketUser === userId
+        && notificationSocket.readyState === WebSocket.OPEN;
+    if (!socketOpen) startNotificationPolling(userId);
+    connectNotificationSocket(userId);
 }
 
 // Stop notification checking
 function stopNotificationCheck() {
-    if (notificationCheckInterval) {
-        clearInterval(notificationCheckInterval);
-        notificationCheckInterval = null;
-    }
+    stopNotificationPolling();
+    closeNotificationSocket();
 }
 
 // Clear notification for a specific type
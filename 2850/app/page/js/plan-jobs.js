@@ -0,0 +1,65 @@
+// Plan generation jobs
+// POST /plan/generate trả job_id ngay; poll /plan/jobs/{id} tới khi xong và báo tiến độ thật.
+
+const PLAN_JOB_POLL_MS = 1000;
+
+const PLAN_JOB_STAGE_LABELS = {
+    queued: 'Waiting for a free worker...',
+    context: 'Analyzing preferences...',
+    theme: 'Picking dishes for the theme...',
+    plan: 'Generating meal suggestions...',
+    recipes: 'Writing recipes...',
+    render: 'Optimizing recipes...',
+    persist: 'Finalizing your plan...',
+    done: 'Done!',
+};
+
+function planJobLabel(job) {
+    if (!job) return '';
+    const d = job.detail || {};
+    if (job.stage === 'recipes' && d.total) {
+        return `Writing recipes (${d.done || 0}/${d.total})...`;
+    }
+    return PLAN_JOB_STAGE_LABELS[job.stage] || 'Working...';
+}
+
+async function readPlanJobError(res) {
+    const txt = await res.text();
+    let msg = `HTTP ${res.status}: ${txt}`;
+    try { const j = JSON.parse(txt); msg = j.detail || j.message || msg; } catch (_) {}
+    return new Error(msg);
+}
+
+/**
+ * Gửi yêu cầu sinh plan rồi poll tới khi job xong.
+ * @param {string} base     API base (…/api)
+ * @param {object} payload  body của /plan/generate
+ * @param {object} opts     { query: '?user_id=…', onProgress: (percent, label, job) => void }
+ * @returns {Promise<object>} result của job (có plan_id)
+ */
+async function runPlanGenerateJob(base, payload, opts = {}) {
+    const onProgress = opts.onProgress || (() => {});
+    const res = await fetch(`${base}/plan/generate${opts.query || ''}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    });
+    if (!res.ok) throw await readPlanJobError(res);
+
+    const data = await res.json();
+    // Server cũ (hoặc ?wait=1) trả plan luôn
+    if (!data.job_id) return data;
+
+    onProgress(0, PLAN_JOB_STAGE_LABELS.queued, data);
+    while (true) {
+        await new Promise(r => setTimeout(r, PLAN_JOB_POLL_MS));
+        const jr = await fetch(`${base}/plan/jobs/${encodeURIComponent(data.job_id)}`, { cache: 'no-store' });
+        if (!jr.ok) throw await readPlanJobError(jr);
+        const job = await jr.json();
+        onProgress(job.percent || 0, planJobLabel(job), job);
+        if (job.status === 'done') return job.result || {};
+        if (job.status === 'error') throw new Error(job.error || 'Plan generation failed');
+    }
+}
+
+window.runPlanGenerateJob = runPlanGenerateJob;
@@ -6,6 +6,7 @@ from typing import Any, Dict, Optional, Tuple, List
 
 # Lưu ý:
 # - Module này giả định bạn có pool aiomysql và truyền vào các hàm bên dưới.
+#   Pool dùng chung: `await database.get_async_pool()` (DictCursor, autocommit).
 # - Nếu bạn đang dùng mysqlclient / mysql-connector thuần sync, bạn có thể viết
 #   wrapper sync tương tự (chỉ khác await và cách lấy cursor).
 
@@ -84,7 +85,7 @@ def _normalize_role_like(obj: Dict[str, Any]) -> Dict[str, Any]:
 
     if r.get("after_work") is True:
         tasks.append("after_work")
-        r["tasks"] = list({t for t in tasks if t})
+    r["tasks"] = list(dict.fromkeys(t for t in tasks if t))
 
     # before/after task chuẩn hoá
     if "before_task" in r and r["before_task"]:
@@ -97,8 +98,8 @@ def _normalize_role_like(obj: Dict[str, Any]) -> Dict[str, Any]:
         if r["after_task"] and r["after_task"] != "none" and "after_work" not in r["tasks"]:
             r["tasks"] = r["tasks"] + ["after_work"]
 
-        r.pop("pre_work", None)
-        r.pop("after_work", None)
+    r.pop("pre_work", None)
+    r.pop("after_work", None)
     return r
 
 def _merge_pref(default: Optional[Dict[str, Any]],
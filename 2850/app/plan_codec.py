@@ -0,0 +1,166 @@
+"""
+Storage codec cho plans.plan_json / plans.model_raw
+
+- Ghi: JSON/text lớn được nén và bọc trong 1 envelope JSON có version:
+      {"_codec": "z1",  "data": "<base64(zlib(utf-8 text))>"}
+      {"_codec": "zs1", "data": "<base64(zstd(utf-8 text))>"}   (khi có `zstandard`)
+  Envelope vẫn là JSON hợp lệ -> cột kiểu JSON/TEXT đều chứa được, không cần đổi schema.
+- Đọc: decode_text()/decode_json() nhận cả dữ liệu cũ (JSON/text thường) lẫn envelope.
+- Backfill dữ liệu cũ:  python -m app.plan_codec backfill [--batch 200] [--dry-run]
+"""
+import argparse
+import base64
+import json
+import logging
+import sys
+import zlib
+from typing import Any, Optional
+
+try:  # zstd là tuỳ chọn
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from .config import PLAN_CODEC_CONFIG
+
+logger = logging.getLogger("meal")
+
+CODEC_KEY = "_codec"
+_KEY_TOKEN = '"' + CODEC_KEY + '"'
+
+
+def _compress(codec: str, raw: bytes) -> bytes:
+    if codec == "zs1":
+        return zstandard.ZstdCompressor(level=PLAN_CODEC_CONFIG["level"]).compress(raw)
+    return zlib.compress(raw, PLAN_CODEC_CONFIG["level"])
+
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "z1":
+        return zlib.decompress(blob)
+    if codec == "zs1":
+        if zstandard is None:
+            raise RuntimeError("Plan payload is zstd-compressed but `zstandard` is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown plan codec: {codec}")
+
+
+def _write_codec() -> Optional[str]:
+    codec = PLAN_CODEC_CONFIG["codec"]
+    if codec == "zs1" and zstandard is None:
+        return "z1"
+    return codec if codec in ("z1", "zs1") else None
+
+
+def is_encoded(stored: Any) -> bool:
+    """
+    Envelope? Cột kiểu JSON của MySQL tự sắp xếp lại key ({"data": ..., "_codec": ...})
+    nên tìm "_codec" ở cả đầu lẫn cuối chuỗi (base64 không chứa dấu ").
+    """
+    if not isinstance(stored, str):
+        return False
+    s = stored.strip()
+    return s.startswith("{") and s.endswith("}") and (_KEY_TOKEN in s[:16] or _KEY_TOKEN in s[-24:])
+
+
+def encode(value: Any) -> Optional[str]:
+    """
+    dict/list -> JSON; str giữ nguyên. Nén nếu bật codec và đủ lớn (PLAN_CODEC_CONFIG['min_size']),
+    trả về chuỗi để lưu DB. None -> None.
+    """
+    if value is None:
+        return None
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    codec = _write_codec()
+    raw = text.encode("utf-8")
+    if codec is None or len(raw) < PLAN_CODEC_CONFIG["min_size"] or is_encoded(text):
+        return text
+    data = base64.b64encode(_compress(codec, raw)).decode("ascii")
+    return json.dumps({CODEC_KEY: codec, "data": data}, separators=(",", ":"))
+
+
+def decode_text(stored: Any) -> Optional[str]:
+    """Giá trị trong DB (envelope hoặc dữ liệu cũ) -> text gốc."""
+    if stored is None:
+        return None
+    if isinstance(stored, (bytes, bytearray)):
+        stored = stored.decode("utf-8")
+    if not is_encoded(stored):
+        return stored
+    env = json.loads(stored)
+    if not (isinstance(env, dict) and set(env) == {CODEC_KEY, "data"}):
+        return stored
+    return _decompress(env[CODEC_KEY], base64.b64decode(env["data"])).decode("utf-8")
+
+
+def decode_json(stored: Any, default: Any = None) -> Any:
+    """Giá trị trong DB -> object JSON; rỗng -> default. Lỗi parse vẫn raise (caller tự xử lý)."""
+    text = decode_text(stored)
+    if not text:
+        return default
+    return json.loads(text)
+
+
+# =====================================================================
+# Backfill: nén các dòng cũ trong bảng plans
+# =====================================================================
+
+def backfill(batch: int = 200, dry_run: bool = False) -> dict:
+    from .database import db_query, db_execute
+
+    if _write_codec() is None:
+        raise RuntimeError("PLAN_CODEC is 'none'; nothing to backfill")
+
+    last_id = 0
+    stats = {"scanned": 0, "updated": 0, "bytes_before": 0, "bytes_after": 0}
+    while True:
+        rows = db_query(
+            """
+            SELECT id, plan_json, model_raw FROM plans
+            WHERE id > %s ORDER BY id ASC LIMIT %s
+            """,
+            (last_id, batch),
+        )
+        if not rows:
+            break
+        for r in rows:
+            last_id = r["id"]
+            stats["scanned"] += 1
+            changes = {}
+            for col in ("plan_json", "model_raw"):
+                old = r.get(col)
+                if isinstance(old, (bytes, bytearray)):
+                    old = old.decode("utf-8")
+                if not old or is_encoded(old):
+                    continue
+                new = encode(old)
+                if new != old:
+                    changes[col] = new
+                    stats["bytes_before"] += len(old.encode("utf-8"))
+                    stats["bytes_after"] += len(new)
+            if changes and not dry_run:
+                cols = ", ".join(f"{c}=%s" for c in changes)
+                db_execute(f"UPDATE plans SET {cols} WHERE id=%s", (*changes.values(), r["id"]))
+            if changes:
+                stats["updated"] += 1
+        logger.info("plan_codec backfill: up to id %s, %s", last_id, stats)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.plan_codec")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bf = sub.add_parser("backfill", help="compress existing plans.plan_json / model_raw rows")
+    bf.add_argument("--batch", type=int, default=200)
+    bf.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.cmd == "backfill":
+        stats = backfill(batch=args.batch, dry_run=args.dry_run)
+        print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
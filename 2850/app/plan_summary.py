@@ -0,0 +1,156 @@
+"""
+Plan summary projection (dish count, dish names, headcount)
+
+- Tính lúc ghi plan (generate / ingest / regenerate) và lưu ở bảng nhỏ `plan_summaries`
+  (khoá plan_id) -> list plan không cần tải + giải nén plan_json.
+- Plan cũ chưa có summary: tính bù từ plan_json khi được list lần đầu rồi lưu lại.
+- Lỗi DB (thiếu quyền CREATE...) chỉ log cảnh báo, không làm hỏng việc lưu plan.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import plan_codec
+from .database import db_query, db_execute, db_execute_many
+
+logger = logging.getLogger("meal")
+
+_table_ready = False
+
+
+def ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    db_execute(
+        """
+        CREATE TABLE IF NOT EXISTS plan_summaries (
+          plan_id INT PRIMARY KEY,
+          family_id VARCHAR(64) NOT NULL,
+          dish_count INT NOT NULL DEFAULT 0,
+          dish_names_json TEXT NOT NULL,
+          headcount INT NULL,
+          KEY idx_plan_summaries_family (family_id, plan_id)
+        ) DEFAULT CHARSET=utf8mb4
+        """
+    )
+    _table_ready = True
+
+
+def summarize(plan_obj: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """{dish_count, dish_names, headcount} từ plan_json (LAN schema)."""
+    plan_obj = plan_obj if isinstance(plan_obj, dict) else {}
+    dishes = [d for d in (plan_obj.get("dishes") or []) if isinstance(d, dict)]
+    names = [str(d.get("name") or "").strip() for d in dishes]
+    meta = plan_obj.get("meta") if isinstance(plan_obj.get("meta"), dict) else {}
+    headcount = meta.get("headcount", meta.get("participants_display"))
+    try:
+        headcount = int(headcount) if headcount is not None else None
+    except (TypeError, ValueError):
+        headcount = None
+    return {
+        "dish_count": len(dishes),
+        "dish_names": [n for n in names if n],
+        "headcount": headcount,
+    }
+
+
+def _row(plan_id: int, family_id: str, summary: Dict[str, Any]) -> tuple:
+    return (
+        plan_id,
+        family_id,
+        summary["dish_count"],
+        json.dumps(summary["dish_names"], ensure_ascii=False),
+        summary["headcount"],
+    )
+
+
+def remember(plan_id: int, family_id: str, plan_obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Lưu summary cho plan vừa ghi; trả summary (None nếu lưu lỗi)."""
+    summary = summarize(plan_obj)
+    try:
+        ensure_table()
+        db_execute(
+            """
+            REPLACE INTO plan_summaries (plan_id, family_id, dish_count, dish_names_json, headcount)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            _row(plan_id, family_id, summary),
+        )
+    except Exception as e:
+        logger.warning("Saving plan summary %s failed: %s", plan_id, e)
+        return None
+    return summary
+
+
+def load_many(plan_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    plan_id -> summary cho các plan đã cho (1 query); plan chưa có summary được tính bù
+    từ plan_json (1 query nữa) và ghi lại bằng 1 câu multi-row INSERT.
+    """
+    ids: List[int] = [int(i) for i in plan_ids]
+    if not ids:
+        return {}
+    placeholders = ",".join(["%s"] * len(ids))
+    out: Dict[int, Dict[str, Any]] = {}
+    try:
+        ensure_table()
+        rows = db_query(
+            f"""
+            SELECT plan_id, dish_count, dish_names_json, headcount
+            FROM plan_summaries WHERE plan_id IN ({placeholders})
+            """,
+            tuple(ids),
+        )
+        for r in rows:
+            try:
+                names = json.loads(r.get("dish_names_json") or "[]")
+            except Exception:
+                names = []
+            out[int(r["plan_id"])] = {
+                "dish_count": r.get("dish_count") or 0,
+                "dish_names": names,
+                "headcount": r.get("headcount"),
+            }
+    except Exception as e:
+        logger.warning("Loading plan summaries failed: %s", e)
+
+    missing = [i for i in ids if i not in out]
+    if not missing:
+        return out
+
+    placeholders = ",".join(["%s"] * len(missing))
+    rows = db_query(
+        f"SELECT id, family_id, plan_json FROM plans WHERE id IN ({placeholders})",
+        tuple(missing),
+    )
+    backfill = []
+    for r in rows:
+        try:
+            plan_obj = plan_codec.decode_json(r.get("plan_json"), {})
+        except Exception:
+            plan_obj = {}
+        summary = summarize(plan_obj)
+        out[int(r["id"])] = summary
+        backfill.append(_row(int(r["id"]), r["family_id"], summary))
+    if backfill and _table_ready:
+        try:
+            db_execute_many(
+                """
+                INSERT IGNORE INTO plan_summaries (plan_id, family_id, dish_count, dish_names_json, headcount)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                backfill,
+            )
+        except Exception as e:
+            logger.warning("Backfilling plan summaries failed: %s", e)
+    return out
+
+
+def forget(plan_id: int) -> None:
+    """Xoá summary khi plan bị xoá."""
+    try:
+        ensure_table()
+        db_execute("DELETE FROM plan_summaries WHERE plan_id = %s", (plan_id,))
+    except Exception as e:
+        logger.warning("Deleting plan summary %s failed: %s", plan_id, e)
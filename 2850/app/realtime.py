@@ -0,0 +1,70 @@
+"""
+In-process pub/sub hub for WebSocket push (wheel sessions, notifications)
+
+- Topic = chuỗi bất kỳ, vd "wheel:<family_id>:<meal_date>:<meal_type>", "user:<user_id>".
+- Route WebSocket: await hub.connect(topic, ws) ... hub.disconnect(topic, ws).
+- Handler sync (chạy trong threadpool) gọi hub.publish(topic, message): đẩy sang event loop
+  bằng run_coroutine_threadsafe, không chặn request. Không có ai nghe -> no-op.
+- Chỉ trong 1 process: chạy nhiều worker thì mỗi worker chỉ push cho client nối vào nó.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Set
+
+logger = logging.getLogger("meal")
+
+
+class Hub:
+    def __init__(self):
+        self._topics: Dict[str, Set[Any]] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def connect(self, topic: str, websocket) -> None:
+        await websocket.accept()
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(websocket)
+
+    def disconnect(self, topic: str, websocket) -> None:
+        with self._lock:
+            subs = self._topics.get(topic)
+            if subs is not None:
+                subs.discard(websocket)
+                if not subs:
+                    del self._topics[topic]
+
+    def has_subscribers(self, topic: str) -> bool:
+        with self._lock:
+            return bool(self._topics.get(topic))
+
+    async def broadcast(self, topic: str, message: Dict[str, Any]) -> None:
+        with self._lock:
+            subs = list(self._topics.get(topic) or ())
+        for ws in subs:
+            try:
+                await ws.send_json(message)
+            except Exception:
+                # client đã đóng kết nối
+                self.disconnect(topic, ws)
+
+    def publish(self, topic: str, message: Dict[str, Any]) -> None:
+        """Gửi message cho mọi subscriber của topic; gọi được từ cả thread lẫn event loop."""
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self.has_subscribers(topic):
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        try:
+            if running is loop:
+                loop.create_task(self.broadcast(topic, message))
+            else:
+                asyncio.run_coroutine_threadsafe(self.broadcast(topic, message), loop)
+        except Exception as e:
+            logger.warning("Realtime publish failed (%s): %s", topic, e)
+
+
+hub = Hub()
@@ -0,0 +1,208 @@
+"""
+Dish recipe library: canonical recipes reused across plans
+
+- Mỗi món lưu 1 lần (ingredients + steps) trong bảng `recipes`, khoá theo name_key
+  (= norm_dish_name + casefold, UNIQUE index) để tra cứu nhanh.
+- Trước khi gọi LLM, wheel mode / forced menu tra thư viện; món mới do LLM sinh
+  được ghi lại ở background (không chặn request).
+- Lỗi DB (thiếu bảng, mất kết nối...) chỉ log cảnh báo -> coi như không có trong thư viện.
+"""
+import copy
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from .cache import LRUTTLCache
+from .database import db_query, db_execute, db_execute_many
+
+logger = logging.getLogger("meal")
+
+# RAM index name_key -> recipe (None = đã tra DB và không có)
+_INDEX = LRUTTLCache(maxsize=2000, ttl=3600)
+_NEGATIVE_TTL = 300
+_MISSING = object()
+
+# Ghi thư viện ở background, 1 thread là đủ (INSERT IGNORE rất nhẹ)
+_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recipe-lib")
+_table_ready = False
+
+_PLACEHOLDER_INGREDIENT = "ingredient a"
+
+
+def norm_dish_name(s: str) -> str:
+    """Normalize dish names (single spaces, trimmed)."""
+    return re.sub(r"\s+", " ", (s or "").strip())
+
+
+def dish_key(name: str) -> str:
+    """Khoá tra cứu thư viện: tên chuẩn hoá + casefold."""
+    return norm_dish_name(name).casefold()
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    db_execute(
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          name_key VARCHAR(255) NOT NULL,
+          name VARCHAR(255) NOT NULL,
+          category VARCHAR(64) NULL,
+          ingredients_json MEDIUMTEXT NOT NULL,
+          steps_json MEDIUMTEXT NOT NULL,
+          video_url VARCHAR(512) NULL,
+          source VARCHAR(32) NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          UNIQUE KEY uq_recipes_name_key (name_key)
+        ) DEFAULT CHARSET=utf8mb4
+        """
+    )
+    _table_ready = True
+
+
+def _row_to_recipe(row: dict) -> dict:
+    name = row.get("name") or ""
+    return {
+        "name": name,
+        "category": row.get("category") or "Hot dish",
+        "ingredients": json.loads(row.get("ingredients_json") or "[]"),
+        "steps": json.loads(row.get("steps_json") or "[]"),
+        "image_url": "",
+        "video_url": row.get("video_url") or f"https://www.youtube.com/results?search_query={name.replace(' ', '+')}",
+        "similarity_note": "",
+    }
+
+
+def is_placeholder(recipe: Optional[dict]) -> bool:
+    """Recipe khung (fallback) hoặc thiếu nội dung -> không đưa vào thư viện."""
+    if not isinstance(recipe, dict):
+        return True
+    ingredients = recipe.get("ingredients") or []
+    steps = [s for s in (recipe.get("steps") or []) if str(s).strip()]
+    if not ingredients or not steps:
+        return True
+    first = ingredients[0].get("name", "") if isinstance(ingredients[0], dict) else str(ingredients[0])
+    return len(ingredients) == 1 and first.strip().lower() == _PLACEHOLDER_INGREDIENT
+
+
+def lookup_many(names: Iterable[str]) -> Dict[str, dict]:
+    """
+    Tra nhiều món 1 lượt (RAM trước, phần còn lại 1 query IN (...)).
+    Trả dict name_key -> recipe (bản sao, caller được phép sửa).
+    """
+    keys: List[str] = []
+    for n in names or []:
+        k = dish_key(n)
+        if k and k not in keys:
+            keys.append(k)
+
+    found: Dict[str, dict] = {}
+    todo: List[str] = []
+    for k in keys:
+        hit = _INDEX.get(k, _MISSING)
+        if hit is _MISSING:
+            todo.append(k)
+        elif hit is not None:
+            found[k] = copy.deepcopy(hit)
+
+    if todo:
+        try:
+            _ensure_table()
+            placeholders = ",".join(["%s"] * len(todo))
+            rows = db_query(
+                f"""
+                SELECT name_key, name, category, ingredients_json, steps_json, video_url
+                FROM recipes WHERE name_key IN ({placeholders})
+                """,
+                tuple(todo),
+            )
+        except Exception as e:
+            logger.warning("Recipe library lookup failed: %s", e)
+            return found
+        by_key = {r["name_key"]: _row_to_recipe(r) for r in rows}
+        for k in todo:
+            recipe = by_key.get(k)
+            if recipe is None:
+                _INDEX.set(k, None, ttl=_NEGATIVE_TTL)
+            else:
+                _INDEX.set(k, recipe)
+                found[k] = copy.deepcopy(recipe)
+
+    if keys:
+        logger.info("Recipe library: %s/%s hit", len(found), len(keys))
+    return found
+
+
+def lookup(name: str) -> Optional[dict]:
+    """Tra 1 món theo tên; None nếu chưa có trong thư viện."""
+    return lookup_many([name]).get(dish_key(name))
+
+
+def _write(entries: List[tuple]) -> None:
+    try:
+        _ensure_table()
+        db_execute_many(
+            """
+            INSERT IGNORE INTO recipes
+              (name_key, name, category, ingredients_json, steps_json, video_url, source)
+            VALUES (%s,%s,%s,%s,%s,%s,%s)
+            """,
+            entries,
+        )
+    except Exception as e:
+        logger.warning("Recipe library write failed: %s", e)
+
+
+def remember(recipe: dict, name: Optional[str] = None, source: str = "llm") -> None:
+    """Ghi 1 recipe vào thư viện (xem remember_many)."""
+    remember_many([(name, recipe)], source=source)
+
+
+def remember_many(items: Iterable[tuple], source: str = "llm") -> None:
+    """
+    items: [(name_or_None, recipe), ...] — name (nếu có) là tên dùng để tra cứu sau này,
+    mặc định lấy recipe['name']. Bỏ qua recipe khung. Món đã có giữ nguyên bản đầu tiên.
+    Serialize ngay (caller có thể sửa recipe sau đó), ghi DB ở background.
+    """
+    entries: List[tuple] = []
+    for name, recipe in items or []:
+        if is_placeholder(recipe):
+            continue
+        display = norm_dish_name(recipe.get("name") or name or "")
+        key = dish_key(name or display)
+        if not key or not display:
+            continue
+        if _INDEX.get(key) is not None:
+            continue
+        ingredients = [
+            {"name": i.get("name", ""), "amount": i.get("amount", "")} if isinstance(i, dict)
+            else {"name": str(i), "amount": ""}
+            for i in recipe.get("ingredients") or []
+        ]
+        steps = [s if isinstance(s, str) else (s.get("description") or "") for s in recipe.get("steps") or []]
+        canonical = {
+            "name": display,
+            "category": recipe.get("category") or "Hot dish",
+            "ingredients": ingredients,
+            "steps": steps,
+            "image_url": "",
+            "video_url": recipe.get("video_url")
+            or f"https://www.youtube.com/results?search_query={display.replace(' ', '+')}",
+            "similarity_note": "",
+        }
+        _INDEX.set(key, canonical)
+        entries.append((
+            key[:255],
+            display[:255],
+            canonical["category"][:64],
+            json.dumps(ingredients, ensure_ascii=False),
+            json.dumps(steps, ensure_ascii=False),
+            canonical["video_url"][:512],
+            source,
+        ))
+    if entries:
+        _WRITER.submit(_write, entries)
@@ -13,7 +13,8 @@ from ..models import (
     RemoveMemberRequest, FamilyInfo, CreateMealCodeRequest, MealCodeInfo,
     FamilyMealTimes
 )
-from ..database import db_query, db_execute
+from ..database import db_query, db_execute, db_transaction
+from .message import push_unread, push_new_member
 from ..utils import (
     validate_family_id, generate_family_id, generate_meal_code, parse_meal_code,
     log_api_call, log_error
@@ -89,7 +90,7 @@ def join_family(request: JoinFamilyRequest):
             SELECT 1 FROM family_memberships
             WHERE family_id=%s AND user_id=%s
             LIMIT 1
-        """, (request.family_id, request.user_id))
+        """, (request.family_id, request.user_id), prepared=True)
         if existing:
             raise HTTPException(400, "You are already a member of this family")
 
@@ -100,6 +101,7 @@ def join_family(request: JoinFamilyRequest):
             INSERT INTO family_memberships (family_id, user_id, role, display_name)
             VALUES (%s, %s, %s, %s)
         """, (request.family_id, request.user_id, role, display_name))
+        push_new_member(request.family_id, request.user_id, display_name)
 
         return {
             "ok": True,
@@ -124,39 +126,41 @@ def create_family(request: CreateFamilyRequest):
         if not validate_family_id(family_id):
             raise HTTPException(400, "Invalid family ID format")
 
-        existing_family = db_query("SELECT family_id FROM families WHERE family_id=%s",
-                                   (family_id,))
-        if existing_family:
-            raise HTTPException(400, "Family ID already exists")
-
-        user_families = db_query("""
-            SELECT f.family_name FROM families f
-            JOIN family_memberships fm ON f.family_id = fm.family_id
-            WHERE fm.user_id = %s AND f.family_name = %s
-        """, (request.user_id, request.family_name))
-        if user_families:
-            raise HTTPException(400, "You already have a family with this name")
-
-        user_exists = db_query("SELECT user_id FROM users WHERE user_id=%s",
-                               (request.user_id,))
-        if not user_exists:
-            raise HTTPException(400, f"User {request.user_id} does not exist")
-
-        db_execute("""
-            INSERT INTO families (family_id, family_name, user_id)
-            VALUES (%s, %s, %s)
-        """, (family_id, request.family_name, request.user_id))
-
-        db_execute("""
-            INSERT INTO family_memberships (family_id, user_id, role, display_name)
-            VALUES (%s, %s, %s, %s)
-        """, (family_id, request.user_id, "holder", request.family_name))
-
-        # seed mặc định cho bảng settings (nếu chưa có)
-        db_execute("""
-            INSERT IGNORE INTO family_meal_settings (family_id)
-            VALUES (%s)
-        """, (family_id,))
+        # Kiểm tra + 3 insert trên 1 connection, commit 1 lần (lỗi giữa chừng -> rollback hết)
+        with db_transaction() as tx:
+            existing_family = tx.query("SELECT family_id FROM families WHERE family_id=%s",
+                                       (family_id,))
+            if existing_family:
+                raise HTTPException(400, "Family ID already exists")
+
+            user_families = tx.query("""
+                SELECT f.family_name FROM families f
+                JOIN family_memberships fm ON f.family_id = fm.family_id
+                WHERE fm.user_id = %s AND f.family_name = %s
+            """, (request.user_id, request.family_name))
+            if user_families:
+                raise HTTPException(400, "You already have a family with this name")
+
+            user_exists = tx.query("SELECT user_id FROM users WHERE user_id=%s",
+                                   (request.user_id,))
+            if not user_exists:
+                raise HTTPException(400, f"User {request.user_id} does not exist")
+
+            tx.execute("""
+                INSERT INTO families (family_id, family_name, user_id)
+                VALUES (%s, %s, %s)
+            """, (family_id, request.family_name, request.user_id))
+
+            tx.execute("""
+                INSERT INTO family_memberships (family_id, user_id, role, display_name)
+                VALUES (%s, %s, %s, %s)
+            """, (family_id, request.user_id, "holder", request.family_name))
+
+            # seed mặc định cho bảng settings (nếu chưa có)
+            tx.execute("""
+                INSERT IGNORE INTO family_meal_settings (family_id)
+                VALUES (%s)
+            """, (family_id,))
 
         return {
             "ok": True,
@@ -187,7 +191,7 @@ def invite_member(request: InviteMemberRequest):
         existing_member = db_query("""
             SELECT user_id FROM family_memberships
             WHERE family_id=%s AND user_id=%s
-        """, (request.family_id, request.invited_user_id))
+        """, (request.family_id, request.invited_user_id), prepared=True)
         if existing_member:
             raise HTTPException(400, "User is already a member of this family")
 
@@ -211,6 +215,9 @@ def invite_member(request: InviteMemberRequest):
         except Exception as e:
             logger.warning("Failed to send invitation message: %s", e)
 
+        push_unread([request.invited_user_id])
+        push_new_member(request.family_id, request.invited_user_id, user[0]["user_name"])
+
         return {"ok": True, "message": f"User {user[0]['user_name']} has been invited to the family"}
     except HTTPException:
         raise
@@ -222,13 +229,14 @@ def invite_member(request: InviteMemberRequest):
 def delete_family(request: DeleteFamilyRequest):
     try:
         log_api_call("/family/delete", "DELETE", request.family_id)
-        family = db_query("SELECT family_id FROM families WHERE family_id=%s",
-                          (request.family_id,))
-        if not family:
-            raise HTTPException(404, "Family not found")
-
-        db_execute("DELETE FROM family_memberships WHERE family_id=%s", (request.family_id,))
-        db_execute("DELETE FROM families WHERE family_id=%s", (request.family_id,))
+        with db_transaction() as tx:
+            family = tx.query("SELECT family_id FROM families WHERE family_id=%s FOR UPDATE",
+                              (request.family_id,))
+            if not family:
+                raise HTTPException(404, "Family not found")
+
+            tx.execute("DELETE FROM family_memberships WHERE family_id=%s", (request.family_id,))
+            tx.execute("DELETE FROM families WHERE family_id=%s", (request.family_id,))
         return {"ok": True, "message": "Family deleted successfully"}
     except HTTPException:
         raise
@@ -268,7 +276,7 @@ def get_family_members(family_id: str):
             JOIN users u ON fm.user_id = u.user_id
             WHERE fm.family_id = %s
             ORDER BY fm.role, fm.display_name
-        """, (family_id,))
+        """, (family_id,), prepared=True)
         return members
     except Exception as e:
         log_error(e, f"get_family_members for family {family_id}")
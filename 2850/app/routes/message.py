@@ -1,16 +1,96 @@
 """
 Message and notification API routes
+
+Realtime: WebSocket /user/{user_id}/ws (topic "user:<user_id>" trên hub).
+Mỗi khi ghi messages / family_memberships, server push
+  {"type": "unread", "unread_count": N}
+  {"type": "new_member", "family_id", "user_id", "display_name"}
+cho các user đang nối; client không nối thì vẫn poll như cũ.
 """
 import json
 import logging
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query
-from ..database import db_query, db_execute
+from typing import Dict, Iterable, List
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from ..database import db_query, db_execute, db_execute_many, db_query_async
+from ..realtime import hub
 from ..utils import log_api_call, log_error
 
 logger = logging.getLogger("meal")
 router = APIRouter(tags=["message"])
 
+# ---------- realtime helpers ----------
+
+def _user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def _unread_counts(user_ids: List[str]) -> Dict[str, int]:
+    """Đếm tin chưa đọc cho nhiều user bằng 1 query GROUP BY."""
+    if not user_ids:
+        return {}
+    placeholders = ",".join(["%s"] * len(user_ids))
+    rows = db_query(f"""
+        SELECT user_id, COUNT(*) AS count
+        FROM messages
+        WHERE user_id IN ({placeholders}) AND read_status = false
+        GROUP BY user_id
+    """, tuple(user_ids))
+    counts = {uid: 0 for uid in user_ids}
+    for r in rows or []:
+        counts[r["user_id"]] = int(r["count"])
+    return counts
+
+
+def push_unread(user_ids: Iterable[str]) -> None:
+    """Push số tin chưa đọc mới cho các user đang nối WebSocket (không ai nghe -> không query)."""
+    listening = [uid for uid in dict.fromkeys(user_ids) if uid and hub.has_subscribers(_user_topic(uid))]
+    if not listening:
+        return
+    try:
+        for uid, count in _unread_counts(listening).items():
+            hub.publish(_user_topic(uid), {"type": "unread", "unread_count": count})
+    except Exception as e:
+        logger.warning("push_unread failed: %s", e)
+
+
+def push_new_member(family_id: str, user_id: str, display_name: str = None) -> None:
+    """Báo cho các thành viên khác của family (đang nối) rằng có người mới vào."""
+    try:
+        members = db_query("""
+            SELECT user_id FROM family_memberships
+            WHERE family_id = %s AND user_id != %s
+        """, (family_id, user_id))
+    except Exception as e:
+        logger.warning("push_new_member failed: %s", e)
+        return
+    event = {"type": "new_member", "family_id": family_id, "user_id": user_id,
+             "display_name": display_name}
+    for m in members or []:
+        hub.publish(_user_topic(m["user_id"]), event)
+
+@router.websocket("/user/{user_id}/ws")
+async def notifications_ws(websocket: WebSocket, user_id: str):
+    """
+    Kênh thông báo của 1 user. Khi nối: gửi {"type":"unread","unread_count":N};
+    sau đó nhận unread / new_member mỗi khi có thay đổi.
+    Client không cần gửi gì (có thể gửi "ping" để giữ kết nối).
+    """
+    topic = _user_topic(user_id)
+    await hub.connect(topic, websocket)
+    try:
+        counts = await run_in_threadpool(_unread_counts, [user_id])
+        await websocket.send_json({"type": "unread", "unread_count": counts.get(user_id, 0)})
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        log_error(e, f"notifications_ws for user {user_id}")
+    finally:
+        hub.disconnect(topic, websocket)
+
 @router.get("/user/{user_id}")
 def get_user_messages(user_id: str):
     """获取用户的所有消息"""
@@ -43,12 +123,12 @@ def get_user_messages(user_id: str):
         raise HTTPException(500, "Internal server error")
 
 @router.get("/user/{user_id}/unread-count")
-def get_unread_message_count(user_id: str):
-    """获取用户未读消息数量"""
+async def get_unread_message_count(user_id: str):
+    """获取用户未读消息数量（async：轮询最频繁的接口，直接跑在 event loop 上）"""
     try:
         log_api_call(f"/messages/user/{user_id}/unread-count", "GET")
         
-        result = db_query("""
+        result = await db_query_async("""
             SELECT COUNT(*) as count
             FROM messages 
             WHERE user_id = %s AND read_status = false
@@ -66,11 +146,14 @@ def mark_message_read(message_id: int):
     try:
         log_api_call(f"/messages/{message_id}/read", "POST")
         
+        owner = db_query("SELECT user_id FROM messages WHERE id = %s", (message_id,))
         db_execute("""
             UPDATE messages 
             SET read_status = true 
             WHERE id = %s
         """, (message_id,))
+        if owner:
+            push_unread([owner[0]["user_id"]])
         
         return {"ok": True, "message": "Message marked as read"}
     except Exception as e:
@@ -88,6 +171,7 @@ def mark_all_messages_read(user_id: str):
             SET read_status = true 
             WHERE user_id = %s
         """, (user_id,))
+        push_unread([user_id])
         
         return {"ok": True, "message": "All messages marked as read"}
     except Exception as e:
@@ -110,6 +194,7 @@ def send_message(
             INSERT INTO messages (user_id, type, title, content, action_url, read_status, created_at)
             VALUES (%s, %s, %s, %s, %s, false, %s)
         """, (user_id, message_type, title, content, action_url, datetime.now()))
+        push_unread([user_id])
         
         return {"ok": True, "message_id": message_id, "message": "Message sent successfully"}
     except Exception as e:
@@ -163,20 +248,20 @@ def notify_plan_generated(
         family = db_query("SELECT family_name FROM families WHERE family_id = %s", (family_id,))
         family_name = family[0]["family_name"] if family else family_id
         
-        # 为每个用户发送通知（已去重）
-        notification_count = 0
-        for user_id in user_ids_to_notify:
-            title = f"Meal Plan Generated - {meal_type.title()}"
-            content = f"Your {meal_type} plan for {family_name} on {meal_date} has been generated successfully! Click to view the detailed meal plan."
-            action_url = f"history.html?tab=plans&planId={plan_id}"
-            
-            db_execute("""
-                INSERT INTO messages (user_id, type, title, content, action_url, read_status, created_at)
-                VALUES (%s, %s, %s, %s, %s, false, %s)
-            """, (user_id, "plan_generated", title, content, action_url, datetime.now()))
-            
-            notification_count += 1
+        # 为每个用户发送通知（已去重）：一次多行 INSERT，一个事务
+        title = f"Meal Plan Generated - {meal_type.title()}"
+        content = f"Your {meal_type} plan for {family_name} on {meal_date} has been generated successfully! Click to view the detailed meal plan."
+        action_url = f"history.html?tab=plans&planId={plan_id}"
+        now = datetime.now()
+        rows = [(user_id, "plan_generated", title, content, action_url, now)
+                for user_id in user_ids_to_notify]
+        db_execute_many("""
+            INSERT INTO messages (user_id, type, title, content, action_url, read_status, created_at)
+            VALUES (%s, %s, %s, %s, %s, false, %s)
+        """, rows)
+        notification_count = len(rows)
         
+        push_unread(user_ids_to_notify)
         logger.info(f"Plan {plan_id} notifications sent to {notification_count} users (submission users + family members, deduplicated)")
         return {"ok": True, "message": f"Notifications sent to {notification_count} users"}
     except Exception as e:
@@ -1,28 +1,74 @@
 """
 Plan generation and management API routes
 """
+import asyncio
 import json
 import logging
 import datetime
+import functools
 import re
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 
 from ..models import GenerateRequest, PlanIngest  # (không cần model mới cho /suggest)
-from ..database import db_query, db_execute
+from ..database import db_query, db_query_or_primary, db_execute, db_iter, db_transaction
 from ..utils import coerce_to_lan_schema, render_plan_html, log_api_call, log_error, get_meal_time_by_type
-from ..config import OPENAI_CONFIG
+from ..config import OPENAI_CONFIG, LLM_CACHE_CONFIG, PLAN_JOB_CONFIG, IMAGE_SCRAPER_CONFIG
+from ..cache import LRUTTLCache, TieredCache, content_key, make_store
+from .. import image_scraper, plan_codec, plan_summary
+from .. import recipes as recipe_lib
+from ..recipes import norm_dish_name as _norm_dish_name
+from ..jobs import JobQueue, SingleFlight
+from ..wheel_snapshot import load_wheel_snapshot
 
 
 # --- OpenAI client (giữ nguyên cách bạn đang dùng) ---
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 client = OpenAI(
     api_key=OPENAI_CONFIG["api_key"],
     base_url=OPENAI_CONFIG["base_url"],
 )
+# Client async cho các route async: chờ LLM không chiếm thread của threadpool
+aclient = AsyncOpenAI(
+    api_key=OPENAI_CONFIG["api_key"],
+    base_url=OPENAI_CONFIG["base_url"],
+)
+
+# Pool dùng chung cho các lượt gọi recipe song song (giới hạn tổng số request LLM đồng thời)
+_LLM_POOL = ThreadPoolExecutor(
+    max_workers=max(1, OPENAI_CONFIG.get("max_workers") or 4),
+    thread_name_prefix="llm-recipe",
+)
+# Giới hạn tương ứng cho nhánh async
+_ALLM_SEM = asyncio.Semaphore(max(1, OPENAI_CONFIG.get("max_workers") or 4))
+# Cache response LLM theo nội dung prompt (recipe chính xác + danh sách món theo theme)
+LLM_CACHE = TieredCache(
+    "llm",
+    maxsize=LLM_CACHE_CONFIG["maxsize"],
+    ttl=LLM_CACHE_CONFIG["ttl"],
+    store=make_store(LLM_CACHE_CONFIG["backend"], LLM_CACHE_CONFIG["path"]),
+    enabled=LLM_CACHE_CONFIG["backend"].strip().lower() != "off",
+    max_rows=LLM_CACHE_CONFIG["max_rows"],
+)
+# Hàng đợi job sinh plan (POST /generate trả job_id ngay, FE poll GET /jobs/{id})
+PLAN_JOBS = JobQueue(
+    max_workers=PLAN_JOB_CONFIG["workers"],
+    name="plan-job",
+    ttl=PLAN_JOB_CONFIG["ttl"],
+)
+# Gộp các lượt /generate?wait=true giống hệt nhau đang chạy cùng lúc
+_GENERATE_FLIGHTS = SingleFlight()
+# Pre-warm ảnh món sau khi lưu plan (1 thread; bản thân image_scraper đã scrape song song)
+_IMG_PREWARM = ThreadPoolExecutor(max_workers=1, thread_name_prefix="img-prewarm")
 
 ENGLISH_SYSTEM_PROMPT = (
     "You are Meal Planner AI. ALWAYS respond in ENGLISH only, regardless of the "
@@ -136,32 +182,20 @@ def get_meal_time(meal_type: str) -> str:
 
 def _wheel_load_candidates(family_id: str, meal_date: str, meal_type: str):
     """
-    Đọc danh sách ứng viên từ wheel_candidates + tổng votes từ wheel_votes.
-    Trả về list[{id,name,votes,proposer_user_id,proposer_name}].
+    Danh sách ứng viên + tổng votes (snapshot chung với routes/wheel.py, 1 query).
+    Trả về list[{id,name,votes,proposer_user_id,proposer_name}] theo id tăng dần.
     """
-    rows = db_query(
-        """
-        SELECT c.id,
-               c.name,
-               c.proposer_user_id,
-               c.proposer_name,
-               (SELECT COUNT(*) FROM wheel_votes v WHERE v.candidate_id = c.id) AS votes
-        FROM wheel_candidates c
-        WHERE family_id=%s AND meal_date=%s AND meal_type=%s AND c.deleted_at IS NULL
-        ORDER BY c.id ASC
-        """,
-        (family_id, meal_date, meal_type),
-    )
-    out = []
-    for r in rows or []:
-        out.append({
-            "id": int(r["id"]),
-            "name": r["name"],
-            "votes": int(r.get("votes") or 0),
-            "proposer_user_id": r.get("proposer_user_id"),
-            "proposer_name": r.get("proposer_name"),
-        })
-    return out
+    snapshot = load_wheel_snapshot(family_id, meal_date, meal_type)
+    return [
+        {
+            "id": c["id"],
+            "name": c["name"],
+            "votes": c["votes"],
+            "proposer_user_id": c["proposer_user_id"],
+            "proposer_name": c["proposer_name"],
+        }
+        for c in snapshot["candidates"]
+    ]
 
 
 def _try_fetch_winner_from_db(family_id: str, meal_date: str, meal_type: str):
@@ -187,16 +221,55 @@ def _try_fetch_winner_from_db(family_id: str, meal_date: str, meal_type: str):
         return None
 
 
-def _wheel_build_context(family_id: str, meal_date: str, meal_type: str):
+class WheelContext:
+    """
+    Ngữ cảnh wheel theo request (1 phiên family_id/meal_date/meal_type), load lười:
+      - candidates: ứng viên + votes (1 query, lần đầu truy cập)
+      - picked_winner: winner đã quay từ wheel_picks (1 query, lần đầu truy cập)
+      - state: kết quả _wheel_build_context tính từ 2 thứ trên
+    Tạo 1 lần ở route rồi truyền qua cả pipeline sinh plan để không đọc lại DB.
+    """
+
+    def __init__(self, family_id: str, meal_date: str, meal_type: str):
+        self.family_id = family_id
+        self.meal_date = meal_date
+        self.meal_type = meal_type
+
+    @functools.cached_property
+    def candidates(self) -> list[dict]:
+        return _wheel_load_candidates(self.family_id, self.meal_date, self.meal_type)
+
+    @functools.cached_property
+    def picked_winner(self) -> str | None:
+        return _try_fetch_winner_from_db(self.family_id, self.meal_date, self.meal_type)
+
+    @functools.cached_property
+    def state(self) -> dict:
+        return _wheel_build_context(self.family_id, self.meal_date, self.meal_type, wctx=self)
+
+    def find_candidate(self, name: str | None) -> dict | None:
+        """Ứng viên trùng tên (không phân biệt hoa thường), None nếu không có."""
+        key = (name or "").strip().lower()
+        if not key:
+            return None
+        for c in self.candidates:
+            if (c["name"] or "").strip().lower() == key:
+                return c
+        return None
+
+
+def _wheel_build_context(family_id: str, meal_date: str, meal_type: str, wctx: WheelContext | None = None):
     """
-    Tạo ngữ cảnh:
+    Tạo ngữ cảnh (đọc candidates / wheel_picks qua `wctx` nếu có, tránh load lại):
       - participants: list unique proposer_user_id đã đề cử món (tức là 'tham gia vòng xoay')
       - nominations: map user_id -> các món họ đề cử (≤2) kèm votes (sort desc)
       - winner_dish: ưu tiên lấy từ wheel_picks; nếu không có -> ứng viên votes cao nhất
       - winner_proposer: proposer_user_id của winner (nếu xác định được)
       - wheel_all_names: set tất cả tên món xuất hiện trên wheel
     """
-    cands = _wheel_load_candidates(family_id, meal_date, meal_type)
+    if wctx is None:
+        wctx = WheelContext(family_id, meal_date, meal_type)
+    cands = wctx.candidates
     participants_order = []            # giữ thứ tự gặp lần đầu
     seen = set()
     nominations = {}
@@ -218,7 +291,7 @@ def _wheel_build_context(family_id: str, meal_date: str, meal_type: str):
         nominations[uid] = arr[:2]
 
     # winner: ưu tiên bảng wheel_picks; nếu không có -> max votes
-    winner_name = _try_fetch_winner_from_db(family_id, meal_date, meal_type)
+    winner_name = wctx.picked_winner
     winner_proposer = None
     if not winner_name and cands:
         best = sorted(cands, key=lambda x: (-x["votes"], x["id"]))[0]
@@ -310,89 +383,267 @@ def _suggest_variant_name(base: str, forbid: set[str]) -> str:
             return cand
         i += 1
 
-def _llm_one_recipe(prompt: str, fallback_name: str | None = None) -> dict:
+def _recipe_request(prompt: str) -> dict:
+    """Tham số chat.completions cho 1 recipe (dùng chung cho client sync/async)."""
+    return dict(
+        model=OPENAI_CONFIG["model"],
+        messages=[
+            {"role": "system", "content": ENGLISH_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt + "\n\nReturn all fields strictly in English."},
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.6,
+        max_tokens=900,
+    )
+
+def _recipe_from_content(content: str | None, fallback_name: str | None = None) -> dict:
+    """Parse JSON recipe từ LLM và chuẩn hoá về dạng tối thiểu mà coerce_to_lan_schema hiểu được."""
+    data = json.loads(content or "{}")
+    name = (data.get("name") or fallback_name or "").strip() or (fallback_name or "Dish")
+    ingredients = data.get("ingredients") or []
+    steps = data.get("steps") or []
+    return {
+        "name": name,
+        "category": "Hot dish",
+        "ingredients": [
+            {"name": i.get("name",""), "amount": i.get("quantity_metric","")}
+            if isinstance(i, dict) else {"name": str(i), "amount": ""}
+            for i in ingredients
+        ],
+        "steps": [s if isinstance(s, str) else (s.get("description") or "") for s in steps],
+        "image_url": "",
+        "video_url": f"https://www.youtube.com/results?search_query={name.replace(' ', '+')}",
+        "similarity_note": "",  # <-- FIX: không dùng biến chưa định nghĩa
+    }
+
+def _llm_cache_key(req: dict) -> str:
+    """Khoá cache = hash(model, system prompt, user prompt, temperature làm tròn 0.1)."""
+    msgs = req.get("messages") or []
+    system = "\n".join(m.get("content") or "" for m in msgs if m.get("role") == "system")
+    user = "\n".join(m.get("content") or "" for m in msgs if m.get("role") == "user")
+    temp_bucket = round(float(req.get("temperature") or 0.0), 1)
+    return content_key(req.get("model"), system, user, temp_bucket)
+
+def _cached_completion(req: dict, parse, use_cache: bool = True):
+    """
+    chat.completions có cache: hit -> parse nội dung đã lưu, không gọi mạng.
+    Chỉ lưu khi parse thành công (không cache fallback / JSON hỏng). Lỗi -> raise cho caller.
+    """
+    key = _llm_cache_key(req) if use_cache else None
+    if key:
+        content = LLM_CACHE.get(key)
+        if content is not None:
+            try:
+                return parse(content)
+            except Exception:
+                LLM_CACHE.delete(key)
+    r = client.chat.completions.create(**req)
+    content = r.choices[0].message.content
+    out = parse(content)
+    if key:
+        LLM_CACHE.set(key, content)
+    return out
+
+async def _acached_completion(req: dict, parse, use_cache: bool = True):
+    """Bản async của _cached_completion (store bền truy cập qua threadpool)."""
+    key = _llm_cache_key(req) if use_cache else None
+    if key:
+        content = await run_in_threadpool(LLM_CACHE.get, key)
+        if content is not None:
+            try:
+                return parse(content)
+            except Exception:
+                await run_in_threadpool(LLM_CACHE.delete, key)
+    r = await aclient.chat.completions.create(**req)
+    content = r.choices[0].message.content
+    out = parse(content)
+    if key:
+        await run_in_threadpool(LLM_CACHE.set, key, content)
+    return out
+
+def _llm_one_recipe(prompt: str, fallback_name: str | None = None, cache: bool = False) -> dict:
     """
     Gọi LLM một lần để lấy 1 recipe JSON.
+    `cache=True` cho prompt chính xác (_craft_prompt_exact) -> dùng LLM_CACHE.
     Nếu lỗi hoặc parse fail -> trả khung recipe tối thiểu.
     """
     try:
-        r = client.chat.completions.create(
-            model=OPENAI_CONFIG["model"],
-            messages=[
-                {"role": "system", "content": ENGLISH_SYSTEM_PROMPT},
-                {"role": "user", "content": prompt + "\n\nReturn all fields strictly in English."},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.6,
-            max_tokens=900,
+        return _cached_completion(
+            _recipe_request(prompt), lambda c: _recipe_from_content(c, fallback_name), use_cache=cache
         )
-        data = json.loads(r.choices[0].message.content or "{}")
-        name = (data.get("name") or fallback_name or "").strip() or (fallback_name or "Dish")
-        ingredients = data.get("ingredients") or []
-        steps = data.get("steps") or []
-        # Chuẩn hoá về dạng tối thiểu mà coerce_to_lan_schema hiểu được
-        return {
-            "name": name,
-            "category": "Hot dish",
-            "ingredients": [
-                {"name": i.get("name",""), "amount": i.get("quantity_metric","")}
-                if isinstance(i, dict) else {"name": str(i), "amount": ""}
-                for i in ingredients
-            ],
-            "steps": [s if isinstance(s, str) else (s.get("description") or "") for s in steps],
-            "image_url": "",
-            "video_url": f"https://www.youtube.com/results?search_query={name.replace(' ', '+')}",
-            "similarity_note": "",  # <-- FIX: không dùng biến chưa định nghĩa
-        }
     except Exception as e:
         logger.warning("LLM one-recipe failed, fallback. err=%s", e)
-        # Fallback recipe khung
-        nm = fallback_name or "Dish"
-        return {
-            "name": nm,
-            "category": "Hot dish",
-            "ingredients": [{"name": "Ingredient A", "amount": "100g"}],
-            "steps": [f"Step {k+1}: Instruction" for k in range(5)],
-            "image_url": "",
-            "video_url": f"https://www.youtube.com/results?search_query={nm.replace(' ', '+')}",
-            "similarity_note": "",
-        }
+        return _fallback_recipe(fallback_name)
 
-def _generate_plan_wheel_mode(
+async def _allm_one_recipe(prompt: str, fallback_name: str | None = None, cache: bool = False) -> dict:
+    """Bản async của _llm_one_recipe (AsyncOpenAI)."""
+    try:
+        return await _acached_completion(
+            _recipe_request(prompt), lambda c: _recipe_from_content(c, fallback_name), use_cache=cache
+        )
+    except Exception as e:
+        logger.warning("LLM one-recipe (async) failed, fallback. err=%s", e)
+        return _fallback_recipe(fallback_name)
+
+def _fallback_recipe(fallback_name: str | None = None) -> dict:
+    """Recipe khung tối thiểu khi LLM lỗi hoặc quá hạn."""
+    nm = fallback_name or "Dish"
+    return {
+        "name": nm,
+        "category": "Hot dish",
+        "ingredients": [{"name": "Ingredient A", "amount": "100g"}],
+        "steps": [f"Step {k+1}: Instruction" for k in range(5)],
+        "image_url": "",
+        "video_url": f"https://www.youtube.com/results?search_query={nm.replace(' ', '+')}",
+        "similarity_note": "",
+    }
+
+def _llm_fan_out(
+    jobs: list[tuple[str, str | None, bool]],
+    deadline: float | None = None,
+    on_done=None,
+) -> list[dict | None]:
+    """
+    Gọi _llm_one_recipe song song cho nhiều (prompt, fallback_name, cache) trên _LLM_POOL.
+    - Kết quả giữ đúng thứ tự jobs.
+    - `deadline` (giây) áp cho CẢ nhóm: job nào chưa xong khi hết hạn -> None
+      (job chưa chạy sẽ bị huỷ khỏi hàng đợi), caller tự quyết định fallback.
+    - `on_done(k, n)` (tuỳ chọn) được gọi mỗi khi 1 recipe xong (để báo tiến độ job).
+    """
+    if deadline is None:
+        deadline = OPENAI_CONFIG.get("plan_deadline") or 60
+    end = time.monotonic() + deadline
+    futures = [_LLM_POOL.submit(_llm_one_recipe, prompt, fb, cache) for prompt, fb, cache in jobs]
+    if on_done is not None:
+        finished = [0]
+        lock = threading.Lock()
+
+        def _tick(_f):
+            with lock:
+                finished[0] += 1
+                k = finished[0]
+            try:
+                on_done(k, len(futures))
+            except Exception:
+                pass
+
+        for f in futures:
+            f.add_done_callback(_tick)
+    out: list[dict | None] = []
+    for f in futures:
+        try:
+            out.append(f.result(timeout=max(0.0, end - time.monotonic())))
+        except Exception as e:
+            f.cancel()
+            logger.warning("LLM recipe job dropped (deadline %.0fs). err=%r", deadline, e)
+            out.append(None)
+    return out
+
+async def _allm_one_recipe_bounded(prompt: str, fallback_name: str | None = None, cache: bool = False) -> dict:
+    """_allm_one_recipe giới hạn bởi _ALLM_SEM (tối đa `max_workers` request đồng thời)."""
+    async with _ALLM_SEM:
+        return await _allm_one_recipe(prompt, fallback_name, cache)
+
+async def _allm_fan_out(jobs: list[tuple[str, str | None, bool]], deadline: float | None = None) -> list[dict | None]:
+    """
+    Bản async của _llm_fan_out: tối đa `max_workers` request đồng thời (semaphore),
+    hết `deadline` thì huỷ các task còn lại và trả None ở vị trí tương ứng.
+    """
+    if deadline is None:
+        deadline = OPENAI_CONFIG.get("plan_deadline") or 60
+
+    tasks = [asyncio.ensure_future(_allm_one_recipe_bounded(prompt, fb, cache)) for prompt, fb, cache in jobs]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=deadline)
+    for t in pending:
+        t.cancel()
+    if pending:
+        logger.warning("LLM recipe jobs dropped (deadline %.0fs): %s", deadline, len(pending))
+    return [t.result() if (t.done() and not t.cancelled() and t.exception() is None) else None for t in tasks]
+
+def _wheel_variant_bases(
+    participants: list,
+    nominations: dict,
+    winner_proposer,
+    forbid: set,
+    limit: int,
+) -> list[tuple[Any, str]]:
+    """
+    Chọn trước base dish cho từng member (trừ proposer của winner) để có thể gọi LLM song song.
+    Trả về [(user_id, base), ...] theo thứ tự participants, tối đa `limit` phần tử.
+    """
+    out = []
+    for uid in participants:
+        if len(out) >= limit:
+            break
+        # nếu chính họ là proposer winner (nếu xác định được) thì bỏ qua
+        if winner_proposer and uid == winner_proposer:
+            continue
+        base = _pick_member_base_dish(nominations.get(uid, []), forbid)
+        if base:
+            out.append((uid, base))
+    return out
+
+def _wheel_accept_variant(recipe: dict, base: str, forbid: set, already: set) -> dict:
+    """
+    Gộp 1 recipe variant vào plan theo luật chống trùng (chạy tuần tự sau khi LLM trả về):
+      - tên rỗng / nằm trong forbid / trùng base -> đổi bằng _suggest_variant_name
+      - trùng tên đã có trong already -> thêm hậu tố
+    Cập nhật forbid/already tại chỗ.
+    """
+    name_now = (recipe.get("name") or "").strip()
+    if (not name_now
+            or name_now.casefold() in {x.casefold() for x in forbid}
+            or name_now.casefold() == (base or "").strip().casefold()):
+        recipe["name"] = _suggest_variant_name(base, forbid)
+        recipe["video_url"] = f"https://www.youtube.com/results?search_query={recipe['name'].replace(' ', '+')}"
+
+    # chống trùng tên với already
+    if (recipe.get("name") or "").strip() in already:
+        recipe["name"] = f'{recipe.get("name","Variant")}-{len(already)+1}'
+
+    # Gắn lý do/metadata cho variant
+    sim = (recipe.get("similarity_note") or "").strip()
+    recipe["source"] = "wheel_variant"
+    recipe["base_dish"] = base
+    recipe["reason"] = f"Similar to {base} — {sim if sim else 'same style/ingredients'}"
+
+    already.add(recipe["name"])
+    forbid.add(recipe["name"])
+    return recipe
+
+def _report_recipe_progress(progress, k: int, n: int) -> None:
+    progress.update("recipes", 10 + 70 * k / max(1, n), done=k, total=n)
+
+
+def _wheel_prepare(
     family_id: str,
     meal_date: str,
     meal_type: str,
-    headcount_hint: int,
-    people_payload: list[dict],
-    forced_winner: str | None = None,   # <-- NEW: winner ép từ FE (kết quả spin)
+    forced_winner: str | None = None,
+    wctx: WheelContext | None = None,
 ) -> dict | None:
     """
-    Sinh plan theo luật wheel:
-      - Số món = số participants.
-      - Winner: EXACT (ưu tiên forced_winner nếu có).
-      - Thành viên còn lại: VARIANT từ món có vote cao hơn (tránh trùng wheel & đã sinh).
-    Trả về plan_obj dạng gần với schema, sẽ được coerce_to_lan_schema sau đó.
-    Đồng thời gắn metadata để FE hiển thị lý do sinh món:
-      - winner dish: source="wheel_winner", base_dish=<winner>, reason="Picked by wheel (winner) — proposed by X"
-      - variant dish: source="wheel_variant", base_dish=<base>, reason="Similar to <base> — <similarity_note|same style/ingredients>"
+    Bước chuẩn bị (chỉ đọc DB, không gọi LLM) cho wheel-first:
+    xác định winner, base của từng member và danh sách prompt cần gọi.
+    Trả None nếu phiên không đủ dữ liệu wheel.
+    `wctx`: WheelContext của request (candidates/winner chỉ load 1 lần cho cả pipeline).
     """
-    ctx = _wheel_build_context(family_id, meal_date, meal_type)
+    if wctx is None:
+        wctx = WheelContext(family_id, meal_date, meal_type)
+    ctx = wctx.state
     participants = ctx["participants"]               # list user_id theo thứ tự gặp
     nominations = ctx["nominations"]                 # user_id -> [{dish,votes,cid}, ...] (đã sort desc)
     # --- Quyết định winner: ưu tiên forced_winner từ FE, nếu không thì ctx['winner_dish']
     winner_dish = (forced_winner or "").strip() or ctx["winner_dish"]
     winner_proposer = ctx["winner_proposer"]
-    wheel_names = set(ctx["wheel_all_names"])
 
     # Nếu forced_winner có giá trị khác với ctx winner, cố tìm proposer tương ứng
     if forced_winner and forced_winner.strip():
-        try:
-            for c in _wheel_load_candidates(family_id, meal_date, meal_type):
-                if (c["name"] or "").strip().lower() == forced_winner.strip().lower():
-                    winner_proposer = c.get("proposer_user_id")
-                    break
-        except Exception:
-            pass
+        c = wctx.find_candidate(forced_winner)
+        if c:
+            winner_proposer = c.get("proposer_user_id")
 
     if not participants or not winner_dish:
         # không đủ dữ liệu wheel -> trả None để caller fallback sang _llm_generate_plan
@@ -404,73 +655,85 @@ def _generate_plan_wheel_mode(
     forbid = set([winner_dish]) if winner_dish else set()
     already = set([winner_dish]) if winner_dish else set()
 
-    dishes_out: list[dict] = []
+    # Winner đã có trong thư viện recipe -> không cần gọi LLM cho món này
+    winner_recipe = recipe_lib.lookup(winner_dish)
+    if winner_recipe:
+        forbid.add(winner_recipe["name"])
 
-    # ---- 1) Winner → EXACT recipe ----
-    prompt_exact = _craft_prompt_exact(winner_dish)
-    exact_recipe = _llm_one_recipe(prompt_exact, fallback_name=winner_dish)
+    # Chọn trước base cho từng member để gọi LLM SONG SONG (winner + variants)
+    variant_bases = _wheel_variant_bases(
+        participants, nominations, winner_proposer, forbid, limit=target_count - 1
+    )
+    # Các variant chạy song song nên không thấy tên của nhau như khi chạy tuần tự:
+    # cấm luôn base của mọi member trong prompt để LLM tránh trùng với "anh em" ngay từ đầu.
+    prompt_forbid = sorted(forbid | {base for _, base in variant_bases})
+    # Recipe winner dùng prompt chính xác -> cache được; variant phụ thuộc forbid -> luôn gọi mới
+    jobs = [] if winner_recipe else [(_craft_prompt_exact(winner_dish), winner_dish, True)]
+    jobs += [(_craft_prompt_variant(base, prompt_forbid, winner_dish), None, False) for _, base in variant_bases]
 
     # Lý do/metadata cho winner
     reason_winner = "Picked by wheel (winner)"
     winner_proposer_name = None
-    try:
-        for c in _wheel_load_candidates(family_id, meal_date, meal_type):
-            if (c["name"] or "").strip().lower() == (winner_dish or "").strip().lower():
-                winner_proposer_name = (c.get("proposer_name") or "") or c.get("proposer_user_id")
-                break
-    except Exception:
-        winner_proposer_name = None
+    c = wctx.find_candidate(winner_dish)
+    if c:
+        winner_proposer_name = (c.get("proposer_name") or "") or c.get("proposer_user_id")
     if winner_proposer_name:
         reason_winner += f" — proposed by {winner_proposer_name}"
 
-    exact_recipe["source"] = "wheel_winner"
-    exact_recipe["base_dish"] = winner_dish
-    exact_recipe["reason"] = reason_winner
-
-    dishes_out.append(exact_recipe)
-    already.add(exact_recipe["name"])
-    forbid.add(exact_recipe["name"])
-
-    # ---- 2) Cho từng member còn lại → VARIANT từ món có vote cao nhất của họ ----
-    for uid in participants:
-        # nếu chính họ là proposer winner (nếu xác định được) thì bỏ qua
-        if winner_proposer and uid == winner_proposer:
-            continue
-
-        base = _pick_member_base_dish(nominations.get(uid, []), forbid)
-        if not base:
-            continue
-
-        prompt_var = _craft_prompt_variant(base, list(forbid), winner_dish)
-        recipe = _llm_one_recipe(prompt_var, fallback_name=None)
-
-        name_now = (recipe.get("name") or "").strip()
-        if (not name_now
-                or name_now.casefold() in {x.casefold() for x in forbid}
-                or name_now.casefold() == (base or "").strip().casefold()):
-            recipe["name"] = _suggest_variant_name(base, forbid)
-            recipe["video_url"] = f"https://www.youtube.com/results?search_query={recipe['name'].replace(' ', '+')}"
-
-        # chống trùng tên với already
-        if (recipe.get("name") or "").strip() in already:
-            recipe["name"] = f'{recipe.get("name","Variant")}-{len(already)+1}'
+    return {
+        "winner_dish": winner_dish,
+        "winner_recipe": winner_recipe,
+        "reason_winner": reason_winner,
+        "target_count": target_count,
+        "forbid": forbid,
+        "already": already,
+        "variant_bases": variant_bases,
+        "jobs": jobs,
+    }
 
-        # Gắn lý do/metadata cho variant
-        sim = (recipe.get("similarity_note") or "").strip()
-        reason = f"Similar to {base} — {sim if sim else 'same style/ingredients'}"
-        recipe["source"] = "wheel_variant"
-        recipe["base_dish"] = base
-        recipe["reason"] = reason
 
-        dishes_out.append(recipe)
-        already.add(recipe["name"])
-        forbid.add(recipe["name"])
+def _wheel_winner_recipe(prep: dict, recipe: dict | None) -> dict:
+    """
+    Winner → EXACT recipe. `recipe` là kết quả LLM (None nếu quá hạn);
+    bỏ qua khi winner đã lấy từ thư viện (prep['winner_recipe']).
+    """
+    winner_dish = prep["winner_dish"]
+    if prep.get("winner_recipe"):
+        recipe = prep["winner_recipe"]
+    elif recipe:
+        # Lưu recipe mới (trước khi gắn metadata) vào thư viện
+        recipe_lib.remember(recipe, name=winner_dish)
+    recipe = recipe or _fallback_recipe(winner_dish)
+    recipe["source"] = "wheel_winner"
+    recipe["base_dish"] = winner_dish
+    recipe["reason"] = prep["reason_winner"]
+
+    prep["already"].add(recipe["name"])
+    prep["forbid"].add(recipe["name"])
+    return recipe
+
+
+def _wheel_variant_recipe(prep: dict, base: str, recipe: dict | None) -> dict:
+    """Variant của 1 member (luật forbid/already giữ nguyên, phải gọi theo thứ tự participants)."""
+    if recipe is None:
+        # quá hạn -> khung tối thiểu, tên sẽ được đặt lại bởi _suggest_variant_name
+        recipe = _fallback_recipe(None)
+        recipe["name"] = ""
+    else:
+        recipe_lib.remember(recipe)
+    return _wheel_accept_variant(recipe, base, prep["forbid"], prep["already"])
 
-        if len(dishes_out) >= target_count:
-            break
 
-    # Compose meta sơ bộ; roles lấy từ people_payload (được coerce sau)
-    plan_obj = {
+def _wheel_plan_obj(
+    dishes_out: list[dict],
+    family_id: str,
+    meal_date: str,
+    meal_type: str,
+    headcount_hint: int,
+    people_payload: list[dict],
+) -> dict:
+    """Compose meta sơ bộ; roles lấy từ people_payload (được coerce sau)."""
+    return {
         "meta": {
             "Time": f"{meal_date}, {get_meal_time_by_type(meal_type)}",
             "headcount": max(headcount_hint or 1, len(people_payload) or 1),
@@ -480,7 +743,81 @@ def _generate_plan_wheel_mode(
         },
         "dishes": dishes_out,
     }
-    return plan_obj
+
+
+def _wheel_compose(
+    prep: dict,
+    results: list[dict | None],
+    family_id: str,
+    meal_date: str,
+    meal_type: str,
+    headcount_hint: int,
+    people_payload: list[dict],
+) -> dict:
+    """Gộp kết quả LLM (theo đúng thứ tự prep['jobs']) thành plan_obj wheel-first."""
+    # Winner lấy từ thư viện thì prep['jobs'] chỉ còn các variant
+    offset = 0 if prep.get("winner_recipe") else 1
+
+    # ---- 1) Winner → EXACT recipe ----
+    dishes_out: list[dict] = [_wheel_winner_recipe(prep, results[0] if offset else None)]
+
+    # ---- 2) Gộp VARIANT của từng member theo thứ tự participants ----
+    for (uid, base), recipe in zip(prep["variant_bases"], results[offset:]):
+        dishes_out.append(_wheel_variant_recipe(prep, base, recipe))
+        if len(dishes_out) >= prep["target_count"]:
+            break
+
+    return _wheel_plan_obj(dishes_out, family_id, meal_date, meal_type, headcount_hint, people_payload)
+
+
+def _generate_plan_wheel_mode(
+    family_id: str,
+    meal_date: str,
+    meal_type: str,
+    headcount_hint: int,
+    people_payload: list[dict],
+    forced_winner: str | None = None,   # <-- NEW: winner ép từ FE (kết quả spin)
+    progress=None,                      # JobProgress (tuỳ chọn) khi chạy trong PLAN_JOBS
+    wctx: WheelContext | None = None,   # ngữ cảnh wheel dùng chung của request
+) -> dict | None:
+    """
+    Sinh plan theo luật wheel:
+      - Số món = số participants.
+      - Winner: EXACT (ưu tiên forced_winner nếu có).
+      - Thành viên còn lại: VARIANT từ món có vote cao hơn (tránh trùng wheel & đã sinh).
+    Trả về plan_obj dạng gần với schema, sẽ được coerce_to_lan_schema sau đó.
+    Đồng thời gắn metadata để FE hiển thị lý do sinh món:
+      - winner dish: source="wheel_winner", base_dish=<winner>, reason="Picked by wheel (winner) — proposed by X"
+      - variant dish: source="wheel_variant", base_dish=<base>, reason="Similar to <base> — <similarity_note|same style/ingredients>"
+    """
+    if progress is not None:
+        progress.update("context", 5)
+    prep = _wheel_prepare(family_id, meal_date, meal_type, forced_winner, wctx)
+    if prep is None:
+        return None
+
+    if progress is not None:
+        progress.update("recipes", 10, done=0, total=len(prep["jobs"]))
+    on_done = functools.partial(_report_recipe_progress, progress) if progress is not None else None
+    results = _llm_fan_out(prep["jobs"], on_done=on_done)
+    return _wheel_compose(prep, results, family_id, meal_date, meal_type, headcount_hint, people_payload)
+
+
+async def _agenerate_plan_wheel_mode(
+    family_id: str,
+    meal_date: str,
+    meal_type: str,
+    headcount_hint: int,
+    people_payload: list[dict],
+    forced_winner: str | None = None,
+    wctx: WheelContext | None = None,
+) -> dict | None:
+    """Bản async của _generate_plan_wheel_mode: đọc DB trong threadpool, gọi LLM bằng AsyncOpenAI."""
+    prep = await run_in_threadpool(_wheel_prepare, family_id, meal_date, meal_type, forced_winner, wctx)
+    if prep is None:
+        return None
+    results = await _allm_fan_out(prep["jobs"])
+    return _wheel_compose(prep, results, family_id, meal_date, meal_type, headcount_hint, people_payload)
 
 
 # ================== SCHEMA & PROMPTS ==================
@@ -828,6 +1165,44 @@ def _heuristic_theme_dishes(seed: str) -> List[str]:
     ]
 
 
+def _propose_request(theme: str, meal_type: str, headcount: int) -> dict:
+    """Tham số chat.completions cho _propose_dishes_for_theme (sync/async)."""
+    system = (
+        "You are a menu ideation assistant. Respond ONLY with JSON of the form: "
+        "{\"dishes\": [\"name1\", \"name2\", ...]}. English only."
+    )
+    user = (
+        "Center on the given theme. Output 5 dishes total: 2–3 variations of the base theme and 1–2 complementary sides. "
+        "Names must be concise. Do NOT add descriptions.\n"
+        f"Theme: {theme}\nMeal type: {meal_type}\nHeadcount: {headcount}\n"
+        "Return strictly JSON with a `dishes` array."
+    )
+    return dict(
+        model=OPENAI_CONFIG["model"],
+        messages=[{"role": "system", "content": system},
+                  {"role": "user", "content": user}],
+        response_format={"type": "json_object"},
+        temperature=0.6,
+        max_tokens=300,
+    )
+
+def _proposals_from_content(content: str | None, base5: List[str]) -> List[str]:
+    data = json.loads(content or "{}")
+    arr = [str(x).strip() for x in (data.get("dishes") or []) if str(x).strip()]
+    # de-dup + fill to 5
+    seen, out = set(), []
+    for x in arr:
+        xl = x.lower()
+        if xl not in seen:
+            seen.add(xl); out.append(x)
+        if len(out) >= 5: break
+    for x in base5:
+        if len(out) >= 5: break
+        xl = x.lower()
+        if xl not in seen:
+            seen.add(xl); out.append(x)
+    return out[:5] if out else base5
+
 def _propose_dishes_for_theme(theme: str, meal_type: str, headcount: int) -> List[str]:
     """
     Produce ~5 dish names centered around `theme`.
@@ -839,74 +1214,52 @@ def _propose_dishes_for_theme(theme: str, meal_type: str, headcount: int) -> Lis
         return base5
 
     try:
-        system = (
-            "You are a menu ideation assistant. Respond ONLY with JSON of the form: "
-            "{\"dishes\": [\"name1\", \"name2\", ...]}. English only."
-        )
-        user = (
-            "Center on the given theme. Output 5 dishes total: 2–3 variations of the base theme and 1–2 complementary sides. "
-            "Names must be concise. Do NOT add descriptions.\n"
-            f"Theme: {theme}\nMeal type: {meal_type}\nHeadcount: {headcount}\n"
-            "Return strictly JSON with a `dishes` array."
-        )
-        resp = client.chat.completions.create(
-            model=OPENAI_CONFIG["model"],
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": user}],
-            response_format={"type": "json_object"},
-            temperature=0.6,
-            max_tokens=300,
-        )
-        data = json.loads(resp.choices[0].message.content or "{}")
-        arr = [str(x).strip() for x in (data.get("dishes") or []) if str(x).strip()]
-        # de-dup + fill to 5
-        seen, out = set(), []
-        for x in arr:
-            xl = x.lower()
-            if xl not in seen:
-                seen.add(xl); out.append(x)
-            if len(out) >= 5: break
-        for x in base5:
-            if len(out) >= 5: break
-            xl = x.lower()
-            if xl not in seen:
-                seen.add(xl); out.append(x)
-        return out[:5] if out else base5
+        resp = client.chat.completions.create(**_propose_request(theme, meal_type, headcount))
+        return _proposals_from_content(resp.choices[0].message.content, base5)
     except Exception as e:
         logger.warning("Theme proposal LLM failed, using heuristic. err=%s", e)
         return base5
 
-# --- Helpers for theme-first generation (ADD these right before _llm_generate_plan) ---
+async def _apropose_dishes_for_theme(theme: str, meal_type: str, headcount: int) -> List[str]:
+    """Bản async của _propose_dishes_for_theme."""
+    base5 = _heuristic_theme_dishes(theme)
 
-def _norm_dish_name(s: str) -> str:
-    """Normalize dish names (single spaces, trimmed)."""
-    return re.sub(r"\s+", " ", (s or "").strip())
+    if OPENAI_CONFIG.get("debug", False):
+        return base5
 
+    try:
+        resp = await aclient.chat.completions.create(**_propose_request(theme, meal_type, headcount))
+        return _proposals_from_content(resp.choices[0].message.content, base5)
+    except Exception as e:
+        logger.warning("Theme proposal LLM (async) failed, using heuristic. err=%s", e)
+        return base5
 
-def _llm_list_theme_dishes(theme: str) -> List[str]:
-    """
-    Stage-1: Ask LLM to list ~5 dishes that revolve around the theme.
-    Always return 5 strings (fallback if LLM fails or debug=True).
-    """
-    if OPENAI_CONFIG.get("debug", False):
-        seed_low = (theme or "").lower()
-        if any(k in seed_low for k in ["nui xào", "nui xao", "stir-fried macaroni", "macaroni", "pasta",
-                                       "mì xào", "mi xao", "stir-fry noodle", "stir-fried noodle"]):
-            return [
-                "Stir-fried Macaroni with Beef (牛肉意面炒)",
-                "Stir-fried Macaroni with Chicken (鸡肉意面炒)",
-                "Stir-fried Macaroni with Seafood (什锦海鲜意面炒)",
-                "Garlic Butter Vegetables (蒜香黄油时蔬)",
-                "Tomato Egg Soup (西红柿鸡蛋汤)",
-            ]
+# --- Helpers for theme-first generation (ADD these right before _llm_generate_plan) ---
+
+def _theme_list_fallback(theme: str) -> List[str]:
+    """Danh sách 5 món mặc định khi không gọi được LLM (hoặc debug=True)."""
+    seed_low = (theme or "").lower()
+    if OPENAI_CONFIG.get("debug", False) and any(
+        k in seed_low for k in ["nui xào", "nui xao", "stir-fried macaroni", "macaroni", "pasta",
+                                "mì xào", "mi xao", "stir-fry noodle", "stir-fried noodle"]
+    ):
         return [
-            f"{theme} – Variant A",
-            f"{theme} – Variant B",
-            f"{theme} – Variant C",
-            "Simple Side Vegetables",
-            "Light Soup",
+            "Stir-fried Macaroni with Beef (牛肉意面炒)",
+            "Stir-fried Macaroni with Chicken (鸡肉意面炒)",
+            "Stir-fried Macaroni with Seafood (什锦海鲜意面炒)",
+            "Garlic Butter Vegetables (蒜香黄油时蔬)",
+            "Tomato Egg Soup (西红柿鸡蛋汤)",
         ]
+    return [
+        f"{theme} – Variant A",
+        f"{theme} – Variant B",
+        f"{theme} – Variant C",
+        "Simple Side Vegetables",
+        "Light Soup",
+    ]
 
+def _theme_list_request(theme: str) -> dict:
+    """Tham số chat.completions cho _llm_list_theme_dishes (sync/async)."""
     system = (
         "You are a culinary planner. English only. "
         "Respond with JSON only: {\"dishes\":[\"dish1\",\"dish2\",\"dish3\",\"dish4\",\"dish5\"]}. "
@@ -918,42 +1271,54 @@ def _llm_list_theme_dishes(theme: str) -> List[str]:
         "Return 5 concise dish names in English only. "
         "No explanations, JSON only."
     )
+    return dict(
+        model=OPENAI_CONFIG["model"],
+        messages=[{"role": "system", "content": system},
+                  {"role": "user", "content": user}],
+        response_format={"type": "json_object"},
+        temperature=0.6,
+        max_tokens=300,
+    )
+
+def _theme_list_from_content(content: str | None, theme: str) -> List[str]:
+    data = json.loads(content)
+    arr = [ _norm_dish_name(x) for x in (data.get("dishes") or []) if _norm_dish_name(x) ]
+    # ensure 5 unique
+    uniq: List[str] = []
+    for x in arr:
+        if x.lower() not in [u.lower() for u in uniq]:
+            uniq.append(x)
+    while len(uniq) < 5:
+        uniq.append(f"{theme} – Variant {len(uniq)+1}")
+    return uniq[:5]
+
+def _llm_list_theme_dishes(theme: str) -> List[str]:
+    """
+    Stage-1: Ask LLM to list ~5 dishes that revolve around the theme.
+    Always return 5 strings (fallback if LLM fails or debug=True).
+    """
+    if OPENAI_CONFIG.get("debug", False):
+        return _theme_list_fallback(theme)
 
     try:
-        resp = client.chat.completions.create(
-            model=OPENAI_CONFIG["model"],
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": user}],
-            response_format={"type": "json_object"},
-            temperature=0.6,
-            max_tokens=300,
-        )
-        data = json.loads(resp.choices[0].message.content)
-        arr = [ _norm_dish_name(x) for x in (data.get("dishes") or []) if _norm_dish_name(x) ]
-        # ensure 5 unique
-        uniq: List[str] = []
-        for x in arr:
-            if x.lower() not in [u.lower() for u in uniq]:
-                uniq.append(x)
-        while len(uniq) < 5:
-            uniq.append(f"{theme} – Variant {len(uniq)+1}")
-        return uniq[:5]
+        return _cached_completion(_theme_list_request(theme), lambda c: _theme_list_from_content(c, theme))
     except Exception as e:
         logger.warning("Theme list LLM failed: %s", e)
-        return [
-            f"{theme} – Variant A",
-            f"{theme} – Variant B",
-            f"{theme} – Variant C",
-            "Simple Side Vegetables",
-            "Light Soup",
-        ]
+        return _theme_list_fallback(theme)
 
+async def _allm_list_theme_dishes(theme: str) -> List[str]:
+    """Bản async của _llm_list_theme_dishes."""
+    if OPENAI_CONFIG.get("debug", False):
+        return _theme_list_fallback(theme)
 
-def _pick_4_from_theme(theme: str) -> List[str]:
-    """
-    Pick exactly 4 dishes for the theme using stage-1 list (LLM) with fallback.
-    """
-    dishes5 = _llm_list_theme_dishes(theme)
+    try:
+        return await _acached_completion(_theme_list_request(theme), lambda c: _theme_list_from_content(c, theme))
+    except Exception as e:
+        logger.warning("Theme list LLM (async) failed: %s", e)
+        return _theme_list_fallback(theme)
+
+
+def _first_4_unique(theme: str, dishes5: List[str]) -> List[str]:
     out = [ _norm_dish_name(x) for x in dishes5[:4] ]
     final: List[str] = []
     for x in out:
@@ -963,10 +1328,22 @@ def _pick_4_from_theme(theme: str) -> List[str]:
         final.append(f"{theme} – Variant {len(final)+1}")
     return final[:4]
 
-def _apply_forced_menu(plan_obj: dict, forced_menu: List[str]) -> dict:
+def _pick_4_from_theme(theme: str) -> List[str]:
+    """
+    Pick exactly 4 dishes for the theme using stage-1 list (LLM) with fallback.
+    """
+    return _first_4_unique(theme, _llm_list_theme_dishes(theme))
+
+async def _apick_4_from_theme(theme: str) -> List[str]:
+    """Bản async của _pick_4_from_theme."""
+    return _first_4_unique(theme, await _allm_list_theme_dishes(theme))
+
+def _apply_forced_menu(plan_obj: dict, forced_menu: List[str], library: Dict[str, dict] | None = None) -> dict:
     """
     Overwrite/normalize the LLM JSON so that dish names are EXACTLY the forced_menu (4 items).
-    - Giữ lại category/ingredients/steps nếu có, nhưng thay name + video_url.
+    - Món có trong thư viện recipe (`library`: name_key -> recipe) -> dùng bản thư viện.
+    - Còn lại giữ category/ingredients/steps của LLM nếu có, nhưng thay name + video_url;
+      món LLM trả đúng tên thì lưu vào thư viện.
     - Nếu LLM trả ít hơn 4 món, tự bổ sung khung món tối thiểu.
     - Luôn set đúng 4 món theo thứ tự forced_menu.
     """
@@ -981,9 +1358,16 @@ def _apply_forced_menu(plan_obj: dict, forced_menu: List[str]) -> dict:
             fm.append(f"{forced_menu[0]} – Variant {len(fm)+1}")
         fm = fm[:4]
 
+        library = library or {}
+        learned = []
         for i, name in enumerate(fm):
-            if i < len(dishes) and isinstance(dishes[i], dict):
+            key = recipe_lib.dish_key(name)
+            if key in library:
+                d = dict(library[key])
+            elif i < len(dishes) and isinstance(dishes[i], dict):
                 d = dishes[i]
+                if recipe_lib.dish_key(d.get("name") or "").startswith(key):
+                    learned.append((name, d))
             else:
                 # tạo khung mặc định nếu thiếu
                 d = {
@@ -997,6 +1381,7 @@ def _apply_forced_menu(plan_obj: dict, forced_menu: List[str]) -> dict:
             d["video_url"] = f"https://www.youtube.com/results?search_query={name.replace(' ', '+')}"
             out.append(d)
 
+        recipe_lib.remember_many(learned)
         plan_obj["dishes"] = out
         return plan_obj
     except Exception:
@@ -1005,58 +1390,62 @@ def _apply_forced_menu(plan_obj: dict, forced_menu: List[str]) -> dict:
 
 # ================== LLM CALLER ==================
 
-def _llm_generate_plan(payload: dict):
+def _plan_hints(payload: dict) -> dict:
     """
-    Call LLM and return (plan_obj, raw_text).
-    If OPENAI_CONFIG['debug'] = True → use rule-based fallback (no LLM call).
+    Đọc remarks để lấy THEME, các món được yêu cầu và điều chỉnh headcount
+    (dùng chung cho _llm_generate_plan / _allm_generate_plan).
     """
-    if OPENAI_CONFIG.get("debug", False):
-        logger.info("OPENAI_CONFIG.debug=True -> using rule-based fallback without calling LLM")
-        plan_obj = _fallback_simple_plan(payload.get("people") or [], payload.get("headcount") or 1, payload.get("meal_type") or "dinner")
-        return plan_obj, json.dumps({"LLM": "mocked_debug"}, ensure_ascii=False)
+    # ---- Extract remarks for THEME and required dishes ----
+    required_dishes = []
+    theme_seed = None
+    for person in payload.get("people", []):
+        remark = (person.get("remark") or "").strip()
+        if remark:
+            required_dishes.append(f"{person.get('display_name', 'member')}: {remark}")
+            m1 = re.search(r'^\s*THEME\s*:\s*(.+)$', remark, flags=re.IGNORECASE | re.MULTILINE)
+            m2 = re.search(r'Requested\s+dish\s*:\s*(.+)$', remark, flags=re.IGNORECASE)
+            if m1 and not theme_seed:
+                theme_seed = m1.group(1).strip()
+            elif m2 and not theme_seed:
+                theme_seed = m2.group(1).strip()
+
+    headcount = int(payload.get("headcount") or 0)
+    recommended_dish_count = max(2, headcount - 1)
+
+    # ---- Stage-0: reconcile participant hint (unchanged) ----
+    expected_participant_hint = ""
+    for person in payload.get("people", []):
+        remark = (person.get("remark") or "").strip()
+        m = re.search(r"(\d+)\s*(?:人|people)", remark, re.IGNORECASE)
+        if m:
+            expected_count = int(m.group(1))
+            if expected_count > headcount:
+                expected_participant_hint = (
+                    f"\nIMPORTANT: User remark mentions {expected_count} participants, "
+                    f"but only {headcount} submission(s) received."
+                )
+                headcount = expected_count
+                recommended_dish_count = max(2, headcount - 1)
+                break
 
-    try:
-        # ---- Extract remarks for THEME and required dishes ----
-        required_dishes = []
-        theme_seed = None
-        for person in payload.get("people", []):
-            remark = (person.get("remark") or "").strip()
-            if remark:
-                required_dishes.append(f"{person.get('display_name', 'member')}: {remark}")
-                m1 = re.search(r'^\s*THEME\s*:\s*(.+)$', remark, flags=re.IGNORECASE | re.MULTILINE)
-                m2 = re.search(r'Requested\s+dish\s*:\s*(.+)$', remark, flags=re.IGNORECASE)
-                if m1 and not theme_seed:
-                    theme_seed = m1.group(1).strip()
-                elif m2 and not theme_seed:
-                    theme_seed = m2.group(1).strip()
-
-        headcount = int(payload.get("headcount") or 0)
-        recommended_dish_count = max(2, headcount - 1)
-
-        # ---- Stage-0: reconcile participant hint (unchanged) ----
-        expected_participant_hint = ""
-        for person in payload.get("people", []):
-            remark = (person.get("remark") or "").strip()
-            m = re.search(r"(\d+)\s*(?:人|people)", remark, re.IGNORECASE)
-            if m:
-                expected_count = int(m.group(1))
-                if expected_count > headcount:
-                    expected_participant_hint = (
-                        f"\nIMPORTANT: User remark mentions {expected_count} participants, "
-                        f"but only {headcount} submission(s) received."
-                    )
-                    headcount = expected_count
-                    recommended_dish_count = max(2, headcount - 1)
-                    break
-
-        # ---- NEW Stage-1: if we have a theme, pick EXACT 4 dish names up front ----
-        forced_menu: List[str] = []
-        if theme_seed:
-            forced_menu = _pick_4_from_theme(theme_seed)
-            recommended_dish_count = 4  # lock to 4 dishes
+    return {
+        "required_dishes": required_dishes,
+        "theme_seed": theme_seed,
+        "headcount": headcount,
+        "recommended_dish_count": recommended_dish_count,
+        "expected_participant_hint": expected_participant_hint,
+    }
 
-        # ---- Build prompt ----
-        user_prompt = f"""Please generate a meal plan for the following family:
+def _plan_user_prompt(payload: dict, hints: dict, forced_menu: List[str]) -> str:
+    """Dựng user prompt cho LLM sinh cả plan."""
+    required_dishes = hints["required_dishes"]
+    theme_seed = hints["theme_seed"]
+    headcount = hints["headcount"]
+    expected_participant_hint = hints["expected_participant_hint"]
+    recommended_dish_count = 4 if forced_menu else hints["recommended_dish_count"]  # theme -> lock to 4 dishes
+
+    # ---- Build prompt ----
+    user_prompt = f"""Please generate a meal plan for the following family:
 
 **Basic Information:**
 - Date: {payload.get('date')}
@@ -1067,83 +1456,143 @@ def _llm_generate_plan(payload: dict):
 - Meal Code: {payload.get('meal_code', 'N/A')}{expected_participant_hint}
 """
 
-        if theme_seed:
-            user_prompt += (
-                f"**Theme Focus (CRITICAL):** Center the plan around \"{theme_seed}\".\n"
-                "Name dishes in English with Chinese in parentheses. Keep video_url as a YouTube search for each dish.\n"
+    if theme_seed:
+        user_prompt += (
+            f"**Theme Focus (CRITICAL):** Center the plan around \"{theme_seed}\".\n"
+            "Name dishes in English with Chinese in parentheses. Keep video_url as a YouTube search for each dish.\n"
+        )
+        if forced_menu:
+            user_prompt += (
+                "\n**STRICT MENU (OVERRIDE) — USE EXACTLY THESE 4 DISHES:**\n" +
+                "\n".join([f"- {d}" for d in forced_menu]) +
+                "\nDo NOT replace these dish names or add extra mains. "
+                "You may only vary ingredients/steps sensibly.\n"
             )
-            if forced_menu:
-                user_prompt += (
-                    "\n**STRICT MENU (OVERRIDE) — USE EXACTLY THESE 4 DISHES:**\n" +
-                    "\n".join([f"- {d}" for d in forced_menu]) +
-                    "\nDo NOT replace these dish names or add extra mains. "
-                    "You may only vary ingredients/steps sensibly.\n"
-                )
 
-        if required_dishes:
-            total_requested_dishes = 0
-            for dish in required_dishes:
-                if ":" in dish:
-                    total_requested_dishes += len([d.strip() for d in dish.split(":")[1].replace("，", ",").split(",") if d.strip()])
-            user_prompt += f"""**CRITICAL: User-Requested Dishes (MUST INCLUDE ALL):**
+    if required_dishes:
+        total_requested_dishes = 0
+        for dish in required_dishes:
+            if ":" in dish:
+                total_requested_dishes += len([d.strip() for d in dish.split(":")[1].replace("，", ",").split(",") if d.strip()])
+        user_prompt += f"""**CRITICAL: User-Requested Dishes (MUST INCLUDE ALL):**
 {chr(10).join([f"- {x}" for x in required_dishes])}
 Total requested: {total_requested_dishes or "Parse from remarks"}
 """
 
-        user_prompt += "**Family Members Information:**\n\n"
-        for i, person in enumerate(payload.get("people", []), 1):
-            user_prompt += f"{i}. **{person.get('display_name', 'member')}**:\n"
-            user_prompt += f"   - User Name: {person.get('display_name', 'member')}\n"
-            user_prompt += f"   - Is Chef: {'Yes' if person.get('is_chef') else 'No'}\n"
-            if person.get("food_style"):
-                user_prompt += f"   - Food Style: {person['food_style']}\n"
-            if person.get("likes"):
-                user_prompt += f"   - Liked Tastes: {', '.join(person['likes'])}\n"
-            if person.get("dislikes"):
-                user_prompt += f"   - Disliked Tastes: {', '.join(person['dislikes'])}\n"
-            if person.get("allergies"):
-                user_prompt += f"   - Allergies: {person['allergies']}\n"
-            if person.get("remark"):
-                user_prompt += f"   - Special Requirements: {person['remark']}\n"
-            user_prompt += "\n"
-
-        user_prompt += f"\n{PROMPT_RULES}\n"
-        user_prompt += f"\n**Output Format (JSON Schema):**\n```json\n{json.dumps(PLAN_SCHEMA_EXAMPLE, ensure_ascii=False, indent=2)}\n```\n"
-        user_prompt += "\nPlease generate the meal plan following the above schema and rules. Output in JSON format only."
-
-        logger.info(
-            "Sending prompt to LLM (headcount=%s, recommended_dishes=%s, theme=%s, forced_menu=%s, required_dishes=%s)",
-            headcount, recommended_dish_count, theme_seed, len(forced_menu), len(required_dishes)
-        )
+    user_prompt += "**Family Members Information:**\n\n"
+    for i, person in enumerate(payload.get("people", []), 1):
+        user_prompt += f"{i}. **{person.get('display_name', 'member')}**:\n"
+        user_prompt += f"   - User Name: {person.get('display_name', 'member')}\n"
+        user_prompt += f"   - Is Chef: {'Yes' if person.get('is_chef') else 'No'}\n"
+        if person.get("food_style"):
+            user_prompt += f"   - Food Style: {person['food_style']}\n"
+        if person.get("likes"):
+            user_prompt += f"   - Liked Tastes: {', '.join(person['likes'])}\n"
+        if person.get("dislikes"):
+            user_prompt += f"   - Disliked Tastes: {', '.join(person['dislikes'])}\n"
+        if person.get("allergies"):
+            user_prompt += f"   - Allergies: {person['allergies']}\n"
+        if person.get("remark"):
+            user_prompt += f"   - Special Requirements: {person['remark']}\n"
+        user_prompt += "\n"
+
+    user_prompt += f"\n{PROMPT_RULES}\n"
+    user_prompt += f"\n**Output Format (JSON Schema):**\n```json\n{json.dumps(PLAN_SCHEMA_EXAMPLE, ensure_ascii=False, indent=2)}\n```\n"
+    user_prompt += "\nPlease generate the meal plan following the above schema and rules. Output in JSON format only."
+
+    logger.info(
+        "Sending prompt to LLM (headcount=%s, recommended_dishes=%s, theme=%s, forced_menu=%s, required_dishes=%s)",
+        headcount, recommended_dish_count, theme_seed, len(forced_menu), len(required_dishes)
+    )
+    return user_prompt
+
+def _plan_request(user_prompt: str) -> dict:
+    """Tham số chat.completions cho LLM sinh cả plan (sync/async)."""
+    return dict(
+        model=OPENAI_CONFIG["model"],
+        messages=[
+            {"role": "system", "content": PROMPT_SYSTEM},
+            {"role": "user", "content": user_prompt},
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.7,
+        max_tokens=4000,
+    )
 
-        response = client.chat.completions.create(
-            model=OPENAI_CONFIG["model"],
-            messages=[
-                {"role": "system", "content": PROMPT_SYSTEM},
-                {"role": "user", "content": user_prompt},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.7,
-            max_tokens=4000,
-        )
+def _plan_from_content(content: str, forced_menu: List[str], library: Dict[str, dict] | None = None) -> dict:
+    plan_obj = json.loads(content)
+    if forced_menu:
+        plan_obj = _apply_forced_menu(plan_obj, forced_menu, library)
+    logger.info("LLM generated plan with %s dishes", len(plan_obj.get("dishes", [])))
+    return plan_obj
+
+def _plan_fallback(payload: dict, error: Exception | None = None):
+    """Rule-based fallback: debug mode (error=None) hoặc khi LLM lỗi. Trả (plan_obj, raw_text)."""
+    plan_obj = _fallback_simple_plan(payload.get("people") or [], payload.get("headcount") or 1, payload.get("meal_type") or "dinner")
+    if error is None:
+        logger.info("OPENAI_CONFIG.debug=True -> using rule-based fallback without calling LLM")
+        return plan_obj, json.dumps({"LLM": "mocked_debug"}, ensure_ascii=False)
+
+    msg = str(error)
+    logger.error("LLM generation failed: %s", msg)
+    keywords = ("401", "Unauthorized", "invalid", "无效", "未授权", "v_api_error")
+    if any(k.lower() in msg.lower() for k in keywords):
+        logger.warning("LLM auth error -> using rule-based fallback")
+        return plan_obj, json.dumps({"LLM": "fallback_due_to_401", "error": msg}, ensure_ascii=False)
+    return plan_obj, json.dumps({"LLM": "fallback_due_to_error", "error": msg}, ensure_ascii=False)
+
+def _llm_generate_plan(payload: dict, progress=None):
+    """
+    Call LLM and return (plan_obj, raw_text).
+    If OPENAI_CONFIG['debug'] = True → use rule-based fallback (no LLM call).
+    `progress` (JobProgress, optional) nhận stage theme / plan khi chạy trong PLAN_JOBS.
+    """
+    if OPENAI_CONFIG.get("debug", False):
+        return _plan_fallback(payload)
 
+    try:
+        hints = _plan_hints(payload)
+
+        # ---- Stage-1: if we have a theme, pick EXACT 4 dish names up front ----
+        forced_menu: List[str] = []
+        library: Dict[str, dict] = {}
+        if hints["theme_seed"]:
+            if progress is not None:
+                progress.update("theme", 10, theme=hints["theme_seed"])
+            forced_menu = _pick_4_from_theme(hints["theme_seed"])
+            library = recipe_lib.lookup_many(forced_menu)
+
+        if progress is not None:
+            progress.update("plan", 25, dishes=forced_menu)
+        user_prompt = _plan_user_prompt(payload, hints, forced_menu)
+        response = client.chat.completions.create(**_plan_request(user_prompt))
         content = response.choices[0].message.content
-        plan_obj = json.loads(content)
-        if forced_menu:
-            plan_obj = _apply_forced_menu(plan_obj, forced_menu)
-        logger.info("LLM generated plan with %s dishes", len(plan_obj.get("dishes", [])))
-        return plan_obj, content
+        return _plan_from_content(content, forced_menu, library), content
+
+    except Exception as e:
+        return _plan_fallback(payload, e)
+
+async def _allm_generate_plan(payload: dict):
+    """Bản async của _llm_generate_plan (AsyncOpenAI)."""
+    if OPENAI_CONFIG.get("debug", False):
+        return _plan_fallback(payload)
+
+    try:
+        hints = _plan_hints(payload)
+
+        forced_menu: List[str] = []
+        library: Dict[str, dict] = {}
+        if hints["theme_seed"]:
+            forced_menu = await _apick_4_from_theme(hints["theme_seed"])
+            library = await run_in_threadpool(recipe_lib.lookup_many, forced_menu)
+
+        user_prompt = _plan_user_prompt(payload, hints, forced_menu)
+        response = await aclient.chat.completions.create(**_plan_request(user_prompt))
+        content = response.choices[0].message.content
+        return _plan_from_content(content, forced_menu, library), content
 
     except Exception as e:
-        msg = str(e)
-        logger.error("LLM generation failed: %s", msg)
-        keywords = ("401", "Unauthorized", "invalid", "无效", "未授权", "v_api_error")
-        if any(k.lower() in msg.lower() for k in keywords):
-            logger.warning("LLM auth error -> using rule-based fallback")
-            plan_obj = _fallback_simple_plan(payload.get("people") or [], payload.get("headcount") or 1, payload.get("meal_type") or "dinner")
-            return plan_obj, json.dumps({"LLM": "fallback_due_to_401", "error": msg}, ensure_ascii=False)
-        plan_obj = _fallback_simple_plan(payload.get("people") or [], payload.get("headcount") or 1, payload.get("meal_type") or "dinner")
-        return plan_obj, json.dumps({"LLM": "fallback_due_to_error", "error": msg}, ensure_ascii=False)
+        return _plan_fallback(payload, e)
 
 def _extract_requested_dishes(remark: str) -> list[str]:
     """
@@ -1203,7 +1652,13 @@ def _count_participants_from_submissions(submissions: list[dict]) -> int:
 
     return len(seen)
 
-def _count_participants_union(submissions: list[dict], family_id: str | None, meal_date: str | None, meal_type: str | None) -> int:
+def _count_participants_union(
+    submissions: list[dict],
+    family_id: str | None,
+    meal_date: str | None,
+    meal_type: str | None,
+    wctx: WheelContext | None = None,
+) -> int:
     """
     Kết hợp:
     - Participants từ submissions (role/chef/tasks hoặc Requested dish)
@@ -1213,7 +1668,7 @@ def _count_participants_union(submissions: list[dict], family_id: str | None, me
     wheel = 0
     try:
         if family_id and meal_date and meal_type:
-            ctx = _wheel_build_context(family_id, meal_date, meal_type)
+            ctx = (wctx or WheelContext(family_id, meal_date, meal_type)).state
             wheel = len([uid for uid in (ctx.get("participants") or []) if uid])
     except Exception:
         wheel = 0
@@ -1579,216 +2034,480 @@ def set_active_context(
 
 # ================== ROUTES ==================
 
-@router.post("/generate")
-def generate_plan(req: GenerateRequest):
+def _people_from_submissions(submissions: list[dict] | None) -> list[dict]:
+    """Chuẩn bị `people` cho LLM từ submissions mà FE gửi lên."""
+    people = []
+    for sub in (submissions or []):
+        prefs = sub.get("preferences") or {}
+        # FE có thể gửi liked_tastes -> map sang likes (LLM dùng key 'likes')
+        if "likes" not in prefs and "liked_tastes" in prefs:
+            prefs["likes"] = prefs.get("liked_tastes", []) or []
+
+        person = {
+            "person_role": sub.get("role") or "member",
+            "display_name": sub.get("display_name") or sub.get("user_id") or "member",
+            "is_chef": bool(prefs.get("is_chef", False)),
+            "tasks": prefs.get("tasks", []),
+            "food_style": prefs.get("food_style", ""),
+            "likes": prefs.get("likes", []),
+            "dislikes": prefs.get("dislikes", []),
+            "allergies": prefs.get("allergies", ""),
+            # remark rất quan trọng: Wheel/AI hint đã nhét THEME ở đây
+            "remark": sub.get("remark", "") or "",
+        }
+        people.append(person)
+    return people
+
+
+def _generate_headcount(req: GenerateRequest, people: list[dict]) -> int:
     """
-    Generate meal plan centered around wheel/AI theme (if present in remarks).
-    - Nhận anchors/hard_lock từ FE (optional) rồi post-process.
-    - Gọi _llm_generate_plan để tôn trọng THEME từ remarks (Wheel/AI hint).
-    - Lưu DB và trả về plan_id cho FE redirect.
+    Ưu tiên tổng người thực tế từ submissions (nếu FE có gửi participant_count),
+    nếu không có thì rơi về số submission hoặc req.headcount.
     """
+    headcount_from_subs = 0
+    for sub in (req.submissions or []):
+        headcount_from_subs += _norm_participant_count(sub)
+
+    if headcount_from_subs > 0:
+        return headcount_from_subs
+    return req.headcount or (len(people) or 1)
+
+
+def _finalize_generated_plan(
+    req: GenerateRequest,
+    plan_obj_raw: dict,
+    dinner_time: str,
+    headcount: int,
+    participants_count: int,
+) -> dict:
+    """Chuẩn hoá plan thô (wheel-first hoặc LLM) về LAN schema + reasons/video/anchors."""
+    family_info = {"family_id": req.family_id, "family_name": ""}
+    raw_dishes = list(plan_obj_raw.get("dishes") or [])
+    plan_obj = coerce_to_lan_schema(plan_obj_raw, dinner_time, headcount, family_info=family_info)
+    plan_obj = _inject_generation_reasons(raw_dishes, plan_obj)
+    plan_obj = _ensure_video_urls(plan_obj)
+    plan_obj = _mirror_video_field(plan_obj)
+
+    # === Display participants ===
     try:
-        log_api_call("/plan/generate", "POST")
+        plan_obj.setdefault("meta", {})["participants_display"] = participants_count
+        plan_obj["meta"]["headcount"] = participants_count
+    except Exception:
+        pass
 
-        # --- Validate đầu vào ---
-        if not (req.family_id and req.meal_date and req.meal_type):
-            raise HTTPException(400, "Missing family_id / meal_date / meal_type")
-
-        # --- Chuẩn bị people cho LLM từ submissions ---
-        people = []
-        for sub in (req.submissions or []):
-            prefs = sub.get("preferences") or {}
-            # FE có thể gửi liked_tastes -> map sang likes (LLM dùng key 'likes')
-            if "likes" not in prefs and "liked_tastes" in prefs:
-                prefs["likes"] = prefs.get("liked_tastes", []) or []
-
-            person = {
-                "person_role": sub.get("role") or "member",
-                "display_name": sub.get("display_name") or sub.get("user_id") or "member",
-                "is_chef": bool(prefs.get("is_chef", False)),
-                "tasks": prefs.get("tasks", []),
-                "food_style": prefs.get("food_style", ""),
-                "likes": prefs.get("likes", []),
-                "dislikes": prefs.get("dislikes", []),
-                "allergies": prefs.get("allergies", ""),
-                # remark rất quan trọng: Wheel/AI hint đã nhét THEME ở đây
-                "remark": sub.get("remark", "") or "",
-            }
-            people.append(person)
+    # --- Neo anchors (nếu FE có gửi; vẫn hữu ích để pin vị trí/lock) ---
+    if req.anchors:
+        plan_obj = postprocess_with_anchors(plan_obj, anchors=req.anchors or [], hard_lock=bool(req.hard_lock))
+    return plan_obj
 
-        # --- Headcount & time ---
-        # Ưu tiên tổng người thực tế từ submissions (nếu FE có gửi participant_count),
-        # nếu không có thì rơi về số submission hoặc req.headcount.
-        headcount_from_subs = 0
-        for sub in (req.submissions or []):
-            headcount_from_subs += _norm_participant_count(sub)
 
-        if headcount_from_subs > 0:
-            headcount = headcount_from_subs
-        else:
-            headcount = req.headcount or (len(people) or 1)
+def _plan_html_url(plan_id) -> str:
+    return f"/api/plan/id/{plan_id}/html"
 
-        default_time = get_meal_time_by_type(req.meal_type)  # '08:00'/'12:00'/'18:00'
-        dinner_time = f"{req.meal_date} {default_time}:00"
 
-        # === Số participant để hiển thị (đúng luật: người có role/chef/tasks HOẶC cung cấp >=1 món)
-        participants_count = _count_participants_union(
-            req.submissions or [], req.family_id, req.meal_date, req.meal_type
-        )
+def _dishes_without_image(plan_obj: Optional[dict]) -> List[str]:
+    names: List[str] = []
+    for d in (plan_obj or {}).get("dishes") or []:
+        if not isinstance(d, dict):
+            continue
+        name = _norm_dish_name(d.get("name") or "")
+        if name and not image_scraper.is_https(d.get("image_url")) and name not in names:
+            names.append(name)
+    return names
+
+
+def _write_back_plan_images(plan_id: int, images: Dict[str, Optional[str]]) -> None:
+    """
+    Điền dishes[].image_url (chỉ món còn trống) vào plan_json đã lưu.
+    Đọc FOR UPDATE trên primary (replica có thể chưa có plan vừa ghi) rồi ghi trong cùng transaction.
+    """
+    with db_transaction() as tx:
+        rows = tx.query("SELECT plan_json FROM plans WHERE id=%s FOR UPDATE", (plan_id,))
+        if not rows:
+            return
+        plan_obj = plan_codec.decode_json(rows[0].get("plan_json"), {})
+        changed = False
+        for d in plan_obj.get("dishes") or []:
+            if not isinstance(d, dict) or image_scraper.is_https(d.get("image_url")):
+                continue
+            src = images.get(_norm_dish_name(d.get("name") or ""))
+            if src:
+                d["image_url"] = src
+                changed = True
+        if changed:
+            tx.execute("UPDATE plans SET plan_json=%s WHERE id=%s", (plan_codec.encode(plan_obj), plan_id))
+
+
+def _prewarm_job(plan_id: int, names: List[str]) -> None:
+    try:
+        images = image_scraper.resolve_many(names)
+        found = sum(1 for v in images.values() if v)
+        logger.info("Image pre-warm for plan %s: %s/%s dishes", plan_id, found, len(names))
+        if found and IMAGE_SCRAPER_CONFIG["prewarm_write_back"]:
+            _write_back_plan_images(plan_id, images)
+    except Exception as e:
+        logger.warning("Image pre-warm for plan %s failed: %s", plan_id, e)
 
 
-        # === WHEEL-FIRST MODE: nếu phiên có wheel data hợp lệ thì sinh plan theo luật wheel ===
-        # Lấy winner ép từ FE qua anchors[0] (nếu có) — chính là kết quả spin.
-        forced_winner = None
-        if isinstance(req.anchors, list) and req.anchors:
-            forced_winner = (req.anchors[0] or "").strip() or None
+def _prewarm_plan_images(plan_id: int, plan_obj: Optional[dict]) -> None:
+    """Plan vừa lưu: tìm ảnh các món ở background -> người xem đầu tiên không phải chờ scrape."""
+    if not IMAGE_SCRAPER_CONFIG["prewarm"]:
+        return
+    names = _dishes_without_image(plan_obj)
+    if names:
+        _IMG_PREWARM.submit(_prewarm_job, plan_id, names)
 
-        wheel_plan_try = _generate_plan_wheel_mode(
-            family_id=req.family_id,
-            meal_date=req.meal_date,
-            meal_type=req.meal_type,
-            headcount_hint=headcount,
-            people_payload=people,
-            forced_winner=forced_winner,   # <-- NEW
+
+_plans_schema_ready = False
+
+
+def _ensure_plans_schema() -> None:
+    """
+    INSERT vào plans không còn ghi plan_html (HTML render khi cần) -> cột cũ NOT NULL phải cho phép NULL,
+    nếu không MySQL strict mode từ chối mọi lượt generate / ingest / regenerate.
+    Kiểm tra information_schema trước để không ALTER (rebuild bảng) mỗi lần khởi động.
+    """
+    global _plans_schema_ready
+    if _plans_schema_ready:
+        return
+    try:
+        rows = db_query(
+            """
+            SELECT IS_NULLABLE FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'plans' AND COLUMN_NAME = 'plan_html'
+            """,
+            primary=True,
+        )
+        if rows and str(rows[0].get("IS_NULLABLE") or "").upper() == "NO":
+            db_execute("ALTER TABLE plans MODIFY plan_html MEDIUMTEXT NULL")
+            logger.info("plans.plan_html migrated to MEDIUMTEXT NULL")
+        _plans_schema_ready = True
+    except Exception as e:
+        logger.error(
+            "Could not make plans.plan_html nullable (%s); run: ALTER TABLE plans MODIFY plan_html MEDIUMTEXT NULL", e
         )
 
-        if wheel_plan_try:
-            # Chuẩn hoá về LAN schema và LƯU như bình thường, bỏ qua _llm_generate_plan
-            family_info = {"family_id": req.family_id, "family_name": ""}
-            wheel_raw_dishes = list(wheel_plan_try.get("dishes") or [])
-            plan_obj = coerce_to_lan_schema(wheel_plan_try, dinner_time, headcount, family_info=family_info)
-            plan_obj = _inject_generation_reasons(wheel_raw_dishes, plan_obj)
-            plan_obj = _ensure_video_urls(plan_obj)
-            plan_obj = _mirror_video_field(plan_obj)
 
-            try:
-                plan_obj.setdefault("meta", {})["participants_display"] = participants_count
-                plan_obj["meta"]["headcount"] = participants_count
-            except Exception:
-                pass
+def _insert_generated_plan(req: GenerateRequest, submission_cnt: int, plan_obj: dict, model_raw: str) -> int:
+    """Lưu plan vừa sinh vào bảng plans (chỉ plan_json; HTML render khi cần), trả về plan_id."""
+    _ensure_plans_schema()
+    plan_code = f"{req.family_id}_{int(datetime.datetime.now().timestamp())}"
+    meal_code_value = ""  # legacy off
+    plan_id = db_execute(
+        """
+        INSERT INTO plans
+          (plan_code, family_id, meal_type, meal_date, source_date, submission_cnt, plan_json, model_raw, meal_code, comment)
+        VALUES
+          (%s,        %s,        %s,        %s,        %s,          %s,              %s,        %s,        %s,       %s)
+        """,
+        (
+            plan_code,
+            req.family_id,
+            req.meal_type,
+            req.meal_date,
+            req.meal_date,
+            submission_cnt,
+            plan_codec.encode(plan_obj),
+            plan_codec.encode(model_raw),
+            meal_code_value,
+            (req.feedback or "").strip(),
+        ),
+    )
+    plan_summary.remember(plan_id, req.family_id, plan_obj)
+    _prewarm_plan_images(plan_id, plan_obj)
+    return plan_id
 
-            # Neo anchors nếu có (vẫn hữu ích để pin vị trí/lock)
-            if req.anchors:
-                plan_obj = postprocess_with_anchors(plan_obj, anchors=req.anchors or [], hard_lock=bool(req.hard_lock))
 
-            html = render_plan_html(plan_obj)
-            plan_code = f"{req.family_id}_{int(datetime.datetime.now().timestamp())}"
-            meal_code_value = ""
-
-            plan_id = db_execute(
-                """
-                INSERT INTO plans
-                  (plan_code, family_id, meal_type, meal_date, source_date, submission_cnt, plan_json, plan_html, model_raw, meal_code, comment)
-                VALUES
-                  (%s,        %s,        %s,        %s,        %s,          %s,              %s,        %s,        %s,        %s,       %s)
-                """,
-                (
-                    plan_code,
-                    req.family_id,
-                    req.meal_type,
-                    req.meal_date,
-                    req.meal_date,
-                    len(people),
-                    json.dumps(plan_obj, ensure_ascii=False),
-                    html,
-                    json.dumps({"mode": "wheel-first"}, ensure_ascii=False),
-                    meal_code_value,
-                    (req.feedback or "").strip(),
-                ),
-            )
+def _generate_inputs(req: GenerateRequest) -> dict:
+    """Validate + chuẩn bị people/headcount/time/winner/payload cho mọi đường sinh plan."""
+    if not (req.family_id and req.meal_date and req.meal_type):
+        raise HTTPException(400, "Missing family_id / meal_date / meal_type")
 
-            return {
-                "ok": True,
-                "plan_id": plan_id,
-                "plan_json": plan_obj,
-                "plan_html": html,
-                "family_id": req.family_id,
-                "meal_date": req.meal_date,
-                "meal_type": req.meal_type,
-            }
+    # --- Chuẩn bị people cho LLM từ submissions ---
+    people = _people_from_submissions(req.submissions)
 
-        # --- Gọi LLM (có logic THEME/forced menu bên trong) ---
-        payload = {
+    # --- Headcount & time ---
+    headcount = _generate_headcount(req, people)
+    default_time = get_meal_time_by_type(req.meal_type)  # '08:00'/'12:00'/'18:00'
+
+    # Lấy winner ép từ FE qua anchors[0] (nếu có) — chính là kết quả spin.
+    forced_winner = None
+    if isinstance(req.anchors, list) and req.anchors:
+        forced_winner = (req.anchors[0] or "").strip() or None
+
+    return {
+        "people": people,
+        "headcount": headcount,
+        "dinner_time": f"{req.meal_date} {default_time}:00",
+        "forced_winner": forced_winner,
+        "payload": {
             "date": req.meal_date,
             "meal_type": req.meal_type,
             "headcount": headcount,
             "people": people,
             "schema": PLAN_SCHEMA_EXAMPLE,  # cho model biết cấu trúc
-        }
-        plan_obj_raw, model_raw = _llm_generate_plan(payload)
-        raw_dishes = list(plan_obj_raw.get("dishes") or [])
+        },
+    }
 
-        family_info = {"family_id": req.family_id, "family_name": ""}
 
-        plan_obj = coerce_to_lan_schema(plan_obj_raw, dinner_time, headcount, family_info=family_info)
-        plan_obj = _inject_generation_reasons(raw_dishes, plan_obj)
-        plan_obj = _ensure_video_urls(plan_obj)
-        plan_obj = _mirror_video_field(plan_obj)
+def _generate_flight_key(req: GenerateRequest) -> str:
+    """
+    Khoá single-flight: phiên (family_id, meal_date, meal_type) + hash của submissions/anchors
+    (và các tham số khác ảnh hưởng kết quả). Tính trước khi submissions bị chuẩn hoá.
+    """
+    return content_key(
+        "plan.generate",
+        req.family_id, req.meal_date, (req.meal_type or "").lower(),
+        req.submissions or [], req.anchors or [], bool(req.hard_lock),
+        req.headcount, (req.feedback or "").strip(),
+    )
 
-        # === Display participants = number of dishes ===
-        try:
-            plan_obj.setdefault("meta", {})["participants_display"] = participants_count
-            plan_obj["meta"]["headcount"] = participants_count
-        except Exception:
-            pass
 
-        # --- Neo anchors (nếu FE có gửi) ---
-        if req.anchors:
-            plan_obj = postprocess_with_anchors(plan_obj, anchors=req.anchors or [], hard_lock=bool(req.hard_lock))
+def _run_generate_job(progress, req: GenerateRequest) -> dict:
+    """
+    Pipeline sinh plan chạy trên worker của PLAN_JOBS (sync, client OpenAI sync).
+    Stage: context -> recipes k/N (wheel) hoặc theme -> plan (LLM) -> render -> persist.
+    """
+    inp = _generate_inputs(req)
+    people, headcount = inp["people"], inp["headcount"]
 
-        # --- Render HTML để xem nhanh ---
-        html = render_plan_html(plan_obj)
+    progress.update("context", 2)
+    wctx = WheelContext(req.family_id, req.meal_date, req.meal_type)
+    participants_count = _count_participants_union(
+        req.submissions or [], req.family_id, req.meal_date, req.meal_type, wctx
+    )
 
-        # --- Lưu DB và trả về plan_id ---
-        plan_code = f"{req.family_id}_{int(datetime.datetime.now().timestamp())}"
-        meal_code_value = ""  # legacy off
-        plan_id = db_execute(
-            """
-            INSERT INTO plans
-              (plan_code, family_id, meal_type, meal_date, source_date, submission_cnt, plan_json, plan_html, model_raw, meal_code, comment)
-            VALUES
-              (%s,        %s,        %s,        %s,        %s,          %s,              %s,        %s,        %s,        %s,       %s)
-            """,
-            (
-                plan_code,
-                req.family_id,
-                req.meal_type,
-                req.meal_date,
-                req.meal_date,
-                len(people),
-                json.dumps(plan_obj, ensure_ascii=False),
-                html,
-                model_raw,
-                meal_code_value,
-                (req.feedback or "").strip(),
-            ),
-        )
+    # === WHEEL-FIRST MODE: nếu phiên có wheel data hợp lệ thì sinh plan theo luật wheel ===
+    plan_obj_raw = _generate_plan_wheel_mode(
+        family_id=req.family_id,
+        meal_date=req.meal_date,
+        meal_type=req.meal_type,
+        headcount_hint=headcount,
+        people_payload=people,
+        forced_winner=inp["forced_winner"],
+        progress=progress,
+        wctx=wctx,
+    )
+    if plan_obj_raw:
+        model_raw = json.dumps({"mode": "wheel-first"}, ensure_ascii=False)
+    else:
+        plan_obj_raw, model_raw = _llm_generate_plan(inp["payload"], progress=progress)
 
-        return {
-            "ok": True,
-            "plan_id": plan_id,
-            "plan_json": plan_obj,
-            "plan_html": html,
-            "family_id": req.family_id,
-            "meal_date": req.meal_date,
-            "meal_type": req.meal_type,
-        }
+    progress.update("render", 85)
+    plan_obj = _finalize_generated_plan(req, plan_obj_raw, inp["dinner_time"], headcount, participants_count)
+
+    progress.update("persist", 92)
+    plan_id = _insert_generated_plan(req, len(people), plan_obj, model_raw)
+
+    return {
+        "plan_id": plan_id,
+        "family_id": req.family_id,
+        "meal_date": req.meal_date,
+        "meal_type": req.meal_type,
+    }
+
+
+async def _agenerate_inline(req: GenerateRequest) -> dict:
+    """Sinh plan ngay trong request (async): LLM qua AsyncOpenAI, DB chạy trong threadpool."""
+    inp = _generate_inputs(req)
+    people, headcount = inp["people"], inp["headcount"]
+
+    # === Số participant để hiển thị (đúng luật: người có role/chef/tasks HOẶC cung cấp >=1 món)
+    wctx = WheelContext(req.family_id, req.meal_date, req.meal_type)
+    participants_count = await run_in_threadpool(
+        _count_participants_union, req.submissions or [], req.family_id, req.meal_date, req.meal_type, wctx
+    )
+
+    # === WHEEL-FIRST MODE: nếu phiên có wheel data hợp lệ thì sinh plan theo luật wheel ===
+    plan_obj_raw = await _agenerate_plan_wheel_mode(
+        family_id=req.family_id,
+        meal_date=req.meal_date,
+        meal_type=req.meal_type,
+        headcount_hint=headcount,
+        people_payload=people,
+        forced_winner=inp["forced_winner"],
+        wctx=wctx,
+    )
+    if plan_obj_raw:
+        model_raw = json.dumps({"mode": "wheel-first"}, ensure_ascii=False)
+    else:
+        # --- Gọi LLM (có logic THEME/forced menu bên trong) ---
+        plan_obj_raw, model_raw = await _allm_generate_plan(inp["payload"])
+
+    plan_obj = _finalize_generated_plan(req, plan_obj_raw, inp["dinner_time"], headcount, participants_count)
+
+    # --- Lưu DB và trả về plan_id (HTML xem nhanh: GET html_url, render lazily) ---
+    plan_id = await run_in_threadpool(_insert_generated_plan, req, len(people), plan_obj, model_raw)
+
+    return {
+        "ok": True,
+        "plan_id": plan_id,
+        "plan_json": plan_obj,
+        "html_url": _plan_html_url(plan_id),
+        "family_id": req.family_id,
+        "meal_date": req.meal_date,
+        "meal_type": req.meal_type,
+    }
+
+
+@router.post("/generate")
+async def generate_plan(
+    req: GenerateRequest,
+    wait: bool = Query(False, description="true = sinh ngay trong request (legacy), mặc định trả job_id"),
+):
+    """
+    Generate meal plan centered around wheel/AI theme (if present in remarks).
+    - Mặc định: đưa vào PLAN_JOBS, trả 202 + job_id ngay; FE poll GET /plan/jobs/{job_id}.
+    - wait=true: chạy pipeline async ngay trong request và trả plan như trước.
+    - Single-flight: request giống hệt (cùng phiên + submissions + anchors) khi lượt trước còn
+      đang chạy sẽ nhận cùng job_id / cùng plan_id, không sinh thêm plan.
+    - Nhận anchors/hard_lock từ FE (optional) rồi post-process.
+    """
+    try:
+        log_api_call("/plan/generate", "POST")
+
+        flight_key = _generate_flight_key(req)
+        if not wait:
+            _generate_inputs(req)  # validate sớm để trả 400 ngay, không tạo job hỏng
+            job_id = PLAN_JOBS.submit("plan.generate", _run_generate_job, req, dedupe_key=flight_key)
+            return JSONResponse(
+                status_code=202,
+                content={"ok": True, "job_id": job_id, "status": "queued"},
+            )
+
+        return await _GENERATE_FLIGHTS.run(flight_key, lambda: _agenerate_inline(req))
     except HTTPException:
         raise
     except Exception as e:
         log_error(e, "plan.generate")
         raise HTTPException(500, "Internal server error")
 
+
+def _sse(event: str, data: dict) -> str:
+    """1 message Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _lan_dish(dish: dict, dinner_time: str, headcount: int) -> dict:
+    """coerce_to_lan_schema cho 1 món (để stream từng món)."""
+    lan = coerce_to_lan_schema({"dishes": [dish]}, dinner_time, headcount)
+    return (lan.get("dishes") or [{}])[0]
+
+
+async def _await_or_none(task: "asyncio.Future", end: float):
+    """Chờ task tới hạn chót `end` (loop.time()); quá hạn -> huỷ task, trả None."""
+    remaining = max(0.0, end - asyncio.get_running_loop().time())
+    done, _ = await asyncio.wait({task}, timeout=remaining)
+    if not done:
+        task.cancel()
+        return None
+    return task.result() if task.exception() is None else None
+
+
+@router.post("/generate/stream")
+async def generate_plan_stream(req: GenerateRequest):
+    """
+    Sinh plan và stream từng món qua Server-Sent Events:
+      event: start  -> {mode, total}
+      event: dish   -> {index, kind: winner|variant|dish, dish}   (winner EXACT trước, rồi từng variant)
+      event: done   -> {plan_id, plan_json, html_url, ...}
+      event: error  -> {detail}
+    Wheel mode: recipe gọi song song, món nào xong (theo thứ tự participants) gửi ngay.
+    """
+    log_api_call("/plan/generate/stream", "POST")
+    inp = _generate_inputs(req)  # 400 trước khi mở stream
+    people, headcount, dinner_time = inp["people"], inp["headcount"], inp["dinner_time"]
+
+    async def events():
+        tasks: list = []
+        try:
+            wctx = WheelContext(req.family_id, req.meal_date, req.meal_type)
+            participants_count = await run_in_threadpool(
+                _count_participants_union, req.submissions or [], req.family_id, req.meal_date, req.meal_type, wctx
+            )
+            prep = await run_in_threadpool(
+                _wheel_prepare, req.family_id, req.meal_date, req.meal_type, inp["forced_winner"], wctx
+            )
+
+            if prep is not None:
+                # Số dish thực sự gửi: winner + variant (member là proposer winner / không có base thì không có dish)
+                total = min(1 + len(prep["variant_bases"]), prep["target_count"])
+                yield _sse("start", {"mode": "wheel-first", "total": total})
+                deadline = OPENAI_CONFIG.get("plan_deadline") or 60
+                end = asyncio.get_running_loop().time() + deadline
+                tasks = [asyncio.ensure_future(_allm_one_recipe_bounded(prompt, fb, cache))
+                         for prompt, fb, cache in prep["jobs"]]
+                offset = 0 if prep.get("winner_recipe") else 1
+
+                winner_raw = await _await_or_none(tasks[0], end) if offset else None
+                dishes_out = [_wheel_winner_recipe(prep, winner_raw)]
+                yield _sse("dish", {"index": 0, "kind": "winner",
+                                    "dish": _lan_dish(dishes_out[0], dinner_time, headcount)})
+
+                for (uid, base), task in zip(prep["variant_bases"], tasks[offset:]):
+                    if len(dishes_out) >= prep["target_count"]:
+                        break
+                    dish = _wheel_variant_recipe(prep, base, await _await_or_none(task, end))
+                    dishes_out.append(dish)
+                    yield _sse("dish", {"index": len(dishes_out) - 1, "kind": "variant",
+                                        "dish": _lan_dish(dish, dinner_time, headcount)})
+
+                plan_obj_raw = _wheel_plan_obj(dishes_out, req.family_id, req.meal_date, req.meal_type, headcount, people)
+                model_raw = json.dumps({"mode": "wheel-first"}, ensure_ascii=False)
+            else:
+                yield _sse("start", {"mode": "llm", "total": None})
+                plan_obj_raw, model_raw = await _allm_generate_plan(inp["payload"])
+                for i, dish in enumerate(plan_obj_raw.get("dishes") or []):
+                    if isinstance(dish, dict):
+                        yield _sse("dish", {"index": i, "kind": "dish",
+                                            "dish": _lan_dish(dish, dinner_time, headcount)})
+
+            plan_obj = _finalize_generated_plan(req, plan_obj_raw, dinner_time, headcount, participants_count)
+            plan_id = await run_in_threadpool(_insert_generated_plan, req, len(people), plan_obj, model_raw)
+
+            yield _sse("done", {
+                "ok": True,
+                "plan_id": plan_id,
+                "plan_json": plan_obj,
+                "html_url": _plan_html_url(plan_id),
+                "family_id": req.family_id,
+                "meal_date": req.meal_date,
+                "meal_type": req.meal_type,
+            })
+        except Exception as e:
+            log_error(e, "plan.generate_stream")
+            yield _sse("error", {"detail": "Internal server error"})
+        finally:
+            # client ngắt kết nối / lỗi giữa chừng -> huỷ các recipe còn chạy
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/jobs/{job_id}")
+def get_plan_job(job_id: str):
+    """Trạng thái job sinh plan: status/stage/percent (+ result.plan_id khi xong)."""
+    job = PLAN_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
 @router.get("/id/{plan_id}")
 def get_plan(plan_id: int):
     """获取计划详情"""
     try:
         log_api_call(f"/plan/{plan_id}", "GET")
 
-        plan = db_query(
+        plan = db_query_or_primary(
             """
             SELECT id, plan_code, family_id, meal_type, meal_date, source_date, submission_cnt, 
-                   plan_json, plan_html, created_at, meal_code, comment
+                   plan_json, created_at, meal_code, comment
             FROM plans WHERE id = %s
             """,
             (plan_id,),
@@ -1799,9 +2518,10 @@ def get_plan(plan_id: int):
         plan_data = plan[0]
         if plan_data.get("plan_json"):
             try:
-                plan_data["plan_json"] = json.loads(plan_data["plan_json"])
+                plan_data["plan_json"] = plan_codec.decode_json(plan_data["plan_json"], {})
             except Exception:
                 plan_data["plan_json"] = {}
+        plan_data["html_url"] = _plan_html_url(plan_id)
 
         return plan_data
     except HTTPException:
@@ -1810,49 +2530,179 @@ def get_plan(plan_id: int):
         log_error(e, f"get_plan {plan_id}")
         raise HTTPException(500, "Internal server error")
 
+
+# HTML render cache: key = "<plan_id>-<md5(plan_json)>" (cũng là ETag) -> HTML
+_PLAN_HTML = LRUTTLCache(maxsize=256, ttl=3600)
+
+
+@router.get("/id/{plan_id}/html")
+def get_plan_html(plan_id: int, request: Request):
+    """
+    HTML xem nhanh của plan, render từ plan_json khi cần (không lưu plan_html trong DB nữa).
+    ETag theo nội dung plan_json: If-None-Match khớp -> 304 mà không cần tải/render plan.
+    """
+    try:
+        log_api_call(f"/plan/{plan_id}/html", "GET")
+
+        row = db_query_or_primary("SELECT MD5(plan_json) AS h FROM plans WHERE id = %s", (plan_id,))
+        if not row:
+            raise HTTPException(404, "Plan not found")
+        key = f"{plan_id}-{row[0].get('h') or 'empty'}"
+        etag = f'"{key}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        if etag in [t.strip() for t in (request.headers.get("if-none-match") or "").split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        html = _PLAN_HTML.get(key)
+        if html is None:
+            rows = db_query_or_primary("SELECT plan_json FROM plans WHERE id = %s", (plan_id,))
+            if not rows:
+                raise HTTPException(404, "Plan not found")
+            try:
+                plan_obj = plan_codec.decode_json(rows[0].get("plan_json"), {})
+            except Exception:
+                plan_obj = {}
+            html = render_plan_html(plan_obj)
+            _PLAN_HTML.set(key, html)
+        return HTMLResponse(html, headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_error(e, f"get_plan_html {plan_id}")
+        raise HTTPException(500, "Internal server error")
+
+def _stream_plan_rows(first: Optional[Dict[str, Any]], rest, decorate=None):
+    """JSON array, mỗi lần 1 plan (plan_json đã parse để FE dùng luôn)."""
+    try:
+        yield "["
+        row = first
+        sep = ""
+        while row is not None:
+            pj = row.get("plan_json")
+            if pj:
+                try:
+                    row["plan_json"] = plan_codec.decode_json(pj)
+                except Exception:
+                    # giữ nguyên nếu parse lỗi
+                    pass
+            if decorate is not None:
+                row = decorate(row)
+            yield sep + json.dumps(jsonable_encoder(row), ensure_ascii=False)
+            sep = ","
+            row = next(rest, None)
+        yield "]"
+    finally:
+        rest.close()
+
+
+# Cột nhẹ của bảng plans được phép chọn qua ?fields=
+_PLAN_LIST_COLUMNS = (
+    "id", "plan_code", "created_at", "meal_type", "meal_date", "family_id",
+    "submission_cnt", "meal_code", "comment",
+)
+# Trường phụ: summary {dish_count, dish_names, headcount}, dish_names, plan_json (nặng)
+_PLAN_LIST_EXTRAS = ("summary", "dish_names", "plan_json")
+_PLAN_PAGE_DEFAULT = 50
+_PLAN_PAGE_MAX = 200
+
+
+def _plan_list_fields(fields: Optional[str], with_json: bool) -> List[str]:
+    if not fields:
+        chosen = list(_PLAN_LIST_COLUMNS) + ["summary"]
+    else:
+        chosen = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in chosen if f not in _PLAN_LIST_COLUMNS + _PLAN_LIST_EXTRAS]
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in chosen:
+            chosen.insert(0, "id")
+    if with_json and "plan_json" not in chosen:
+        chosen.append("plan_json")
+    return chosen
+
+
+def _decorate_plan_row(row: Dict[str, Any], chosen: List[str],
+                       summaries: Optional[Dict[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    if summaries is not None:
+        summary = summaries.get(int(row["id"])) or plan_summary.summarize({})
+        if "summary" in chosen:
+            row["summary"] = summary
+        if "dish_names" in chosen:
+            row["dish_names"] = summary["dish_names"]
+    return row
+
+
 @router.get("/family/{family_id}")
 def list_plans(
     family_id: str,
-    with_json: bool = Query(False, description="Return plan_json when true"),
+    with_json: bool = Query(False, description="Return plan_json when true (same as fields=...,plan_json)"),
+    before_id: Optional[int] = Query(None, description="Keyset cursor: only plans with id < before_id"),
+    limit: int = Query(_PLAN_PAGE_DEFAULT, ge=1, le=_PLAN_PAGE_MAX, description="Page size"),
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated: id, plan_code, created_at, meal_type, meal_date, family_id, "
+                    "submission_cnt, meal_code, comment, summary, dish_names, plan_json",
+    ),
 ):
-    """获取家庭的所有计划"""
+    """
+    获取家庭的计划（mới nhất trước, phân trang keyset theo id）.
+    Còn trang sau -> header X-Next-Before-Id (truyền lại làm ?before_id=).
+    Mặc định trả các cột nhẹ + summary {dish_count, dish_names, headcount} (tính lúc ghi plan);
+    plan_json chỉ có khi with_json=1 hoặc fields chứa plan_json (stream từng dòng).
+    """
     try:
         log_api_call(f"/plan/family/{family_id}", "GET")
+        chosen = _plan_list_fields(fields, with_json)
 
-        if with_json:
-            rows = db_query(
-                """
-                SELECT id, plan_code, created_at, meal_type, meal_date, family_id,
-                       submission_cnt, meal_code, comment, plan_json
-                FROM plans
-                WHERE family_id=%s
-                ORDER BY id DESC
-                """,
-                (family_id,),
+        # 1) id của trang (+1 để biết còn trang sau) — chỉ đụng index (family_id, id)
+        if before_id is not None:
+            id_rows = db_query(
+                "SELECT id FROM plans WHERE family_id=%s AND id<%s ORDER BY id DESC LIMIT %s",
+                (family_id, before_id, limit + 1),
             )
-            # parse plan_json để FE dùng luôn
-            for r in rows or []:
-                pj = r.get("plan_json")
-                if pj:
-                    try:
-                        r["plan_json"] = json.loads(pj)
-                    except Exception:
-                        # giữ nguyên nếu parse lỗi
-                        pass
-            return rows
-
-        # nhánh mặc định (nhẹ, không trả plan_json)
-        rows = db_query(
-            """
-            SELECT id, plan_code, created_at, meal_type, meal_date, family_id,
-                   submission_cnt, meal_code, comment
+        else:
+            id_rows = db_query(
+                "SELECT id FROM plans WHERE family_id=%s ORDER BY id DESC LIMIT %s",
+                (family_id, limit + 1),
+            )
+        ids = [int(r["id"]) for r in id_rows]
+        headers = {}
+        if len(ids) > limit:
+            ids = ids[:limit]
+            headers["X-Next-Before-Id"] = str(ids[-1])
+        if not ids:
+            return JSONResponse([], headers=headers)
+
+        # 2) chỉ các cột được chọn, trong khoảng id của trang
+        cols = [c for c in _PLAN_LIST_COLUMNS if c in chosen]
+        if "plan_json" in chosen:
+            cols.append("plan_json")
+        sql = f"""
+            SELECT {", ".join(cols)}
             FROM plans
-            WHERE family_id=%s
+            WHERE family_id=%s AND id BETWEEN %s AND %s
             ORDER BY id DESC
-            """,
-            (family_id,),
-        )
-        return rows
+        """
+        params = (family_id, ids[-1], ids[0])
+
+        summaries = None
+        if "summary" in chosen or "dish_names" in chosen:
+            summaries = plan_summary.load_many(ids)
+        decorate = functools.partial(_decorate_plan_row, chosen=chosen, summaries=summaries)
+
+        if "plan_json" in chosen:
+            # plan_json nặng -> stream từng dòng (unbuffered cursor)
+            rows = db_iter(sql, params)
+            # đọc dòng đầu ngay để lỗi DB vẫn thành 500 trước khi bắt đầu stream
+            first = next(rows, None)
+            return StreamingResponse(_stream_plan_rows(first, rows, decorate),
+                                     media_type="application/json", headers=headers)
+
+        rows = db_query(sql, params)
+        return JSONResponse(jsonable_encoder([decorate(r) for r in rows]), headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         log_error(e, f"list_plans for family {family_id}")
         raise HTTPException(500, "Internal server error")
@@ -1874,9 +2724,11 @@ def get_latest_plan(date: str = Query(None, description="Date in YYYY-MM-DD form
         r = rows[0]
         if r.get("plan_json"):
             try:
-                r["plan_json"] = json.loads(r["plan_json"])
+                r["plan_json"] = plan_codec.decode_json(r["plan_json"], {})
             except Exception:
                 r["plan_json"] = {}
+        if r.get("model_raw"):
+            r["model_raw"] = plan_codec.decode_text(r["model_raw"])
         return r
     except HTTPException:
         raise
@@ -1913,13 +2765,12 @@ def ingest_plan(request: PlanIngest):
         except Exception:
             pass
 
-        html = render_plan_html(lan_plan)
-
         plan_code = f"{request.family_id}_{int(datetime.datetime.now().timestamp())}"
+        _ensure_plans_schema()
         plan_id = db_execute(
             """
-            INSERT INTO plans(plan_code,family_id,meal_type,meal_date,source_date,submission_cnt,plan_json,plan_html,model_raw) 
-            VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            INSERT INTO plans(plan_code,family_id,meal_type,meal_date,source_date,submission_cnt,plan_json,model_raw) 
+            VALUES(%s,%s,%s,%s,%s,%s,%s,%s)
             """,
             (
                 plan_code,
@@ -1928,17 +2779,18 @@ def ingest_plan(request: PlanIngest):
                 request.meal_date,
                 request.meal_date,
                 subs_cnt,
-                json.dumps(lan_plan, ensure_ascii=False),
-                html,
-                json.dumps(request.payload, ensure_ascii=False),
+                plan_codec.encode(lan_plan),
+                plan_codec.encode(request.payload),
             ),
         )
+        plan_summary.remember(plan_id, request.family_id, lan_plan)
+        _prewarm_plan_images(plan_id, lan_plan)
 
         return {
             "ok": True,
             "plan_id": plan_id,
             "plan_json": lan_plan,
-            "plan_html": html,
+            "html_url": _plan_html_url(plan_id),
             "family_id": request.family_id,
             "meal_date": request.meal_date,
             "meal_type": request.meal_type,
@@ -1986,6 +2838,7 @@ def delete_plan(plan_id: int, user_id: str):
             raise HTTPException(403, "Only family holder can delete plans")
 
         db_execute("DELETE FROM plans WHERE id = %s", (plan_id,))
+        plan_summary.forget(plan_id)
         logger.info("Plan %s deleted by holder %s", plan_id, user_id)
         return {"ok": True, "message": "Plan deleted successfully"}
     except HTTPException:
@@ -2004,7 +2857,7 @@ def get_plans_by_meal_code(meal_code: str):
         plans = db_query(
             """
             SELECT id, plan_code, family_id, meal_type, meal_date, source_date, 
-                   submission_cnt, plan_json, plan_html, model_raw, created_at, meal_code, comment
+                   submission_cnt, plan_json, model_raw, created_at, meal_code, comment
             FROM plans WHERE meal_code = %s
             ORDER BY created_at DESC
             """,
@@ -2012,7 +2865,9 @@ def get_plans_by_meal_code(meal_code: str):
         )
         for plan in plans:
             if plan["plan_json"]:
-                plan["plan_json"] = json.loads(plan["plan_json"])
+                plan["plan_json"] = plan_codec.decode_json(plan["plan_json"])
+            if plan.get("model_raw"):
+                plan["model_raw"] = plan_codec.decode_text(plan["model_raw"])
         return plans
     except Exception as e:
         log_error(e, f"get_plans_by_meal_code for meal_code {meal_code}")
@@ -2043,95 +2898,143 @@ def add_comment(plan_id: int, user_name: str = Query(...), comment_text: str = Q
         raise HTTPException(500, "Internal server error")
 
 
-@router.post("/{plan_id}/regenerate")
-def regenerate_plan(plan_id: int, user_id: str = Query(..., description="User ID for permission check")):
-    """基于comment重新生成计划（仅holder可操作）"""
-    try:
-        log_api_call(f"/plan/{plan_id}/regenerate", "POST", user_id)
+def _load_regenerate_input(plan_id: int, user_id: str) -> dict:
+    """
+    Đọc plan gốc + kiểm tra quyền holder + gom submissions để dựng payload cho LLM (chỉ DB, sync).
+    Ném HTTPException nếu không hợp lệ.
+    """
 
-        plan = db_query(
-            """
-            SELECT plan_code, family_id, meal_type, meal_date, source_date, 
-                   submission_cnt, plan_json, meal_code, comment
-            FROM plans WHERE id = %s
-            """,
-            (plan_id,),
-        )
-        if not plan:
-            raise HTTPException(404, "Plan not found")
-        plan_data = plan[0]
+    plan = db_query(
+        """
+        SELECT plan_code, family_id, meal_type, meal_date, source_date, 
+               submission_cnt, plan_json, meal_code, comment
+        FROM plans WHERE id = %s
+        """,
+        (plan_id,),
+    )
+    if not plan:
+        raise HTTPException(404, "Plan not found")
+    plan_data = plan[0]
 
-        membership = db_query(
-            "SELECT role FROM family_memberships WHERE family_id = %s AND user_id = %s",
-            (plan_data["family_id"], user_id),
-        )
-        if not membership or membership[0]["role"] != "holder":
-            raise HTTPException(403, "Only family holder can regenerate plans")
+    membership = db_query(
+        "SELECT role FROM family_memberships WHERE family_id = %s AND user_id = %s",
+        (plan_data["family_id"], user_id),
+    )
+    if not membership or membership[0]["role"] != "holder":
+        raise HTTPException(403, "Only family holder can regenerate plans")
 
-        family = db_query("SELECT family_name FROM families WHERE family_id=%s", (plan_data["family_id"],))
-        if not family:
-            raise HTTPException(404, "Family not found")
-        family_name = family[0]["family_name"]
+    family = db_query("SELECT family_name FROM families WHERE family_id=%s", (plan_data["family_id"],))
+    if not family:
+        raise HTTPException(404, "Family not found")
+    family_name = family[0]["family_name"]
 
-        # NEW: submissions by (family_id, date, type); fallback to legacy meal_code
-        meal_code = plan_data.get("meal_code") or ""
-        subs = db_query(
-            """
-            SELECT * FROM info_submissions
-            WHERE family_id=%s AND meal_date=%s AND meal_type=%s
-            ORDER BY id ASC
-            """,
-            (plan_data["family_id"], plan_data["meal_date"], plan_data["meal_type"]),
-        )
-        if not subs and meal_code:
-            subs = db_query("SELECT * FROM info_submissions WHERE meal_code=%s ORDER BY id ASC", (meal_code,))
-        if not subs:
-            raise HTTPException(400, "No submissions found for regeneration")
-
-        original_plan_json = json.loads(plan_data["plan_json"]) if plan_data.get("plan_json") else {}
-        headcount = original_plan_json.get("meta", {}).get("headcount", len(subs))
-
-        roles_lines = []
-        comments = plan_data.get("comment", "")
-        for sub in subs:
-            if isinstance(sub.get("preferences"), str):
-                try:
-                    preferences = json.loads(sub.get("preferences", "{}"))
-                except Exception:
-                    preferences = {}
-            else:
-                preferences = sub.get("preferences", {}) or {}
-
-            # normalize FE keys
-            if "likes" not in preferences and "liked_tastes" in preferences:
-                preferences["likes"] = preferences.get("liked_tastes", []) or []
-
-            username = sub.get("user_id", "member") or "member"
-            remark = sub.get("remark", "")
-            if comments:
-                remark = (remark + "\n\nPrevious feedback:\n" + comments).strip()
-            role_info = {
-                "person_role": "member",
-                "display_name": username,
-                "is_chef": preferences.get("is_chef", False),
-                "tasks": preferences.get("tasks", []),
-                "food_style": preferences.get("food_style", ""),
-                "likes": preferences.get("likes", []),
-                "dislikes": preferences.get("dislikes", []),
-                "allergies": preferences.get("allergies", ""),
-                "remark": remark,
-            }
-            roles_lines.append(role_info)
-
-        user_content = {
-            "date": plan_data["meal_date"],
-            "meal_type": plan_data["meal_type"],
-            "headcount": headcount,
-            "people": roles_lines,
-            "schema": PLAN_SCHEMA_EXAMPLE,
+    # NEW: submissions by (family_id, date, type); fallback to legacy meal_code
+    meal_code = plan_data.get("meal_code") or ""
+    subs = db_query(
+        """
+        SELECT * FROM info_submissions
+        WHERE family_id=%s AND meal_date=%s AND meal_type=%s
+        ORDER BY id ASC
+        """,
+        (plan_data["family_id"], plan_data["meal_date"], plan_data["meal_type"]),
+    )
+    if not subs and meal_code:
+        subs = db_query("SELECT * FROM info_submissions WHERE meal_code=%s ORDER BY id ASC", (meal_code,))
+    if not subs:
+        raise HTTPException(400, "No submissions found for regeneration")
+
+    original_plan_json = plan_codec.decode_json(plan_data.get("plan_json"), {})
+    headcount = original_plan_json.get("meta", {}).get("headcount", len(subs))
+
+    roles_lines = []
+    comments = plan_data.get("comment", "")
+    for sub in subs:
+        if isinstance(sub.get("preferences"), str):
+            try:
+                preferences = json.loads(sub.get("preferences", "{}"))
+            except Exception:
+                preferences = {}
+        else:
+            preferences = sub.get("preferences", {}) or {}
+
+        # normalize FE keys
+        if "likes" not in preferences and "liked_tastes" in preferences:
+            preferences["likes"] = preferences.get("liked_tastes", []) or []
+
+        username = sub.get("user_id", "member") or "member"
+        remark = sub.get("remark", "")
+        if comments:
+            remark = (remark + "\n\nPrevious feedback:\n" + comments).strip()
+        role_info = {
+            "person_role": "member",
+            "display_name": username,
+            "is_chef": preferences.get("is_chef", False),
+            "tasks": preferences.get("tasks", []),
+            "food_style": preferences.get("food_style", ""),
+            "likes": preferences.get("likes", []),
+            "dislikes": preferences.get("dislikes", []),
+            "allergies": preferences.get("allergies", ""),
+            "remark": remark,
         }
+        roles_lines.append(role_info)
+
+    user_content = {
+        "date": plan_data["meal_date"],
+        "meal_type": plan_data["meal_type"],
+        "headcount": headcount,
+        "people": roles_lines,
+        "schema": PLAN_SCHEMA_EXAMPLE,
+    }
+    return {
+        "plan_data": plan_data,
+        "family_name": family_name,
+        "meal_code": meal_code,
+        "headcount": headcount,
+        "user_content": user_content,
+    }
 
-        plan_obj_raw, content = _llm_generate_plan(user_content)
+
+def _insert_regenerated_plan(plan_id: int, ctx: dict, lan_plan: dict, content: str) -> int:
+    plan_data = ctx["plan_data"]
+    meal_code = ctx["meal_code"]
+    new_plan_code = f"{plan_data['family_id']}_{int(datetime.datetime.now().timestamp())}"
+    _ensure_plans_schema()
+    new_plan_id = db_execute(
+        """
+        INSERT INTO plans
+          (plan_code,family_id,meal_type,meal_date,source_date,submission_cnt,plan_json,model_raw,meal_code,comment) 
+        VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        """,
+        (
+            new_plan_code,
+            plan_data["family_id"],
+            plan_data["meal_type"],
+            plan_data["meal_date"],
+            plan_data["source_date"],
+            plan_data["submission_cnt"],
+            plan_codec.encode(lan_plan),
+            plan_codec.encode(content),
+            meal_code,  # keep legacy value if any (can be None)
+            f"Regenerated from plan #{plan_id}",
+        ),
+    )
+    plan_summary.remember(new_plan_id, plan_data["family_id"], lan_plan)
+    _prewarm_plan_images(new_plan_id, lan_plan)
+    return new_plan_id
+
+
+@router.post("/{plan_id}/regenerate")
+async def regenerate_plan(plan_id: int, user_id: str = Query(..., description="User ID for permission check")):
+    """基于comment重新生成计划（仅holder可操作）"""
+    try:
+        log_api_call(f"/plan/{plan_id}/regenerate", "POST", user_id)
+
+        ctx = await run_in_threadpool(_load_regenerate_input, plan_id, user_id)
+        plan_data = ctx["plan_data"]
+        family_name = ctx["family_name"]
+        headcount = ctx["headcount"]
+
+        plan_obj_raw, content = await _allm_generate_plan(ctx["user_content"])
 
         lan_plan = coerce_to_lan_schema(
             plan_obj_raw,
@@ -2149,36 +3052,14 @@ def regenerate_plan(plan_id: int, user_id: str = Query(..., description="User ID
         except Exception:
             pass
 
-        html = render_plan_html(lan_plan)
-
-        new_plan_code = f"{plan_data['family_id']}_{int(datetime.datetime.now().timestamp())}"
-        new_plan_id = db_execute(
-            """
-            INSERT INTO plans
-              (plan_code,family_id,meal_type,meal_date,source_date,submission_cnt,plan_json,plan_html,model_raw,meal_code,comment) 
-            VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            """,
-            (
-                new_plan_code,
-                plan_data["family_id"],
-                plan_data["meal_type"],
-                plan_data["meal_date"],
-                plan_data["source_date"],
-                plan_data["submission_cnt"],
-                json.dumps(lan_plan, ensure_ascii=False),
-                html,
-                content,
-                meal_code,  # keep legacy value if any (can be None)
-                f"Regenerated from plan #{plan_id}",
-            ),
-        )
+        new_plan_id = await run_in_threadpool(_insert_regenerated_plan, plan_id, ctx, lan_plan, content)
 
         logger.info("Plan regenerated: old_plan_id=%s, new_plan_id=%s", plan_id, new_plan_id)
         return {
             "ok": True,
             "plan_id": new_plan_id,
             "plan_json": lan_plan,
-            "plan_html": html,
+            "html_url": _plan_html_url(new_plan_id),
             "family_id": plan_data["family_id"],
             "meal_date": plan_data["meal_date"],
             "meal_type": plan_data["meal_type"],
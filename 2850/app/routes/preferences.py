@@ -4,7 +4,8 @@ from fastapi import APIRouter, HTTPException, Path, Query
 from pydantic import BaseModel
 import json
 
-from ..database import db_query, db_execute
+from ..database import db_query, db_execute, get_async_pool
+from ..page.services import preferences as pref_service
 from ..utils import log_api_call, log_error
 
 router = APIRouter(prefix="/api/preferences", tags=["preferences"])
@@ -95,6 +96,10 @@ def _normalize_pref(obj: Dict[str, Any]) -> Dict[str, Any]:
 # Models
 # -------------------------
 
+class UserPrefIn(BaseModel):
+    preference: Dict[str, Any]
+
+
 class SavePrefIn(BaseModel):
     family_id: str
     user_id: str
@@ -332,3 +337,80 @@ def merged_pref(
         log_error(e, "merged_pref")
         raise HTTPException(500, "Internal server error")
 
+
+# -------------------------
+# Async routes (aiomysql, page/services/preferences.py)
+#   default pref theo user (user_cooking_prefs) + override theo family (family_user_cooking_prefs)
+# -------------------------
+
+def _is_missing_table(e: Exception) -> bool:
+    msg = str(e)
+    return "1146" in msg or "doesn't exist" in msg or "does not exist" in msg
+
+
+async def _pref_pool():
+    try:
+        return await get_async_pool()
+    except RuntimeError:
+        raise HTTPException(503, "Async database driver is not available")
+
+
+@router.get("/user/{user_id}")
+async def get_user_merged_pref(
+    user_id: str = Path(..., description="User ID"),
+    family_id: Optional[str] = Query(None, description="Family ID (override > default)"),
+):
+    """
+    Preference hợp nhất của user: default (user) + override (family) nếu có family_id.
+    Trả về: { user_id, family_id, merged, default, override, updated_at_default, updated_at_override }
+    """
+    try:
+        log_api_call(f"/preferences/user/{user_id}", "GET", user_id, family_id=family_id)
+        pool = await _pref_pool()
+        try:
+            return await pref_service.get_merged_pref(pool, user_id, family_id)
+        except Exception as ie:
+            # Bảng chưa có → coi như chưa lưu gì
+            if _is_missing_table(ie):
+                return {
+                    "user_id": user_id,
+                    "family_id": family_id,
+                    "merged": pref_service._normalize_role_like({}),
+                    "default": None,
+                    "override": None,
+                    "updated_at_default": None,
+                    "updated_at_override": None,
+                }
+            raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_error(e, "get_user_merged_pref")
+        raise HTTPException(500, "Internal server error")
+
+
+@router.put("/family/{family_id}/user/{user_id}")
+async def save_family_user_pref(
+    req: UserPrefIn,
+    family_id: str = Path(..., description="Family ID"),
+    user_id: str = Path(..., description="User ID"),
+):
+    """Lưu (upsert) override preference của user trong 1 family. Trả về updated_at."""
+    try:
+        log_api_call(f"/preferences/family/{family_id}/user/{user_id}", "PUT", user_id, family_id=family_id)
+        pool = await _pref_pool()
+        try:
+            updated_at = await pref_service.upsert_family_user_pref(pool, family_id, user_id, req.preference or {})
+        except Exception as ie:
+            if _is_missing_table(ie):
+                raise HTTPException(
+                    500,
+                    "Table 'family_user_cooking_prefs' is missing. Please run the SQL migration to create it.",
+                )
+            raise
+        return {"ok": True, "updated_at": updated_at}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_error(e, "save_family_user_pref")
+        raise HTTPException(500, "Internal server error")
@@ -5,7 +5,7 @@ import json
 import logging
 from fastapi import APIRouter, HTTPException, Query
 from ..models import InfoCollectIn
-from ..database import db_query, db_execute
+from ..database import db_query, db_execute, db_transaction
 from ..utils import log_api_call, log_error
 
 logger = logging.getLogger("meal")
@@ -20,72 +20,75 @@ def submit_info(request: InfoCollectIn):
         if not (request.family_id and request.user_id and request.meal_date and request.meal_type):
             raise HTTPException(400, "Missing required fields")
 
-        existed = db_query(
-            """
-            SELECT id FROM info_submissions
-            WHERE family_id=%s AND user_id=%s AND meal_date=%s AND meal_type=%s
-            ORDER BY id DESC LIMIT 1
-            """,
-            (request.family_id, request.user_id, request.meal_date, request.meal_type),
-        )
-
-        # Không còn dùng meal_code -> để None (hoặc '' nếu cột NOT NULL)
-        meal_code_value = ""
-
-        if existed:
-            db_execute(
+        # SELECT ... FOR UPDATE + UPDATE/INSERT trên 1 connection, commit 1 lần
+        with db_transaction() as tx:
+            existed = tx.query(
                 """
-                UPDATE info_submissions
-                SET role=%s,
-                    display_name=%s,
-                    age=%s,
-                    meal_date=%s,
-                    meal_type=%s,
-                    preferences=%s,
-                    drinks=%s,
-                    remark=%s,
-                    meal_code=%s,
-                    participant_count=%s
-                WHERE id=%s
+                SELECT id FROM info_submissions
+                WHERE family_id=%s AND user_id=%s AND meal_date=%s AND meal_type=%s
+                ORDER BY id DESC LIMIT 1
+                FOR UPDATE
                 """,
-                (
-                    request.role,
-                    request.display_name,
-                    request.age,
-                    request.meal_date,
-                    request.meal_type,
-                    json.dumps(request.preferences, ensure_ascii=False),
-                    request.drinks,
-                    request.remark,
-                    meal_code_value,
-                    request.participant_count or 1,
-                    existed[0]["id"],
-                ),
-            )
-        else:
-            db_execute(
-                """
-                INSERT INTO info_submissions
-                    (family_id,user_id,role,display_name,age,meal_date,meal_type,preferences,drinks,remark,meal_code,participant_count)
-                VALUES
-                    (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """,
-                (
-                    request.family_id,
-                    request.user_id,
-                    request.role,
-                    request.display_name,
-                    request.age,
-                    request.meal_date,
-                    request.meal_type,
-                    json.dumps(request.preferences, ensure_ascii=False),
-                    request.drinks,
-                    request.remark,
-                    meal_code_value,
-                    request.participant_count or 1,
-                ),
+                (request.family_id, request.user_id, request.meal_date, request.meal_type),
             )
 
+            # Không còn dùng meal_code -> để None (hoặc '' nếu cột NOT NULL)
+            meal_code_value = ""
+
+            if existed:
+                tx.execute(
+                    """
+                    UPDATE info_submissions
+                    SET role=%s,
+                        display_name=%s,
+                        age=%s,
+                        meal_date=%s,
+                        meal_type=%s,
+                        preferences=%s,
+                        drinks=%s,
+                        remark=%s,
+                        meal_code=%s,
+                        participant_count=%s
+                    WHERE id=%s
+                    """,
+                    (
+                        request.role,
+                        request.display_name,
+                        request.age,
+                        request.meal_date,
+                        request.meal_type,
+                        json.dumps(request.preferences, ensure_ascii=False),
+                        request.drinks,
+                        request.remark,
+                        meal_code_value,
+                        request.participant_count or 1,
+                        existed[0]["id"],
+                    ),
+                )
+            else:
+                tx.execute(
+                    """
+                    INSERT INTO info_submissions
+                        (family_id,user_id,role,display_name,age,meal_date,meal_type,preferences,drinks,remark,meal_code,participant_count)
+                    VALUES
+                        (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                    """,
+                    (
+                        request.family_id,
+                        request.user_id,
+                        request.role,
+                        request.display_name,
+                        request.age,
+                        request.meal_date,
+                        request.meal_type,
+                        json.dumps(request.preferences, ensure_ascii=False),
+                        request.drinks,
+                        request.remark,
+                        meal_code_value,
+                        request.participant_count or 1,
+                    ),
+                )
+
         return {"ok": True, "message": "Information submitted successfully"}
     except HTTPException:
         raise
@@ -6,13 +6,19 @@ Wheel routes (shared state in DB)
 - User cannot vote their own dishes.
 - Toggle vote (vote/unvote) as long as votes_used < ballots.
 - State returns candidates with total votes + voters, and user summary.
+- Realtime: WebSocket /ws theo phiên; mỗi lần ghi (nominate/vote/edit/delete/pick)
+  push delta cho các client đang nghe thay vì để họ poll /state.
 """
 import logging
 from typing import Dict, Any, List, Optional
 
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from ..cache import LRUTTLCache
 from ..database import db_query, db_execute
+from ..realtime import hub
 from ..utils import log_api_call, log_error
+from ..wheel_snapshot import load_wheel_snapshot, find_candidate, user_summary
 
 logger = logging.getLogger("meal")
 router = APIRouter(tags=["wheel"])
@@ -21,6 +27,44 @@ router = APIRouter(tags=["wheel"])
 
 SESSION_WHERE = "family_id=%s AND meal_date=%s AND meal_type=%s"
 
+# Snapshot phiên trong RAM: bị xoá ở mỗi lần ghi; TTL ngắn phòng khi worker khác ghi
+_SNAPSHOTS = LRUTTLCache(maxsize=512, ttl=5)
+
+
+def _session_key(family_id: str, meal_date, meal_type: str) -> str:
+    return f"wheel:{family_id}:{str(meal_date)[:10]}:{(meal_type or '').lower()}"
+
+
+def _cached_snapshot(family_id: str, meal_date: str, meal_type: str) -> Dict[str, Any]:
+    key = _session_key(family_id, meal_date, meal_type)
+    snap = _SNAPSHOTS.get(key)
+    if snap is None:
+        snap = load_wheel_snapshot(family_id, meal_date, meal_type)
+        _SNAPSHOTS.set(key, snap)
+    return snap
+
+
+def _publish_change(family_id: str, meal_date, meal_type: str, event: Dict[str, Any],
+                    candidate_id=None) -> None:
+    """
+    Sau mỗi lần ghi: bỏ snapshot cũ; nếu có client WebSocket đang nghe phiên này thì
+    load lại 1 lần (dùng luôn làm cache) và push delta kèm candidate mới nhất.
+    """
+    key = _session_key(family_id, meal_date, meal_type)
+    _SNAPSHOTS.delete(key)
+    if not hub.has_subscribers(key):
+        return
+    try:
+        if candidate_id is not None:
+            snap = load_wheel_snapshot(family_id, str(meal_date)[:10], meal_type)
+            _SNAPSHOTS.set(key, snap)
+            cand = find_candidate(snap, candidate_id)
+            if cand is not None:
+                event = dict(event, candidate=_format_candidate(cand))
+        hub.publish(key, event)
+    except Exception as e:
+        logger.warning("wheel publish failed (%s): %s", key, e)
+
 
 def _user_ballots(family_id: str, meal_date: str, meal_type: str, user_id: str) -> int:
     """
@@ -32,66 +76,33 @@ def _user_ballots(family_id: str, meal_date: str, meal_type: str, user_id: str)
             FROM wheel_candidates
             WHERE {SESSION_WHERE} AND proposer_user_id=%s AND deleted_at IS NULL""",
         (family_id, meal_date, meal_type, user_id),
+        prepared=True,
     )
     return int(rows[0]["cnt"]) if rows else 0
 
 
-def _user_voted_ids(family_id: str, meal_date: str, meal_type: str, user_id: str) -> List[int]:
-    rows = db_query(
-        f"""SELECT v.candidate_id
-            FROM wheel_votes v
-            JOIN wheel_candidates c ON c.id = v.candidate_id
-            WHERE c.{SESSION_WHERE}
-              AND v.voter_user_id = %s
-              AND c.deleted_at IS NULL""",
-        (family_id, meal_date, meal_type, user_id),
-    )
-    return [int(r["candidate_id"]) for r in rows]
-
-
-def _load_candidates(family_id: str, meal_date: str, meal_type: str) -> List[Dict[str, Any]]:
+def _load_candidates(family_id: str, meal_date: str, meal_type: str,
+                     snapshot: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
-    Lấy all candidates đang active + tổng votes + voters.
-    (Dùng bảng thật để có voters; có thể dùng view để nhẹ hơn nếu cần)
+    Lấy all candidates đang active + tổng votes + voters (từ snapshot 1 query).
+    Sắp xếp votes giảm dần, id tăng dần.
     """
-    cands = db_query(
-        f"""SELECT c.id,
-                   c.name,
-                   c.proposer_user_id,
-                   c.proposer_name,
-                   (SELECT COUNT(*) FROM wheel_votes v WHERE v.candidate_id = c.id) AS votes
-            FROM wheel_candidates c
-            WHERE {SESSION_WHERE} AND c.deleted_at IS NULL
-            ORDER BY votes DESC, c.id ASC""",
-        (family_id, meal_date, meal_type),
-    )
-    if not cands:
-        return []
-
-    ids = [int(c["id"]) for c in cands]
-    voters_map: Dict[int, List[str]] = {cid: [] for cid in ids}
-    if ids:
-        placeholders = ",".join(["%s"] * len(ids))
-        rows = db_query(
-            f"SELECT candidate_id, voter_user_id FROM wheel_votes WHERE candidate_id IN ({placeholders})",
-            tuple(ids),
-        )
-        for r in rows:
-            voters_map[int(r["candidate_id"])].append(r["voter_user_id"])
-
-    result = []
-    for c in cands:
-        result.append(
-            {
-                "id": str(c["id"]),
-                "name": c["name"],
-                "votes": int(c["votes"] or 0),
-                "proposer": c["proposer_user_id"],
-                "proposer_name": c["proposer_name"],
-                "voters": voters_map.get(int(c["id"]), []),
-            }
-        )
-    return result
+    if snapshot is None:
+        snapshot = load_wheel_snapshot(family_id, meal_date, meal_type)
+    cands = sorted(snapshot["candidates"], key=lambda c: (-c["votes"], c["id"]))
+    return [_format_candidate(c) for c in cands]
+
+
+def _format_candidate(c: Dict[str, Any]) -> Dict[str, Any]:
+    """Candidate trong snapshot -> dạng FE dùng (/state và WebSocket)."""
+    return {
+        "id": str(c["id"]),
+        "name": c["name"],
+        "votes": c["votes"],
+        "proposer": c["proposer_user_id"],
+        "proposer_name": c["proposer_name"],
+        "voters": list(c["voters"]),
+    }
 
 
 # ---------- endpoints ----------
@@ -112,16 +123,10 @@ def get_state(
     """
     try:
         log_api_call("/wheel/state", "GET", user_id)
-        candidates = _load_candidates(family_id, meal_date, meal_type)
-        resp: Dict[str, Any] = {"candidates": candidates}
+        snapshot = _cached_snapshot(family_id, meal_date, meal_type)
+        resp: Dict[str, Any] = {"candidates": _load_candidates(family_id, meal_date, meal_type, snapshot)}
         if user_id:
-            ballots = _user_ballots(family_id, meal_date, meal_type, user_id)
-            voted_ids = _user_voted_ids(family_id, meal_date, meal_type, user_id)
-            resp["user_summary"] = {
-                "ballots": ballots,
-                "votes_used": len(voted_ids),
-                "voted_candidate_ids": [str(i) for i in voted_ids],
-            }
+            resp["user_summary"] = user_summary(snapshot, user_id)
         return resp
     except Exception as e:
         log_error(e, "wheel.get_state")
@@ -158,7 +163,7 @@ def nominate(payload: Dict[str, Any] = Body(...)):
             raise HTTPException(400, "You can add at most 2 dishes for this time")
 
         # lấy proposer_name
-        u = db_query("SELECT user_name FROM users WHERE user_id=%s", (user_id,))
+        u = db_query("SELECT user_name FROM users WHERE user_id=%s", (user_id,), prepared=True)
         proposer_name = u[0]["user_name"] if u else user_id
 
         # kiểm tra trùng tên đang active trong cùng phiên
@@ -167,6 +172,7 @@ def nominate(payload: Dict[str, Any] = Body(...)):
                WHERE family_id=%s AND meal_date=%s AND meal_type=%s
                  AND name=%s AND deleted_at IS NULL""",
             (family_id, meal_date, meal_type, dish),
+            prepared=True,
         )
         if exists:
             raise HTTPException(409, "This dish already exists in the current list")
@@ -177,6 +183,7 @@ def nominate(payload: Dict[str, Any] = Body(...)):
                VALUES (%s,%s,%s,%s,%s,%s)""",
             (family_id, meal_date, meal_type, dish, user_id, proposer_name),
         )
+        _publish_change(family_id, meal_date, meal_type, {"type": "candidate_added"}, candidate_id=new_id)
         return {"ok": True, "candidate_id": str(new_id)}
     except HTTPException:
         raise
@@ -206,37 +213,34 @@ def vote_toggle(payload: Dict[str, Any] = Body(...)):
 
         log_api_call("/wheel/vote", "POST", user_id)
 
-        # xác thực candidate thuộc phiên, chưa bị delete
-        cand = db_query(
-            f"""SELECT id, proposer_user_id
-                FROM wheel_candidates
-                WHERE id=%s AND {SESSION_WHERE} AND deleted_at IS NULL""",
-            (candidate_id, family_id, meal_date, meal_type),
-        )
+        # 1 snapshot: xác thực candidate thuộc phiên (chưa bị delete) + ballots + votes đã dùng
+        snapshot = load_wheel_snapshot(family_id, meal_date, meal_type)
+        cand = find_candidate(snapshot, candidate_id)
         if not cand:
             raise HTTPException(404, "Candidate not found")
-        cand = cand[0]
 
         if cand["proposer_user_id"] == user_id:
             raise HTTPException(400, "You cannot vote your own dish")
 
-        ballots = _user_ballots(family_id, meal_date, meal_type, user_id)
-        voted_ids = _user_voted_ids(family_id, meal_date, meal_type, user_id)
-        already = int(candidate_id) in voted_ids
+        summary = user_summary(snapshot, user_id)
+        ballots = summary["ballots"]
+        already = user_id in cand["voters"]
 
         if already:
             db_execute(
                 "DELETE FROM wheel_votes WHERE candidate_id=%s AND voter_user_id=%s",
                 (candidate_id, user_id),
             )
+            _publish_change(family_id, meal_date, meal_type, {"type": "votes"}, candidate_id=candidate_id)
             return {"ok": True, "action": "unvote"}
         else:
-            if len(voted_ids) >= ballots:
+            if summary["votes_used"] >= ballots:
                 raise HTTPException(400, "No ballots left")
             db_execute(
                 "INSERT INTO wheel_votes (candidate_id, voter_user_id) VALUES (%s,%s)",
                 (candidate_id, user_id),
             )
+            _publish_change(family_id, meal_date, meal_type, {"type": "votes"}, candidate_id=candidate_id)
             return {"ok": True, "action": "vote"}
     except HTTPException:
         raise
@@ -276,6 +280,8 @@ def edit_candidate(candidate_id: int, payload: Dict[str, Any] = Body(...)):
             raise HTTPException(409, "This dish name already exists in this list")
 
         db_execute("UPDATE wheel_candidates SET name=%s WHERE id=%s", (name, candidate_id))
+        _publish_change(row[0]["family_id"], row[0]["meal_date"], row[0]["meal_type"],
+                        {"type": "candidate_updated"}, candidate_id=candidate_id)
         return {"ok": True}
     except HTTPException:
         raise
@@ -292,13 +298,18 @@ def delete_candidate(candidate_id: int, user_id: str = Query(...)):
     try:
         log_api_call(f"/wheel/candidate/{candidate_id}", "DELETE", user_id)
 
-        row = db_query("SELECT proposer_user_id FROM wheel_candidates WHERE id=%s", (candidate_id,))
+        row = db_query(
+            "SELECT proposer_user_id, family_id, meal_date, meal_type FROM wheel_candidates WHERE id=%s",
+            (candidate_id,),
+        )
         if not row:
             raise HTTPException(404, "Candidate not found")
         if row[0]["proposer_user_id"] != user_id:
             raise HTTPException(403, "Only proposer can delete this dish")
 
         db_execute("DELETE FROM wheel_candidates WHERE id=%s", (candidate_id,))
+        _publish_change(row[0]["family_id"], row[0]["meal_date"], row[0]["meal_type"],
+                        {"type": "candidate_removed", "candidate_id": str(candidate_id)})
         return {"ok": True}
     except HTTPException:
         raise
@@ -340,6 +351,8 @@ def save_pick(payload: Dict[str, Any] = Body(...)):
             else:
                 raise
 
+        _publish_change(family_id, meal_date, meal_type,
+                        {"type": "picked", "winner_name": winner_name, "picked_by": picked_by})
         return {"ok": True}
     except HTTPException:
         raise
@@ -378,3 +391,31 @@ def get_latest_pick(
         raise HTTPException(500, "Internal server error")
 
 
+@router.websocket("/ws")
+async def wheel_ws(
+    websocket: WebSocket,
+    family_id: str = Query(...),
+    meal_date: str = Query(...),
+    meal_type: str = Query(...),
+):
+    """
+    WebSocket theo phiên wheel. Khi nối: gửi {"type":"state","candidates":[...]};
+    sau đó nhận delta: candidate_added / candidate_updated / candidate_removed / votes / picked.
+    Client không cần gửi gì (có thể gửi "ping" để giữ kết nối).
+    """
+    key = _session_key(family_id, meal_date, meal_type)
+    await hub.connect(key, websocket)
+    try:
+        snap = await run_in_threadpool(_cached_snapshot, family_id, meal_date, meal_type)
+        await websocket.send_json({
+            "type": "state",
+            "candidates": _load_candidates(family_id, meal_date, meal_type, snap),
+        })
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        log_error(e, "wheel.ws")
+    finally:
+        hub.disconnect(key, websocket)
@@ -0,0 +1,79 @@
+"""
+Wheel session snapshot loader (shared by routes/wheel.py and routes/plan.py)
+
+1 query LEFT JOIN wheel_candidates × wheel_votes cho 1 phiên (family_id, meal_date, meal_type)
+-> candidates + votes + voters; user summary (ballots / votes_used) tính từ chính snapshot.
+"""
+from typing import Any, Dict, List, Optional
+
+from .database import db_query
+
+
+def load_wheel_snapshot(family_id: str, meal_date: str, meal_type: str) -> Dict[str, Any]:
+    """
+    Trả về:
+    {
+      "candidates": [{id:int, name, votes, proposer_user_id, proposer_name, voters:[...]}]  // id ASC
+    }
+    Chỉ tính ứng viên đang active (deleted_at IS NULL).
+    """
+    rows = db_query(
+        """
+        SELECT c.id,
+               c.name,
+               c.proposer_user_id,
+               c.proposer_name,
+               v.voter_user_id
+        FROM wheel_candidates c
+        LEFT JOIN wheel_votes v ON v.candidate_id = c.id
+        WHERE c.family_id=%s AND c.meal_date=%s AND c.meal_type=%s AND c.deleted_at IS NULL
+        ORDER BY c.id ASC
+        """,
+        (family_id, meal_date, meal_type),
+        prepared=True,
+    )
+
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for r in rows or []:
+        cid = int(r["id"])
+        cand = by_id.get(cid)
+        if cand is None:
+            cand = by_id[cid] = {
+                "id": cid,
+                "name": r["name"],
+                "votes": 0,
+                "proposer_user_id": r.get("proposer_user_id"),
+                "proposer_name": r.get("proposer_name"),
+                "voters": [],
+            }
+        if r.get("voter_user_id") is not None:
+            cand["voters"].append(r["voter_user_id"])
+            cand["votes"] += 1
+
+    return {"candidates": list(by_id.values())}
+
+
+def find_candidate(snapshot: Dict[str, Any], candidate_id) -> Optional[Dict[str, Any]]:
+    try:
+        cid = int(candidate_id)
+    except (TypeError, ValueError):
+        return None
+    for c in snapshot["candidates"]:
+        if c["id"] == cid:
+            return c
+    return None
+
+
+def user_summary(snapshot: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """
+    ballots = số dish user đã đề cử trong phiên (≤ 2 ở tầng business);
+    voted_candidate_ids = các ứng viên user đã vote.
+    """
+    cands: List[Dict[str, Any]] = snapshot["candidates"]
+    ballots = sum(1 for c in cands if c["proposer_user_id"] == user_id)
+    voted = [c["id"] for c in cands if user_id in c["voters"]]
+    return {
+        "ballots": ballots,
+        "votes_used": len(voted),
+        "voted_candidate_ids": [str(i) for i in voted],
+    }
@@ -0,0 +1,4 @@
+"""
+pytest: thư mục này (2850/) được thêm vào sys.path -> tests import được package `app`.
+Chạy từ 2850/:  python -m pytest -q
+"""
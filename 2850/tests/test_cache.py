@@ -0,0 +1,94 @@
+"""app/cache.py: LRU/TTL trong RAM, TieredCache + SQLiteStore (đọc lại, dòng hỏng, sweep)."""
+import time
+
+import pytest
+
+from app import cache
+from app.cache import LRUTTLCache, SQLiteStore, TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() giả trong app.cache, tua bằng clock.advance(giây)."""
+    class Clock:
+        now = 1_000_000.0
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    c = Clock()
+    monkeypatch.setattr(cache.time, "time", lambda: c.now)
+    return c
+
+
+def test_lru_evicts_least_recently_used():
+    c = LRUTTLCache(maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1          # a mới dùng -> b là LRU
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1 and c.get("c") == 3
+    assert len(c) == 2
+
+
+def test_lru_ttl_expiry(clock):
+    c = LRUTTLCache(maxsize=10, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2, ttl=300)
+    clock.advance(61)
+    assert c.get("a", "gone") == "gone"
+    assert c.get("b") == 2
+
+
+def test_tiered_reads_back_from_store(tmp_path):
+    store = SQLiteStore(tmp_path / "c.sqlite3")
+    t = TieredCache("ns", maxsize=10, ttl=3600, store=store)
+    t.set("k", {"x": [1, 2]})
+    t.memory.clear()
+    assert t.get("k") == {"x": [1, 2]}
+    assert t.store_hits == 1
+    assert t.get("k") == {"x": [1, 2]}
+    assert t.hits == 1
+
+
+def test_tiered_corrupt_store_row_is_a_miss(tmp_path):
+    store = SQLiteStore(tmp_path / "c.sqlite3")
+    t = TieredCache("ns", maxsize=10, ttl=3600, store=store)
+    store.set("ns", "k", '{"truncated": ', None)
+    assert t.get("k", "miss") == "miss"
+    assert store.get("ns", "k") is None     # dòng hỏng đã bị xoá
+    assert t.misses == 1
+
+
+def test_sqlite_sweep_drops_expired_and_lru_rows(tmp_path, clock):
+    store = SQLiteStore(tmp_path / "c.sqlite3")
+    store.set("ns", "old", '"o"', None)
+    clock.advance(1)
+    store.set("ns", "expiring", '"e"', clock.now + 10)
+    clock.advance(1)
+    store.set("ns", "mid", '"m"', None)
+    clock.advance(1)
+    store.set("ns", "new", '"n"', None)
+    store.set("other", "x", '"x"', None)
+    clock.advance(1)
+    assert store.get("ns", "old") == '"o"'  # dùng lại -> không còn là LRU
+
+    clock.advance(20)
+    removed = store.sweep("ns", max_rows=2)
+    assert removed == 2                     # "expiring" hết hạn + "mid" là LRU
+    assert store.get("ns", "old") == '"o"'
+    assert store.get("ns", "new") == '"n"'
+    assert store.get("ns", "mid") is None
+    assert store.get("other", "x") == '"x"'  # namespace khác không bị đụng
+
+
+def test_tiered_sweeps_store_periodically(tmp_path, monkeypatch):
+    store = SQLiteStore(tmp_path / "c.sqlite3")
+    t = TieredCache("ns", maxsize=100, ttl=3600, store=store, max_rows=3)
+    monkeypatch.setattr(t, "SWEEP_EVERY_SETS", 5)
+    for i in range(5):
+        t.set(f"k{i}", i)
+        time.sleep(0.002)
+    assert t.evicted == 2
+    assert store.get("ns", "k0") is None and store.get("ns", "k4") == "4"
@@ -0,0 +1,110 @@
+"""
+db_transaction(): mọi câu lệnh trong khối commit 1 lần, exception -> không dòng nào được ghi.
+
+Connection giả chạy trên SQLite ở chế độ autocommit (isolation_level=None) giống session MySQL
+của pool: nếu db_transaction() không mở transaction thật thì từng câu đã được ghi ngay.
+"""
+import sqlite3
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+from app import database  # noqa: E402
+
+
+class _Cursor:
+    def __init__(self, raw, dictionary=False):
+        self._cur = raw.cursor()
+        self._dictionary = dictionary
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self._cur.execute(sql.replace("%s", "?"), params)
+        self.lastrowid = self._cur.lastrowid
+        self.rowcount = self._cur.rowcount
+
+    def executemany(self, sql, rows):
+        self._cur.executemany(sql.replace("%s", "?"), rows)
+        self.rowcount = self._cur.rowcount
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        if not self._dictionary:
+            return rows
+        cols = [d[0] for d in self._cur.description]
+        return [dict(zip(cols, r)) for r in rows]
+
+    def close(self):
+        self._cur.close()
+
+
+class _Connection:
+    """Chỉ các method db_transaction()/Transaction dùng; autocommit gán vào đây không có tác dụng."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.closed = False
+
+    def start_transaction(self):
+        self._raw.execute("BEGIN")
+
+    def cursor(self, dictionary=False, **_):
+        return _Cursor(self._raw, dictionary)
+
+    def commit(self):
+        if self._raw.in_transaction:
+            self._raw.execute("COMMIT")
+
+    def rollback(self):
+        if self._raw.in_transaction:
+            self._raw.execute("ROLLBACK")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def conns(monkeypatch):
+    """Các connection giả đã cho mượn; conns.raw = DB SQLite dùng chung."""
+    raw = sqlite3.connect(":memory:", isolation_level=None)
+    raw.execute("CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+    lent = _Lent()
+    lent.raw = raw
+
+    def get_connection():
+        conn = _Connection(raw)
+        lent.append(conn)
+        return conn
+
+    monkeypatch.setattr(database, "get_connection", get_connection)
+    yield lent
+    raw.close()
+
+
+class _Lent(list):
+    raw = None
+
+
+def _names(lent):
+    return [r[0] for r in lent.raw.execute("SELECT name FROM items ORDER BY id")]
+
+
+def test_exception_rolls_back_every_statement(conns):
+    with pytest.raises(RuntimeError):
+        with database.db_transaction() as tx:
+            tx.execute("INSERT INTO items (name) VALUES (%s)", ("a",))
+            tx.executemany("INSERT INTO items (name) VALUES (%s)", [("b",), ("c",)])
+            raise RuntimeError("boom")
+    assert _names(conns) == []
+    assert conns and all(c.closed for c in conns)
+
+
+def test_commit_keeps_all_statements(conns):
+    with database.db_transaction() as tx:
+        new_id = tx.execute("INSERT INTO items (name) VALUES (%s)", ("a",))
+        tx.execute("INSERT INTO items (name) VALUES (%s)", ("b",))
+        assert tx.query("SELECT name FROM items WHERE id = %s", (new_id,)) == [{"name": "a"}]
+    assert _names(conns) == ["a", "b"]
+    assert conns and all(c.closed for c in conns)
@@ -0,0 +1,65 @@
+"""app/jobs.py: SingleFlight gộp coroutine trùng key, chia sẻ kết quả lẫn exception."""
+import asyncio
+
+import pytest
+
+from app.jobs import SingleFlight
+
+
+def test_concurrent_callers_share_one_run():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"plan": len(calls)}
+
+    async def main():
+        sf = SingleFlight()
+        results = await asyncio.gather(*(sf.run("k", work) for _ in range(5)))
+        other = await sf.run("other", work)
+        return sf, results, other
+
+    sf, results, other = asyncio.run(main())
+    assert results == [{"plan": 1}] * 5
+    assert other == {"plan": 2}
+    assert len(calls) == 2
+    assert sf._inflight == {}
+
+
+def test_exception_reaches_every_caller_and_key_is_released():
+    calls = []
+
+    async def boom():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("llm down")
+
+    async def main():
+        sf = SingleFlight()
+        results = await asyncio.gather(*(sf.run("k", boom) for _ in range(3)), return_exceptions=True)
+        again = await asyncio.gather(sf.run("k", boom), return_exceptions=True)
+        return results, again
+
+    results, again = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert isinstance(again[0], RuntimeError)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_run():
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        sf = SingleFlight()
+        first = asyncio.ensure_future(sf.run("k", work))
+        second = asyncio.ensure_future(sf.run("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
@@ -0,0 +1,68 @@
+"""app/plan_codec.py: envelope nén, key bị MySQL sắp xếp lại, dữ liệu cũ, ngưỡng min_size."""
+import json
+
+import pytest
+
+from app import plan_codec
+from app.plan_codec import CODEC_KEY, decode_json, decode_text, encode, is_encoded
+
+BIG_PLAN = {"days": [{"day": d, "meals": ["Phở bò", "Cơm tấm", "Bún chả"] * 20} for d in range(7)]}
+
+
+@pytest.fixture(autouse=True)
+def zlib_codec(monkeypatch):
+    monkeypatch.setitem(plan_codec.PLAN_CODEC_CONFIG, "codec", "z1")
+    monkeypatch.setitem(plan_codec.PLAN_CODEC_CONFIG, "min_size", 512)
+
+
+def test_large_payload_round_trips_through_envelope():
+    stored = encode(BIG_PLAN)
+    env = json.loads(stored)
+    assert env[CODEC_KEY] == "z1"
+    assert len(stored) < len(json.dumps(BIG_PLAN, ensure_ascii=False).encode("utf-8"))
+    assert is_encoded(stored)
+    assert decode_json(stored) == BIG_PLAN
+
+
+def test_envelope_with_keys_reordered_by_mysql_json_column():
+    env = json.loads(encode(BIG_PLAN))
+    reordered = json.dumps({"data": env["data"], CODEC_KEY: env[CODEC_KEY]})
+    assert is_encoded(reordered)
+    assert decode_json(reordered) == BIG_PLAN
+
+
+def test_small_payload_is_stored_as_plain_json():
+    small = {"days": [{"day": 0, "meals": ["Phở"]}]}
+    stored = encode(small)
+    assert not is_encoded(stored)
+    assert json.loads(stored) == small
+    assert decode_json(stored) == small
+
+
+def test_legacy_rows_pass_through():
+    legacy = json.dumps(BIG_PLAN, ensure_ascii=False)
+    assert decode_text(legacy) == legacy
+    assert decode_text(legacy.encode("utf-8")) == legacy
+    assert decode_text("raw model output") == "raw model output"
+    # Có "_codec" nhưng không đúng dạng envelope -> giữ nguyên
+    odd = json.dumps({CODEC_KEY: "z1", "data": "x", "extra": 1})
+    assert decode_text(odd) == odd
+
+
+def test_empty_and_none():
+    assert encode(None) is None
+    assert decode_text(None) is None
+    assert decode_json(None, default=[]) == []
+    assert decode_json("", default={}) == {}
+
+
+def test_codec_none_disables_compression(monkeypatch):
+    monkeypatch.setitem(plan_codec.PLAN_CODEC_CONFIG, "codec", "none")
+    stored = encode(BIG_PLAN)
+    assert not is_encoded(stored)
+    assert decode_json(stored) == BIG_PLAN
+
+
+def test_already_encoded_value_is_not_wrapped_twice():
+    stored = encode(BIG_PLAN)
+    assert encode(stored) == stored